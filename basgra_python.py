@@ -8,10 +8,9 @@ import os
 import ctypes as ct
 import numpy as np
 import pandas as pd
-from subprocess import Popen
-from copy import deepcopy
+from subprocess import Popen, PIPE, STDOUT, DEVNULL
 from input_output_keys import param_keys, out_cols, days_harvest_keys, matrix_weather_keys_pet, \
-    matrix_weather_keys_penman
+    matrix_weather_keys_penman, weather_delta_keys, event_log_keys, state_keys, farm_out_keys
 from warnings import warn
 
 # compiled with gfortran 64,
@@ -21,17 +20,60 @@ from warnings import warn
 # define the dll library path
 _libpath_pet = os.path.join(os.path.dirname(__file__), 'fortran_BASGRA_NZ/BASGRA_pet.DLL')
 _libpath_peyman = os.path.join(os.path.dirname(__file__), 'fortran_BASGRA_NZ/BASGRA_peyman.DLL')
+_libpath_pet_single = os.path.join(os.path.dirname(__file__), 'fortran_BASGRA_NZ/BASGRA_pet_single.DLL')
+_libpath_peyman_single = os.path.join(os.path.dirname(__file__), 'fortran_BASGRA_NZ/BASGRA_peyman_single.DLL')
 
 #_libpath_pet = r"C:\Users\BTHRO\OneDrive\Documents\GitHub\BASGRA_NZ_PY\fortran_BASGRA_NZ\BASGRA_pet.DLL"
 #_libpath_peyman = r"C:\Users\BTHRO\OneDrive\Documents\GitHub\BASGRA_NZ_PY\fortran_BASGRA_NZ\BASGRA_peyman.DLL"
 _bat_path = os.path.join(os.path.dirname(__file__), 'fortran_BASGRA_NZ\\compile_BASGRA_gfortran.bat')
+# the fortran code, the default dlls are rebuilt if they are older than it, see _get_dll_path
+_fortran_dir = os.path.join(os.path.dirname(__file__), 'fortran_BASGRA_NZ')
+# the default dlls that have been checked against the fortran code in this process
+_checked_dlls = set()
 # this is the maximum number of weather days,
 # it is hard coded into fortran_BASGRA_NZ/environment.f95 line 9
 _max_weather_size = 36600
 
+# columns of the sparse harvest events passed to fortran
+_harvest_event_cols = ('day',) + days_harvest_keys[2:]
+
+# kinds of stop condition and their fortran codes, see fortran_BASGRA_NZ/basgraf.f95 BASGRA_BATCH
+_stop_kinds = {'below': 1, 'above': 2, 'total_above': 3}
+
+# the event log records, the event codes from fortran are 1 based indices of event_log_keys
+event_log_dtype = np.dtype([('run', np.int32), ('day', np.int32), ('event', 'U10'), ('values', float, (4,))])
+
+# the codes of the input errors found by fortran BASGRA_VALIDATE (see validate_inputs): the input and the message
+input_error_codes = {
+    1: ('params', 'params cannot have na data'),
+    2: ('params', 'harvest delay must be >=1 and effectively an integer'),
+    3: ('matrix_weather', 'matrix_weather cannot have na values'),
+    4: ('matrix_weather', 'year and doy must be integers and doy a day of the year in matrix_weather'),
+    5: ('matrix_weather', 'the date range of matrix_weather contains missing or duplicate days'),
+    6: ('matrix_weather', 'all sets must have the same year and doy in matrix_weather'),
+    7: ('harvest_events', 'days_harvest cannot have na data'),
+    8: ('harvest_events', 'frac_harv must be between 0 and 1'),
+    9: ('harvest_events', 'harvest days must be increasing days of the simulation (0 for padding at the end)'),
+    10: ('doy_irr', 'entries doy_irr must be between 0 and 366'),
+    11: ('params', 'HAGERE must be between 0 and 1'),
+}
+
+# the error records of validate_inputs, set and index are zero based (-1 if there is no index)
+input_error_dtype = np.dtype([('code', np.int32), ('input', 'U14'), ('set', np.int32), ('index', np.int32),
+                              ('message', 'U100')])
+
+# ctypes pointer types of the fortran arguments
+_c_double_p = ct.POINTER(ct.c_double)
+_c_float_p = ct.POINTER(ct.c_float)
+_c_int_p = ct.POINTER(ct.c_int)
+
+# the numpy dtype of the reals of each dll loaded so far, see _real_dtype
+_dll_real_dtypes = {}
+
 
 def run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=False,
-                  dll_path='default', supply_pet=True, auto_harvest=False):
+                  dll_path='default', supply_pet=True, auto_harvest=False, weather_deltas=None, stop_conditions=None,
+                  event_log=False):
     """
     python wrapper for the fortran BASGRA code
     changes to the fortran code may require changes to this function
@@ -49,19 +91,726 @@ def run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=False,
     :param verbose: boolean, if True the fortran function prints a number of statements for debugging purposes
                    (depreciated)
     :param dll_path: path to the compiled fortran DLL to use, default was made on windows 10 64 bit, if the path does
-                     not exist, this function will try to run the bat file to re-make the dll.
+                     not exist, this function will try to run the bat file to re-make the dll.  'single' uses the
+                     single precision (float32) DLLs, which are faster for large ensembles and return float32
+                     output, see README.md for the precision given up
     :param supply_pet: boolean, if True BASGRA expects pet to be supplied, if False the parameters required to
                        calculate pet from the peyman equation are expected,
                        the version must match the DLL if dll_path != 'default'
     :param auto_harvest: boolean, if True then assumes data is formated correctly for auto harvesting, if False, then
                          assumes data is formatted for manual harvesting (e.g. previous version) and re-formats
                          internally
-    :return:
+    :param weather_deltas: None or dictionary of climate change deltas which are applied to the weather inside
+                           BASGRA as it is read (weather * {var}_mult + {var}_add), keys are from
+                           input_output_keys.weather_delta_keys and values are either a single value or 12 monthly
+                           values (Jan-Dec), missing keys have no effect. see README.md
+    :param stop_conditions: None or a list of conditions on the output variables which end the run early, e.g. to
+                            skip the rest of a screening run, see _pack_stop_conditions and README.md. the run stops
+                            at the end of the first day a condition is met and the output after that day is nan
+    :param event_log: boolean, if True also return the harvest, reseed and irrigation events of the run as a
+                      structured array (event_log_dtype), see event_log_frame and README.md
+    :return: output dataframe, or if stop_conditions is passed and/or event_log is True a tuple of
+             (output dataframe, stop, events) without the items that were not asked for, where:
+             stop: None if the run was not stopped or a dictionary of {'date': the date it stopped,
+                   'condition': the index of the condition in stop_conditions}
+             events: structured array of the events in the order they happened
     """
+    dll_path, params, matrix_weather, harvest_events, doy_irr, out_index = _prep_site_inputs(
+        params, matrix_weather, days_harvest, doy_irr, verbose, dll_path, supply_pet, auto_harvest)
+    weather_deltas = _pack_weather_deltas(weather_deltas, supply_pet)
+    stops = _pack_stop_conditions(stop_conditions)
 
-    assert isinstance(supply_pet, bool), 'supply_pet param must be boolean'
-    assert isinstance(auto_harvest, bool), 'auto_harvest param must be boolean'
+    y, stop_info, events = _run_basgra_batch(dll_path, params[np.newaxis], matrix_weather[np.newaxis],
+                                             harvest_events[np.newaxis], doy_irr[np.newaxis],
+                                             weather_deltas[np.newaxis], np.zeros((1, 5), int), verbose, stops=stops,
+                                             event_log=event_log)
+
+    out = _format_output(y[0], out_index)
+    extras = []
+    if stop_conditions is not None:
+        extras.append(_format_stop(stop_info[0], out.index))
+    if event_log:
+        extras.append(events)
+    if len(extras) == 0:
+        return out
+    return (out,) + tuple(extras)
+
+
+def run_basgra_nz_deltas(params, matrix_weather, days_harvest, doy_irr, scenarios, verbose=False,
+                         dll_path='default', supply_pet=True, auto_harvest=False, stop_conditions=None):
+    """
+    run BASGRA for one site under a number of climate change delta scenarios.  The weather is passed to fortran once
+    and each scenario's deltas are applied as the weather is read, so no weather data is copied per scenario.
+    :param params: see run_basgra_nz
+    :param matrix_weather: see run_basgra_nz
+    :param days_harvest: see run_basgra_nz
+    :param doy_irr: see run_basgra_nz
+    :param scenarios: dictionary of {scenario name: weather_deltas}, see run_basgra_nz for the weather_deltas
+    :param verbose: see run_basgra_nz
+    :param dll_path: see run_basgra_nz
+    :param supply_pet: see run_basgra_nz
+    :param auto_harvest: see run_basgra_nz
+    :param stop_conditions: see run_basgra_nz, applied to each scenario
+    :return: dictionary of {scenario name: output dataframe}, or if stop_conditions is passed (that dictionary,
+             dictionary of {scenario name: stop}), see run_basgra_nz for stop
+    """
+    assert isinstance(scenarios, dict), 'scenarios must be a dictionary'
+    assert len(scenarios) > 0, 'scenarios must not be empty'
+    dll_path, params, matrix_weather, harvest_events, doy_irr, out_index = _prep_site_inputs(
+        params, matrix_weather, days_harvest, doy_irr, verbose, dll_path, supply_pet, auto_harvest)
+    names = list(scenarios.keys())
+    weather_deltas = np.stack([_pack_weather_deltas(scenarios[k], supply_pet) for k in names])
+
+    run_sets = np.zeros((len(names), 5), int)
+    run_sets[:, 4] = np.arange(len(names))
+    y, stop_info, _ = _run_basgra_batch(dll_path, params[np.newaxis], matrix_weather[np.newaxis],
+                                        harvest_events[np.newaxis], doy_irr[np.newaxis], weather_deltas, run_sets,
+                                        verbose, stops=_pack_stop_conditions(stop_conditions))
+
+    out = {k: _format_output(y[i], out_index) for i, k in enumerate(names)}
+    if stop_conditions is None:
+        return out
+    return out, {k: _format_stop(stop_info[i], out[k].index) for i, k in enumerate(names)}
+
+
+def run_basgra_multisite(params, matrix_weather, days_harvest, doy_irr, site_params=None, verbose=False,
+                         dll_path='default', supply_pet=True, auto_harvest=True, out_vars=None, nprocesses=1,
+                         chunk_size=None, out=None, stop_conditions=None, event_log=False, soa=False):
+    """
+    run BASGRA for many sites (weather series and/or parameter sets) of the same period with as few fortran calls as
+    possible, inputs are checked once (not once per site) and the output is returned as a single array rather than a
+    dataframe per site
+    :param params: dictionary of the parameters shared by all sites, see run_basgra_nz
+    :param matrix_weather: (n_sites, ndays, nweather) float array with the columns in the order of
+                           matrix_weather_keys_pet (supply_pet=True) or matrix_weather_keys_penman, e.g. from
+                           supporting_functions.weather_preprocessing.prepare_weather. all sites must have the same
+                           year and doy values.  a (ndays, nweather) array is shared by all sites, in which case the
+                           number of sites is set by site_params, doy_irr or days_harvest
+    :param days_harvest: days harvest dataframe shared by all sites (see run_basgra_nz), or for auto harvest only a
+                         (n_sites, ndays, len(days_harvest_keys)) float array of per site harvest data
+    :param doy_irr: list of the days of year to irrigate on, shared by all sites, or a list of one list per site
+    :param site_params: None or pd.DataFrame with one row per site of parameter values (columns in param_keys,
+                        typically site_param_keys) which replace the values in params for that site
+    :param verbose: see run_basgra_nz
+    :param dll_path: see run_basgra_nz
+    :param supply_pet: see run_basgra_nz
+    :param auto_harvest: see run_basgra_nz
+    :param out_vars: None (all of out_cols) or a list of the output variables to return
+    :param nprocesses: number of processes to run the sites in. the fortran keeps its state in module variables, so
+                       the runs within one process are sequential; nprocesses > 1 runs chunks of sites in separate
+                       processes (on windows this must be called from within an if __name__ == '__main__' block)
+    :param chunk_size: number of sites per fortran call, default is to split the sites evenly among the processes
+    :param out: None or a preallocated c-contiguous (n_sites, ndays, len(out_vars)) array of the dtype of the DLL
+                (float64, or float32 for dll_path='single'), fortran writes
+                each site's output straight into its slice of out. if out is an np.memmap (e.g. from np.memmap or
+                np.lib.format.open_memmap) of a whole file the worker processes also write straight to the file,
+                so very large ensembles never need to fit in memory
+    :param stop_conditions: see run_basgra_nz, applied to each site (the conditions may use any output variable,
+                            not only out_vars)
+    :param event_log: boolean, if True also return the harvest, reseed and irrigation events of all of the sites as a
+                      structured array (see run_basgra_nz), run is the index of the site. use out_vars=[] to only
+                      return the events
+    :param soa: boolean, if True use the structure of arrays kernel, which simulates the consecutive sites that only
+                differ in their weather (e.g. the realisations of a weather generator with shared params, site_params
+                None) together and is faster for large numbers of such sites.  the output matches soa=False to
+                rounding (exp, log and powers may come from a vector maths library), the stops and the event log are
+                the same
+    :return: (n_sites, ndays, len(out_vars)) float array (out if it was passed), or if stop_conditions is passed
+             and/or event_log is True a tuple of (that array, stops, events) without the items that were not asked
+             for, where:
+             stops: (n_sites, 2) int array of the (zero based) day each site stopped on and the index of the
+                    condition in stop_conditions (-1 and -1 if the site was not stopped)
+             events: structured array of the events of all sites, ordered by site then day
+    """
+    assert isinstance(nprocesses, int) and nprocesses >= 1, 'nprocesses must be an integer >= 1'
+    dll_path, params, matrix_weather, harvest_events, doy_irr, run_sets = _prep_multisite_inputs(
+        params, matrix_weather, days_harvest, doy_irr, site_params, verbose, dll_path, supply_pet, auto_harvest)
+    weather_deltas = _pack_weather_deltas(None, supply_pet)[np.newaxis]
+    packed_stops = _pack_stop_conditions(stop_conditions)
+
+    out_idx = _get_out_idx(out_vars)
+
+    nsites = len(run_sets)
+    shape = (nsites, matrix_weather.shape[1], len(out_idx))
+    real = _real_dtype(dll_path)[0]
+    if out is None:
+        out = np.zeros(shape, real)
+    else:
+        assert out.shape == shape, 'out must have shape {}'.format(shape)
+        assert out.dtype == real and out.flags.c_contiguous, 'out must be a c-contiguous {} array'.format(real)
+
+    if chunk_size is None:
+        chunk_size = int(np.ceil(nsites / nprocesses))
+    chunks = [(i, min(i + chunk_size, nsites)) for i in range(0, nsites, chunk_size)]
+    sets = (params, matrix_weather, harvest_events, doy_irr)
+    stops = np.zeros((nsites, 2), int)
+    events = []
+
+    def returns():
+        extras = []
+        if stop_conditions is not None:
+            extras.append(stops)
+        if event_log:
+            extras.append(np.concatenate(events) if len(events) > 0 else np.zeros(0, event_log_dtype))
+        if len(extras) == 0:
+            return out
+        return (out,) + tuple(extras)
+
+    def add_events(start, chunk_events):
+        if chunk_events is not None:
+            chunk_events['run'] += start
+            events.append(chunk_events)
+
+    if nprocesses == 1:
+        for start, stop in chunks:
+            _, stops[start:stop], chunk_events = _multisite_worker(
+                _multisite_job(dll_path, sets, weather_deltas, run_sets[start:stop], verbose, out_idx,
+                               out[start:stop], packed_stops, event_log, soa))
+            add_events(start, chunk_events)
+        return returns()
+
+    from concurrent.futures import ProcessPoolExecutor
+    to_file = isinstance(out, np.memmap) and out.filename is not None
+    jobs = []
+    for start, stop in chunks:
+        # workers write to their slice of the file, otherwise the results are returned and copied into out
+        out_file = (out.filename, out.offset + start * out.strides[0], (stop - start,) + shape[1:]) if to_file else None
+        jobs.append(_multisite_job(dll_path, sets, weather_deltas, run_sets[start:stop], verbose, out_idx, out_file,
+                                   packed_stops, event_log, soa))
+    with ProcessPoolExecutor(nprocesses) as pool:
+        for (start, stop), (y, stop_info, chunk_events) in zip(chunks, pool.map(_multisite_worker, jobs)):
+            if not to_file:
+                out[start:stop] = y
+            stops[start:stop] = stop_info
+            add_events(start, chunk_events)
+    if to_file:
+        out.flush()
+    return returns()
+
+
+def iter_basgra_multisite(params, matrix_weather, days_harvest, doy_irr, site_params=None, verbose=False,
+                          dll_path='default', supply_pet=True, auto_harvest=True, out_vars=None, nprocesses=1,
+                          chunk_size=100, soa=False):
+    """
+    run_basgra_multisite as a generator which yields the output of each chunk of sites as it is finished, so the
+    results can be streamed to disk or reduced (see supporting_functions/result_sinks.py) without holding the output
+    of every site in memory.  with nprocesses > 1 at most 2 * nprocesses chunks are queued at a time.
+    the inputs are as per run_basgra_multisite and are checked on the first iteration
+    :return: generator of (start, (n_chunk_sites, ndays, len(out_vars)) float array) in the order of the sites
+    """
+    assert isinstance(nprocesses, int) and nprocesses >= 1, 'nprocesses must be an integer >= 1'
+    assert isinstance(chunk_size, int) and chunk_size >= 1, 'chunk_size must be an integer >= 1'
+    dll_path, params, matrix_weather, harvest_events, doy_irr, run_sets = _prep_multisite_inputs(
+        params, matrix_weather, days_harvest, doy_irr, site_params, verbose, dll_path, supply_pet, auto_harvest)
+    weather_deltas = _pack_weather_deltas(None, supply_pet)[np.newaxis]
+    out_idx = _get_out_idx(out_vars)
+    sets = (params, matrix_weather, harvest_events, doy_irr)
+    jobs = ((start, _multisite_job(dll_path, sets, weather_deltas, run_sets[start:start + chunk_size], verbose,
+                                   out_idx, None, soa=soa))
+            for start in range(0, len(run_sets), chunk_size))
+
+    if nprocesses == 1:
+        for start, job in jobs:
+            yield start, _multisite_worker(job)[0]
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    from collections import deque
+    with ProcessPoolExecutor(nprocesses) as pool:
+        pending = deque()
+        for start, job in jobs:
+            pending.append((start, pool.submit(_multisite_worker, job)))
+            if len(pending) >= 2 * nprocesses:
+                start, future = pending.popleft()
+                yield start, future.result()[0]
+        while len(pending) > 0:
+            start, future = pending.popleft()
+            yield start, future.result()[0]
+
+
+def run_basgra_farm(params, matrix_weather, days_harvest, doy_irr, paddock_params=None, area=None,
+                    farm_max_irr=None, rotation=None, harvest_capacity=None, verbose=False, dll_path='default',
+                    supply_pet=True, weather_deltas=None, out_vars=None):
+    """
+    run the paddocks of a farm together a day at a time, sharing one irrigation budget (e.g. a water take) and one
+    harvest capacity (e.g. a set of harvest machinery).  each day the budget is given to the paddocks with the
+    highest irrigation demand (IRRIG_DEM) first and at most harvest_capacity paddocks are harvested, taking the
+    paddocks that are ready in rotation order (the others are deferred until a later day).  the paddocks are
+    stepped together in one fortran call and only the paddocks held back by the budget or the capacity are
+    simulated again, so a farm run costs little more than a multisite run of its paddocks.  without a budget or
+    capacity the paddocks match run_basgra_multisite exactly.  see fortran_BASGRA_NZ/basgraf.f95 BASGRA_FARM
+    :param params: dictionary of the parameters shared by all paddocks, see run_basgra_nz
+    :param matrix_weather: weather of the farm, a dataframe as per run_basgra_nz or a (ndays, nweather) float array
+                           with the columns in the order of matrix_weather_keys_pet (supply_pet=True) or
+                           matrix_weather_keys_penman
+    :param days_harvest: auto harvest data (one row per day, see run_basgra_nz) shared by all paddocks, or a
+                         (n_paddocks, ndays, len(days_harvest_keys)) float array of per paddock harvest data.  only
+                         auto harvesting is supported as a deferred harvest relies on the harvest being triggered
+                         again on a later day
+    :param doy_irr: list of the days of year to irrigate on, shared by all paddocks, or a list of one list per paddock
+    :param paddock_params: None or pd.DataFrame with one row per paddock of parameter values which replace the values
+                           in params for that paddock (as per site_params of run_basgra_multisite)
+    :param area: None (all paddocks have the same area) or the area of each paddock (any units)
+    :param farm_max_irr: None (no limit) or the irrigation budget of the farm (mm/day over the whole farm area,
+                         e.g. the daily water take / farm area), a single value or one value per day.  the
+                         max_irr of the weather still limits each paddock
+    :param rotation: None (paddock order) or the paddock indices in the order of the harvest rotation
+    :param harvest_capacity: None (no limit) or the maximum number of paddocks harvested a day, a single value or
+                             one value per day (e.g. 0 on days the machinery is not available)
+    :param verbose: see run_basgra_nz
+    :param dll_path: see run_basgra_nz
+    :param supply_pet: see run_basgra_nz
+    :param weather_deltas: see run_basgra_nz, applied to the farm weather
+    :param out_vars: None (all of out_cols) or a list of the output variables to return
+    :return: (paddock output, farm output) where:
+             paddock output: (n_paddocks, ndays, len(out_vars)) float array
+             farm output: pd.DataFrame index: date, columns: input_output_keys.farm_out_keys
+    """
+    if isinstance(matrix_weather, pd.DataFrame):
+        _matrix_weather_keys = matrix_weather_keys_pet if supply_pet else matrix_weather_keys_penman
+        assert set(matrix_weather.keys()) >= set(_matrix_weather_keys), 'incorrect keys for matrix_weather'
+        matrix_weather = matrix_weather.loc[:, _matrix_weather_keys].to_numpy(dtype=float)
+    assert np.ndim(matrix_weather) == 2, 'matrix_weather must be the weather of one site'
+    dll_path, params, matrix_weather, harvest_events, doy_irr, run_sets = _prep_multisite_inputs(
+        params, matrix_weather, days_harvest, doy_irr, paddock_params, verbose, dll_path, supply_pet, True)
+    real, c_real_p = _real_dtype(dll_path)
+    weather_deltas = _pack_weather_deltas(weather_deltas, supply_pet).astype(real)
+    out_idx = np.ascontiguousarray(_get_out_idx(out_vars), dtype=np.int32) + 1  # fortran indexing
+    matrix_weather = np.ascontiguousarray(matrix_weather[0], dtype=real)
+    ndays = len(matrix_weather)
+
+    if area is not None:
+        area = np.atleast_1d(area).astype(float)
+        if len(run_sets) == 1:
+            run_sets = np.repeat(run_sets, len(area), axis=0)
+        assert len(area) == len(run_sets), 'area must have one value per paddock'
+        assert (area > 0).all(), 'area must be greater than 0'
+    npad = len(run_sets)
+    if area is None:
+        area = np.ones(npad)
+
+    if farm_max_irr is None:
+        farm_max_irr = np.inf
+    farm_max_irr = np.atleast_1d(farm_max_irr).astype(float)
+    assert farm_max_irr.shape in ((1,), (ndays,)), 'farm_max_irr must be a single value or one value per day'
+    assert not np.isnan(farm_max_irr).any() and (farm_max_irr >= 0).all(), 'farm_max_irr must be >= 0'
+    farm_max_irr = np.ascontiguousarray(np.broadcast_to(np.minimum(farm_max_irr, np.finfo(real).max), ndays),
+                                        dtype=real)
+
+    if rotation is None:
+        rotation = np.arange(npad)
+    rotation = np.atleast_1d(rotation)
+    assert (np.sort(rotation) == np.arange(npad)).all(), 'rotation must be an order of all of the paddock indices'
+    rotation = np.ascontiguousarray(rotation + 1, dtype=np.int32)  # fortran indexing
+
+    if harvest_capacity is None:
+        harvest_capacity = npad
+    harvest_capacity = np.atleast_1d(harvest_capacity)
+    assert harvest_capacity.shape in ((1,), (ndays,)), 'harvest_capacity must be a single value or one per day'
+    assert (harvest_capacity % 1 == 0).all() and (harvest_capacity >= 0).all(), (
+        'harvest_capacity must be integers >= 0')
+    harvest_capacity = np.ascontiguousarray(np.broadcast_to(harvest_capacity, ndays), dtype=np.int32)
+
+    pad_sets = np.ascontiguousarray(run_sets[:, [0, 2, 3]] + 1, dtype=np.int32)  # fortran indexing
+    params = np.ascontiguousarray(params, dtype=real)
+    harvest_events = np.ascontiguousarray(harvest_events, dtype=real)
+    doy_irr = np.ascontiguousarray(doy_irr, dtype=np.int32)
+    area = np.ascontiguousarray(area, dtype=real)
+    y = np.zeros((npad, ndays, len(out_idx)), real)
+    farm_out = np.zeros((ndays, len(farm_out_keys)), real)
+
+    for_basgra = ct.CDLL(dll_path)
+    for_basgra.BASGRA_FARM_(ct.pointer(ct.c_int(npad)), pad_sets.ctypes.data_as(_c_int_p),
+                            ct.pointer(ct.c_int(len(params))), params.ctypes.data_as(c_real_p),
+                            ct.pointer(ct.c_int(ndays)), matrix_weather.ctypes.data_as(c_real_p),
+                            ct.pointer(ct.c_int(len(harvest_events))), ct.pointer(ct.c_int(harvest_events.shape[1])),
+                            harvest_events.ctypes.data_as(c_real_p),
+                            ct.pointer(ct.c_int(len(doy_irr))), ct.pointer(ct.c_int(doy_irr.shape[1])),
+                            doy_irr.ctypes.data_as(_c_int_p), weather_deltas.ctypes.data_as(c_real_p),
+                            area.ctypes.data_as(c_real_p), farm_max_irr.ctypes.data_as(c_real_p),
+                            rotation.ctypes.data_as(_c_int_p), harvest_capacity.ctypes.data_as(_c_int_p),
+                            ct.pointer(ct.c_int(len(out_cols))), ct.pointer(ct.c_int(len(out_idx))),
+                            out_idx.ctypes.data_as(_c_int_p), y.ctypes.data_as(c_real_p),
+                            farm_out.ctypes.data_as(c_real_p), ct.pointer(ct.c_bool(verbose)))
+
+    start = pd.to_datetime('{}-{:03d}'.format(int(matrix_weather[0, 0]), int(matrix_weather[0, 1])), format='%Y-%j')
+    farm_out = pd.DataFrame(farm_out, index=pd.date_range(start, periods=ndays, freq='D'), columns=farm_out_keys)
+    farm_out.index.name = 'date'
+    return y, farm_out
+
+
+class BasgraSimulation(object):
+    def __init__(self, params, matrix_weather, days_harvest, doy_irr, verbose=False, dll_path='default',
+                 supply_pet=True, auto_harvest=False, weather_deltas=None):
+        """
+        a BASGRA run which is simulated a block of days at a time, e.g. to couple BASGRA with another model or to
+        make management decisions as the season unfolds.  the weather and state can be changed between blocks
+        (see advance and set_state).  the simulation is held in the fortran library (so it cannot be pickled) and
+        any number of simulations can be advanced in turn, but they share the library so should only be used from
+        one thread.  simulating a run in blocks gives exactly the same output as run_basgra_nz.
+        :param params: see run_basgra_nz
+        :param matrix_weather: see run_basgra_nz
+        :param days_harvest: see run_basgra_nz
+        :param doy_irr: see run_basgra_nz
+        :param verbose: see run_basgra_nz
+        :param dll_path: see run_basgra_nz
+        :param supply_pet: see run_basgra_nz
+        :param auto_harvest: see run_basgra_nz
+        :param weather_deltas: see run_basgra_nz, applied to the weather as it is read (including any overrides)
+        """
+        dll_path, params, matrix_weather, harvest_events, doy_irr, out_index = _prep_site_inputs(
+            params, matrix_weather, days_harvest, doy_irr, verbose, dll_path, supply_pet, auto_harvest)
+        self._real, self._c_real_p = _real_dtype(dll_path)
+        weather_deltas = _pack_weather_deltas(weather_deltas, supply_pet).astype(self._real)
+        self.ndays = len(matrix_weather)
+        assert self.ndays <= _max_weather_size, 'maximum run size is {} days'.format(_max_weather_size)
+        self.verbose = verbose
+        self._weather_keys = matrix_weather_keys_pet if supply_pet else matrix_weather_keys_penman
+        self._out_index = out_index
+        self._y = np.zeros((self.ndays, len(out_cols)), self._real)  # fortran writes each block of days into this
+        self._day = 0
+        self._start = pd.to_datetime('{}-{:03d}'.format(int(matrix_weather[0, 0]), int(matrix_weather[0, 1])),
+                                     format='%Y-%j')
+
+        params = np.ascontiguousarray(params, dtype=self._real)
+        matrix_weather = np.ascontiguousarray(matrix_weather, dtype=self._real)
+        harvest_events = np.ascontiguousarray(harvest_events, dtype=self._real)
+        doy_irr = np.ascontiguousarray(doy_irr, dtype=np.int32)
+        handle = ct.c_int(0)
+        self._lib = ct.CDLL(dll_path)
+        self._lib.BASGRA_SIM_INIT_(params.ctypes.data_as(self._c_real_p), ct.pointer(ct.c_int(self.ndays)),
+                                   matrix_weather.ctypes.data_as(self._c_real_p),
+                                   ct.pointer(ct.c_int(len(harvest_events))),
+                                   harvest_events.ctypes.data_as(self._c_real_p), ct.pointer(ct.c_int(len(doy_irr))),
+                                   doy_irr.ctypes.data_as(_c_int_p), weather_deltas.ctypes.data_as(self._c_real_p),
+                                   ct.byref(handle))
+        self._handle = handle.value
+
+    @property
+    def day(self):
+        """
+        the number of days simulated so far
+        """
+        return self._day
+
+    @property
+    def done(self):
+        """
+        True once every day of the weather has been simulated
+        """
+        return self._day >= self.ndays
+
+    @property
+    def state(self):
+        """
+        the state after the last day simulated (the initial state before any days) as a dictionary of
+        {state key: value}, see input_output_keys.state_keys for the keys and units.  the output of each day
+        reports the state at the start of that day, so this is the state in the output of the next day
+        """
+        self._check_open()
+        x = np.zeros(len(state_keys), self._real)
+        day = ct.c_int(0)
+        self._lib.BASGRA_SIM_GET_STATE_(ct.pointer(ct.c_int(self._handle)), x.ctypes.data_as(self._c_real_p),
+                                        ct.byref(day))
+        return dict(zip(state_keys, x.tolist()))
+
+    def set_state(self, values):
+        """
+        change the state before the next day is simulated, e.g. to pass soil water from another model.  the values
+        are not checked beyond being finite, so keep them physically consistent (e.g. TILG1, TILG2 and TILV with LAI)
+        :param values: dictionary of {state key: value}, see input_output_keys.state_keys, missing keys are unchanged
+        """
+        self._check_open()
+        bad_keys = set(values.keys()) - set(state_keys)
+        assert len(bad_keys) == 0, 'unexpected state keys: {}'.format(bad_keys)
+        assert np.isfinite([float(v) for v in values.values()]).all(), 'state values must be finite'
+        state = self.state
+        state.update({k: float(v) for k, v in values.items()})
+        x = np.array([state[k] for k in state_keys], self._real)
+        self._lib.BASGRA_SIM_SET_STATE_(ct.pointer(ct.c_int(self._handle)), x.ctypes.data_as(self._c_real_p))
+
+    def advance(self, n_days=1, overrides=None):
+        """
+        simulate the next n_days days (or the rest of the weather if fewer days are left)
+        :param n_days: int >= 1 the number of days to simulate
+        :param overrides: None or a dictionary of changes to make before the days are simulated, keys are either
+                          weather keys (e.g. 'max_irr', 'rain', but not 'year' or 'doy') with a single value or one
+                          value per day (n_days values), which replace the weather of these days, or state keys
+                          (input_output_keys.state_keys) with a single value, see set_state
+        :return: output dataframe of the days simulated (as per run_basgra_nz)
+        """
+        self._check_open()
+        assert isinstance(n_days, (int, np.integer)) and n_days >= 1, 'n_days must be an integer >= 1'
+        if overrides is None:
+            overrides = {}
+        assert isinstance(overrides, dict), 'overrides must be None or a dictionary'
+        state = {k: v for k, v in overrides.items() if k in state_keys}
+        weather = {k: v for k, v in overrides.items() if k not in state_keys}
+        bad_keys = set(weather.keys()) - (set(self._weather_keys) - {'year', 'doy'})
+        assert len(bad_keys) == 0, 'unexpected overrides: {}'.format(bad_keys)
+
+        nadv = min(int(n_days), self.ndays - self._day)
+        ovr_cols = np.array([self._weather_keys.index(k) + 1 for k in weather.keys()], np.int32)  # fortran indexing
+        ovr_values = np.zeros((len(weather), nadv), self._real)
+        for i, (k, v) in enumerate(weather.items()):
+            v = np.atleast_1d(v).astype(float)
+            assert v.shape in ((1,), (n_days,)), 'override {} must be a single value or n_days values'.format(k)
+            assert not np.isnan(v).any(), 'override {} cannot have na values'.format(k)
+            ovr_values[i] = v[:nadv] if len(v) > 1 else v[0]
+        if len(state) > 0:
+            self.set_state(state)
+
+        start = self._day
+        if nadv > 0:
+            ndone = ct.c_int(0)
+            self._lib.BASGRA_SIM_ADVANCE_(ct.pointer(ct.c_int(self._handle)), ct.pointer(ct.c_int(nadv)),
+                                          ct.pointer(ct.c_int(len(ovr_cols))), ovr_cols.ctypes.data_as(_c_int_p),
+                                          ovr_values.ctypes.data_as(self._c_real_p),
+                                          ct.pointer(ct.c_int(len(out_cols))),
+                                          self._y[start:].ctypes.data_as(self._c_real_p), ct.byref(ndone),
+                                          ct.pointer(ct.c_bool(self.verbose)))
+            self._day += ndone.value
+        return self._output(start, self._day)
+
+    def forecast(self, member_weather, days_harvest=None, out_vars=None):
+        """
+        forecast from the current state with each member of an ensemble of weather futures (e.g. the members of a
+        seasonal forecast) in one fortran call.  each member starts from a copy of the state, so the history is only
+        simulated once, and the simulation is not changed, so it can still be advanced (e.g. with the observed
+        weather) and forecast again later.  see supporting_functions/forecast.py for summaries of the members
+        :param member_weather: (n_members, n_days, nweather) float array of the weather of each member, columns in
+                               the order of matrix_weather_keys_pet (supply_pet=True) or matrix_weather_keys_penman.
+                               the days run on from the last day simulated, the weather_deltas of the simulation
+                               are applied to it
+        :param days_harvest: None (no harvests) or auto harvest data for the forecast (one row per day, see
+                             run_basgra_nz), shared by all members
+        :param out_vars: None (all of out_cols) or a list of the output variables to return
+        :return: (n_members, n_days, len(out_vars)) float array
+        """
+        self._check_open()
+        member_weather = np.ascontiguousarray(member_weather, dtype=self._real)
+        assert member_weather.ndim == 3 and member_weather.shape[2] == len(self._weather_keys), (
+            'member_weather must be (n_members, n_days, {})'.format(len(self._weather_keys)))
+        nmem, nfdays = member_weather.shape[:2]
+        assert nmem >= 1 and nfdays >= 1, 'member_weather must have at least one member and one day'
+        assert self._day + nfdays <= _max_weather_size, 'the simulation and forecast can be at most {} days'.format(
+            _max_weather_size)
+        assert not np.isnan(member_weather).any(), 'member_weather cannot have na values'
+        dates = member_weather[:, :, :2]
+        assert (dates == dates[[0]]).all(), 'all members must have the same year and doy'
+        first = pd.to_datetime('{}-{:03d}'.format(int(dates[0, 0, 0]), int(dates[0, 0, 1])), format='%Y-%j')
+        assert first == self._start + pd.Timedelta(days=self._day), (
+            'the forecast must start on the day after the last day simulated')
+
+        if days_harvest is None:
+            events = np.zeros((0, len(_harvest_event_cols)), float)
+        else:
+            assert isinstance(days_harvest, pd.DataFrame), 'days_harvest must be None or a pd.DataFrame'
+            assert len(days_harvest) == nfdays, 'days_harvest must have one row per forecast day'
+            assert (days_harvest[['year', 'doy']].values == dates[0]).all(), (
+                'days_harvest and member_weather dates must match')
+            events = np.empty((nfdays, len(_harvest_event_cols)), float)
+            events[:, 0] = self._day + 1 + np.arange(nfdays)
+            events[:, 1:] = days_harvest.loc[:, _harvest_event_cols[1:]].values
+            assert not np.isnan(events).any(), 'days_harvest cannot have na data'
+            assert (events[:, _harvest_event_cols.index('frac_harv')] <= 1).all(), 'frac_harv cannot be greater than 1'
+
+        out_idx = np.ascontiguousarray(_get_out_idx(out_vars), dtype=np.int32) + 1  # fortran indexing
+        events = np.ascontiguousarray(events, dtype=self._real)
+        y = np.zeros((nmem, nfdays, len(out_idx)), self._real)
+        self._lib.BASGRA_SIM_FORECAST_(ct.pointer(ct.c_int(self._handle)), ct.pointer(ct.c_int(nmem)),
+                                       ct.pointer(ct.c_int(nfdays)), member_weather.ctypes.data_as(self._c_real_p),
+                                       ct.pointer(ct.c_int(len(events))), events.ctypes.data_as(self._c_real_p),
+                                       ct.pointer(ct.c_int(len(out_cols))), ct.pointer(ct.c_int(len(out_idx))),
+                                       out_idx.ctypes.data_as(_c_int_p), y.ctypes.data_as(self._c_real_p),
+                                       ct.pointer(ct.c_bool(self.verbose)))
+        return y
+
+    @property
+    def outputs_so_far(self):
+        """
+        output dataframe (as per run_basgra_nz) of all of the days simulated so far
+        """
+        return self._output(0, self._day)
+
+    def _output(self, start, stop):
+        if stop <= start:
+            out = pd.DataFrame(columns=list(out_cols), index=pd.DatetimeIndex([], name='date'), dtype=self._real)
+            return out
+        return _format_output(self._y[start:stop].copy(), self._out_index[start:stop])
+
+    def _check_open(self):
+        assert self._handle is not None, 'the simulation has been freed'
+
+    def free(self):
+        """
+        free the simulation in the fortran library, the output so far is kept but the simulation cannot be advanced
+        """
+        if getattr(self, '_handle', None) is not None:
+            self._lib.BASGRA_SIM_FREE_(ct.pointer(ct.c_int(self._handle)))
+            self._handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.free()
+
+    def __del__(self):
+        self.free()
+
+
+def _get_out_idx(out_vars):
+    """
+    the index of out_vars in out_cols
+    """
+    if out_vars is None:
+        return np.arange(len(out_cols))
+    bad_vars = set(out_vars) - set(out_cols)
+    assert len(bad_vars) == 0, 'unexpected out_vars: {}'.format(bad_vars)
+    return np.array([out_cols.index(e) for e in out_vars])
+
+
+def _multisite_job(dll_path, sets, weather_deltas, run_sets, verbose, out_idx, out, stops=None, event_log=False,
+                   soa=False):
+    """
+    set up one chunk of run_basgra_multisite, only the sets used by the chunk are kept (as views where possible), so
+    that only they are passed to the worker processes
+    :param out: None, the output array of the chunk, or (filename, offset, shape) of its part of a memory mapped file
+    """
+    run_sets = run_sets.copy()
+    subsets = []
+    for i, data in enumerate(sets):
+        use, run_sets[:, i] = np.unique(run_sets[:, i], return_inverse=True)
+        if (np.diff(use) == 1).all():
+            subsets.append(data[use[0]:use[-1] + 1])
+        else:
+            subsets.append(data[use])
+    return dll_path, subsets, weather_deltas, run_sets, verbose, out_idx, out, stops, event_log, soa
+
+
+def _multisite_worker(job):
+    """
+    run one chunk of run_basgra_multisite
+    :return: (y, stop_info, events), y is None when the output was written to a memory mapped file
+    """
+    dll_path, subsets, weather_deltas, run_sets, verbose, out_idx, out, stops, event_log, soa = job
+    if isinstance(out, tuple):
+        filename, offset, shape = out
+        out = np.memmap(filename, dtype=_real_dtype(dll_path)[0], mode='r+', offset=offset, shape=shape)
+        _, stop_info, events = _run_basgra_batch(dll_path, *subsets, weather_deltas, run_sets, verbose, out_idx, out,
+                                                 stops, event_log, soa)
+        out.flush()
+        return None, stop_info, events
+    return _run_basgra_batch(dll_path, *subsets, weather_deltas, run_sets, verbose, out_idx, out, stops, event_log,
+                             soa)
+
+
+def _prep_multisite_inputs(params, matrix_weather, days_harvest, doy_irr, site_params, verbose, dll_path, supply_pet,
+                           auto_harvest):
+    """
+    check the inputs of run_basgra_multisite and pack them for _run_basgra_batch. the first site is checked as per
+    run_basgra_nz and the packed sets of all of the sites are checked with validate_inputs
+    :return: dll_path, params, matrix_weather, harvest_events, doy_irr (the sets) and run_sets (n_sites, 5)
+    """
+    if supply_pet:
+        _matrix_weather_keys = matrix_weather_keys_pet
+    else:
+        _matrix_weather_keys = matrix_weather_keys_penman
+
+    matrix_weather = np.ascontiguousarray(matrix_weather, dtype=float)
+    shared_weather = matrix_weather.ndim == 2
+    if shared_weather:
+        matrix_weather = matrix_weather[np.newaxis]
+    assert matrix_weather.ndim == 3 and matrix_weather.shape[2] == len(_matrix_weather_keys), (
+        'matrix_weather must be (n_sites, ndays, {}) or (ndays, {})'.format(len(_matrix_weather_keys),
+                                                                          len(_matrix_weather_keys)))
+    ndays = matrix_weather.shape[1]
+    if not shared_weather:
+        nsites = len(matrix_weather)
+    elif site_params is not None:
+        nsites = len(site_params)
+    elif isinstance(days_harvest, np.ndarray):
+        nsites = len(days_harvest)
+    elif len(doy_irr) > 0 and not np.isscalar(doy_irr[0]):
+        nsites = len(doy_irr)
+    else:
+        nsites = 1
+    dll_path = _get_dll_path(dll_path, supply_pet)
+    validate_inputs(matrix_weather=matrix_weather, dll_path=dll_path, supply_pet=supply_pet, raise_errors=True)
+    dates = matrix_weather[:, :, :2]
+
+    # per site doy_irr are padded with 0, which is never a day of the year
+    if len(doy_irr) > 0 and not np.isscalar(doy_irr[0]):
+        assert len(doy_irr) == nsites, 'doy_irr must be a single list or one list per site'
+        nirr = max(len(e) for e in doy_irr)
+        site_irr = np.zeros((nsites, nirr), np.int32)
+        for i, e in enumerate(doy_irr):
+            site_irr[i, :len(e)] = e
+        check_irr = site_irr[0]
+    else:
+        site_irr = None
+        check_irr = doy_irr
+
+    # per site harvest arrays
+    site_harvest = None
+    if isinstance(days_harvest, np.ndarray):
+        assert auto_harvest, 'days_harvest can only be passed as an array for auto harvesting'
+        site_harvest = np.ascontiguousarray(days_harvest, dtype=float)
+        assert site_harvest.shape == (nsites, ndays, len(days_harvest_keys)), (
+            'days_harvest must be (n_sites, ndays, {})'.format(len(days_harvest_keys)))
+        assert not np.isnan(site_harvest).any(), 'days_harvest cannot have na data'
+        assert (site_harvest[:, :, :2] == dates[[0]]).all(), 'days_harvest and matrix_weather dates must match'
+        days_harvest = pd.DataFrame(site_harvest[0], columns=days_harvest_keys).astype({'year': int, 'doy': int})
+
+    # full check of the first site
+    site_weather = pd.DataFrame(matrix_weather[0], columns=_matrix_weather_keys).astype({'year': int, 'doy': int})
+    dll_path, params_array, _, harvest_events, check_irr, _ = _prep_site_inputs(
+        params, site_weather, days_harvest, check_irr, verbose, dll_path, supply_pet, auto_harvest)
+
+    run_sets = np.zeros((nsites, 5), int)
+    if site_params is None:
+        params = params_array[np.newaxis]
+    else:
+        assert isinstance(site_params, pd.DataFrame), 'site_params must be None or a pd.DataFrame'
+        assert len(site_params) == nsites, 'site_params must have one row per site'
+        bad_keys = set(site_params.keys()) - set(param_keys)
+        assert len(bad_keys) == 0, 'unexpected keys in site_params: {}'.format(bad_keys)
+        params = np.repeat(params_array[np.newaxis], nsites, axis=0)
+        for k in site_params.keys():
+            params[:, param_keys.index(k)] = site_params[k].values
+        run_sets[:, 0] = np.arange(nsites)
+
+    if site_harvest is None:
+        harvest_events = harvest_events[np.newaxis]
+    else:
+        # auto harvesting is an event on every day
+        harvest_events = np.empty((nsites, ndays, len(_harvest_event_cols)))
+        harvest_events[:, :, 0] = np.arange(1, ndays + 1)
+        harvest_events[:, :, 1:] = site_harvest[:, :, 2:]
+        run_sets[:, 2] = np.arange(nsites)
 
+    if site_irr is None:
+        doy_irr = check_irr[np.newaxis]
+    else:
+        doy_irr = site_irr
+        run_sets[:, 3] = np.arange(nsites)
+
+    if not shared_weather:
+        run_sets[:, 1] = np.arange(nsites)
+    validate_inputs(params, matrix_weather, harvest_events, doy_irr, dll_path=dll_path, supply_pet=supply_pet,
+                    raise_errors=True)
+    return dll_path, params, matrix_weather, harvest_events, doy_irr, run_sets
+
+
+def _get_dll_path(dll_path, supply_pet):
+    """
+    get the dll path, and for the default dlls (double and single precision) try to compile them if they do not
+    exist or are older than the fortran code
+    :param dll_path: see run_basgra_nz
+    :param supply_pet: see run_basgra_nz
+    :return: dll_path
+    """
     # define DLL library path
     use_default_lib = False
     if dll_path == 'default':
@@ -72,21 +821,187 @@ def run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=False,
         else:
             dll_path = _libpath_peyman
 
-    # check that library path exists
-    if not os.path.exists(dll_path):
-        if use_default_lib:
+    elif dll_path == 'single':
+        use_default_lib = True
+        if supply_pet:
+            dll_path = _libpath_pet_single
+
+        else:
+            dll_path = _libpath_peyman_single
+
+    # check that library path exists, the default dlls are also rebuilt if they are older than the fortran code (e.g.
+    # after pulling changes), as an old dll does not have the entry points that the python wrapper calls
+    if use_default_lib:
+        if dll_path not in _checked_dlls and _dll_is_stale(dll_path):
             # try to run the bat file
-            print('dll not found, trying to run bat to create DLL:\n{}'.format(_bat_path))
-            p = Popen(os.path.basename(_bat_path), cwd=os.path.dirname(_bat_path), shell=True)
-            stdout, stderr = p.communicate()
-            print('output of bat:\n{}\n{}'.format(stdout, stderr))
+            print('dll {}, trying to run bat to create DLL:\n{}'.format(
+                'older than the fortran code' if os.path.exists(dll_path) else 'not found', _bat_path))
+            _run_bat(_bat_path)
             if not os.path.exists(dll_path):
                 raise EnvironmentError('default DLL path not found:\n'
                                        '{}\n'
                                        'see readme for more details:\n'
                                        '{}'.format(dll_path, os.path.dirname(__file__) + 'README.md'))
-        else:
-            raise EnvironmentError('DLL path not found:\n{}'.format(dll_path))
+            if _dll_is_stale(dll_path):
+                raise EnvironmentError('default DLL is older than the fortran code and could not be rebuilt:\n'
+                                       '{}\n'
+                                       'rerun {}'.format(dll_path, _bat_path))
+        if dll_path in (_libpath_pet_single, _libpath_peyman_single) and _real_dtype(dll_path)[0] != np.float32:
+            raise EnvironmentError('single precision DLL was not compiled as single precision (-Dsingle without '
+                                   '-fdefault-real-8):\n{}\nrerun {}'.format(dll_path, _bat_path))
+        _checked_dlls.add(dll_path)
+    elif not os.path.exists(dll_path):
+        raise EnvironmentError('DLL path not found:\n{}'.format(dll_path))
+    return dll_path
+
+
+def _run_bat(bat_path):
+    """
+    run the bat file which builds the default dlls, without waiting for input (the bat ends with pause)
+    :param bat_path: path to the bat file
+    :return: the output of the bat, raises EnvironmentError if the bat fails
+    """
+    p = Popen(os.path.basename(bat_path), cwd=os.path.dirname(bat_path), shell=True, stdin=DEVNULL, stdout=PIPE,
+              stderr=STDOUT)
+    output, _ = p.communicate()
+    output = output.decode(errors='replace')
+    print('output of bat:\n{}'.format(output))
+    if p.returncode != 0:
+        raise EnvironmentError('building the DLLs failed (return code {}):\n{}\n{}'.format(p.returncode, bat_path,
+                                                                                          output))
+    return output
+
+
+def _dll_is_stale(dll_path):
+    """
+    check whether a default dll is missing or older than any of the fortran code it is built from
+    :param dll_path: path to one of the default dlls
+    :return: boolean
+    """
+    if not os.path.exists(dll_path):
+        return True
+    dll_time = os.path.getmtime(dll_path)
+    return any(os.path.getmtime(os.path.join(_fortran_dir, e)) > dll_time for e in os.listdir(_fortran_dir)
+               if e.endswith('.f95'))
+
+
+def _real_dtype(dll_path):
+    """
+    the dtype of the reals passed to and from a dll, float64 or float32 for the single precision DLLs (compiled
+    without -fdefault-real-8, see fortran_BASGRA_NZ/compile_BASGRA_gfortran.bat)
+    :param dll_path: path to the DLL (from _get_dll_path)
+    :return: numpy dtype, ctypes pointer type of the reals
+    """
+    if dll_path not in _dll_real_dtypes:
+        nbytes = ct.c_int(8)
+        try:
+            ct.CDLL(dll_path).BASGRA_REAL_BYTES_(ct.byref(nbytes))
+        except AttributeError:  # DLLs built before the single precision variant are all float64
+            pass
+        _dll_real_dtypes[dll_path] = np.dtype('float{}'.format(nbytes.value * 8))
+    real = _dll_real_dtypes[dll_path]
+    return real, _c_float_p if real == np.float32 else _c_double_p
+
+
+class BasgraInputError(ValueError):
+    def __init__(self, errors, n_errors):
+        """
+        raised when the packed inputs fail validate_inputs, unlike the asserts this is not removed by python -O
+        :param errors: structured array (input_error_dtype) of the errors (at most max_errors of validate_inputs)
+        :param n_errors: the total number of errors found
+        """
+        self.errors = errors
+        self.n_errors = n_errors
+        lines = ['{} (input: {}, set: {}, index: {})'.format(e['message'], e['input'], e['set'], e['index'])
+                 for e in errors[:10]]
+        if n_errors > len(lines):
+            lines.append('... and {} more'.format(n_errors - len(lines)))
+        super(BasgraInputError, self).__init__('{} input errors:\n{}'.format(n_errors, '\n'.join(lines)))
+
+
+def validate_inputs(params=None, matrix_weather=None, harvest_events=None, doy_irr=None, dll_path='default',
+                    supply_pet=True, max_errors=100, raise_errors=False):
+    """
+    cheap validation of packed (prepared or batched) inputs in fortran (BASGRA_VALIDATE), without any pandas.  the
+    checks are: na values, integer and contiguous dates in matrix_weather (from integer arithmetic), the same dates
+    in every weather set, frac_harv between 0 and 1, increasing harvest event days, reseed_harv_delay >=1 and doy_irr
+    between 0 and 366.  the run functions call this on their packed inputs, the pandas checks of run_basgra_nz only
+    check the structure of the dataframes and dictionaries.
+    :param params: None (not checked) or (n_param_sets, NPAR) float in the order of param_keys
+    :param matrix_weather: None or (n_weather_sets, ndays, nweather) float
+    :param harvest_events: None or (n_harvest_sets, nevents, 7) float sparse harvest events (see
+                           _get_harvest_events), sets with fewer events are padded with rows of day 0.  the days
+                           are only checked to be within the simulation if matrix_weather is passed
+    :param doy_irr: None or (n_doy_irr_sets, nirr) int, shorter sets can be padded with 0
+    :param dll_path: see run_basgra_nz
+    :param supply_pet: see run_basgra_nz
+    :param max_errors: the maximum number of errors to return
+    :param raise_errors: if True raise a BasgraInputError if there are any errors
+    :return: structured array (input_error_dtype) of the errors found (empty if the inputs are valid), the set and
+             index (the parameter, day, event or doy_irr entry) are zero based
+    """
+    dll_path = _get_dll_path(dll_path, supply_pet)
+    real, c_real_p = _real_dtype(dll_path)
+    nweather = len(matrix_weather_keys_pet) if supply_pet else len(matrix_weather_keys_penman)
+    if params is None:
+        params = np.zeros((0, len(param_keys)))
+    if matrix_weather is None:
+        matrix_weather = np.zeros((0, 0, nweather))
+    if harvest_events is None:
+        harvest_events = np.zeros((0, 0, len(_harvest_event_cols)))
+    if doy_irr is None:
+        doy_irr = np.zeros((0, 0))
+    params = np.ascontiguousarray(params, dtype=real)
+    matrix_weather = np.ascontiguousarray(matrix_weather, dtype=real)
+    harvest_events = np.ascontiguousarray(harvest_events, dtype=real)
+    doy_irr = np.ascontiguousarray(doy_irr, dtype=np.int32)
+    assert params.ndim == 2 and params.shape[1] == len(param_keys), 'params must be (nsets, {})'.format(
+        len(param_keys))
+    assert matrix_weather.ndim == 3 and matrix_weather.shape[2] == nweather, (
+        'matrix_weather must be (nsets, ndays, {})'.format(nweather))
+    assert harvest_events.ndim == 3 and harvest_events.shape[2] == len(_harvest_event_cols), (
+        'harvest_events must be (nsets, nevents, {})'.format(len(_harvest_event_cols)))
+    assert doy_irr.ndim == 2, 'doy_irr must be (nsets, nirr)'
+    ndays = matrix_weather.shape[1]
+    if len(matrix_weather) == 0:
+        # without the weather the event days are only checked to be increasing
+        ndays = max(ndays, int(np.nanmax(harvest_events[:, :, 0], initial=0)))
+
+    records = np.zeros((max_errors, 3), np.int32)
+    nerr = ct.c_int(0)
+    for_basgra = ct.CDLL(dll_path)
+    for_basgra.BASGRA_VALIDATE_(ct.pointer(ct.c_int(len(params))), params.ctypes.data_as(c_real_p),
+                                ct.pointer(ct.c_int(len(matrix_weather))), ct.pointer(ct.c_int(ndays)),
+                                matrix_weather.ctypes.data_as(c_real_p),
+                                ct.pointer(ct.c_int(len(harvest_events))),
+                                ct.pointer(ct.c_int(harvest_events.shape[1])),
+                                harvest_events.ctypes.data_as(c_real_p),
+                                ct.pointer(ct.c_int(len(doy_irr))), ct.pointer(ct.c_int(doy_irr.shape[1])),
+                                doy_irr.ctypes.data_as(_c_int_p),
+                                ct.pointer(ct.c_int(max_errors)), records.ctypes.data_as(_c_int_p), ct.byref(nerr))
+
+    records = records[:min(nerr.value, max_errors)]
+    errors = np.zeros(len(records), input_error_dtype)
+    errors['code'] = records[:, 0]
+    errors['set'] = records[:, 1] - 1
+    errors['index'] = records[:, 2] - 1
+    for i, code in enumerate(records[:, 0]):
+        errors['input'][i], errors['message'][i] = input_error_codes[code]
+    if raise_errors and nerr.value > 0:
+        raise BasgraInputError(errors, nerr.value)
+    return errors
+
+
+def _prep_site_inputs(params, matrix_weather, days_harvest, doy_irr, verbose, dll_path, supply_pet, auto_harvest):
+    """
+    check the inputs of a single site and pack them into the arrays expected by fortran, see run_basgra_nz
+    :return: dll_path, params (NPAR,), matrix_weather (ndays, nweather), harvest_events (nevents, 7),
+             doy_irr (nirr,), out_index (the index of matrix_weather)
+    """
+    assert isinstance(supply_pet, bool), 'supply_pet param must be boolean'
+    assert isinstance(auto_harvest, bool), 'auto_harvest param must be boolean'
+
+    dll_path = _get_dll_path(dll_path, supply_pet)
 
     # define expected weather keys
     if supply_pet:
@@ -99,103 +1014,324 @@ def run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=False,
     _test_basgra_inputs(params, matrix_weather, days_harvest, verbose, _matrix_weather_keys,
                         auto_harvest, doy_irr)
 
-    nout = len(out_cols)
-    ndays = len(matrix_weather)
-    nirr = len(doy_irr)
-
     # define output indexes before data manipulation
     out_index = matrix_weather.index
 
-    # copy everything and ensure order is correct
-    params = deepcopy(params)
-    matrix_weather = deepcopy(matrix_weather.loc[:, _matrix_weather_keys])
-    days_harvest = deepcopy(days_harvest.loc[:, days_harvest_keys])
-
-    # translate manual harvest inputs into fortran format
-    if not auto_harvest:
-        days_harvest = _trans_manual_harv(days_harvest, matrix_weather)
+    # translate the harvest inputs into sparse harvest events
+    harvest_events = _get_harvest_events(days_harvest, matrix_weather, auto_harvest)
 
-    # get variables into right python types
+    # get variables into right python types and order, neither python nor fortran modify the inputs so they are
+    # not copied beyond this packing
     params = np.array([params[e] for e in param_keys]).astype(float)
-    matrix_weather = matrix_weather.values.astype(float)
-    days_harvest = days_harvest.values.astype(float)
+    matrix_weather = matrix_weather.loc[:, _matrix_weather_keys].to_numpy(dtype=float)
     doy_irr = doy_irr.astype(np.int32)
+    validate_inputs(params[np.newaxis], matrix_weather[np.newaxis], harvest_events[np.newaxis],
+                    doy_irr[np.newaxis], dll_path=dll_path, supply_pet=supply_pet, raise_errors=True)
 
-    # manage weather size,
-    weather_size = len(matrix_weather)
-    if weather_size < _max_weather_size:
-        temp = np.zeros((_max_weather_size - weather_size, matrix_weather.shape[1]), float)
-        matrix_weather = np.concatenate((matrix_weather, temp), 0)
+    return dll_path, params, matrix_weather, harvest_events, doy_irr, out_index
 
-    y = np.zeros((ndays, nout), float)  # cannot set these to nan's or it breaks fortran
+
+def _get_harvest_events(days_harvest, matrix_weather, auto_harvest):
+    """
+    translate days_harvest into the sparse harvest events expected by fortran (see fortran_BASGRA_NZ/basgraf.f95),
+    one row per harvest day (every day for auto harvesting), days without a row do not harvest or reseed and
+    weed_dm_frac is carried forward from the previous row
+    :param days_harvest: checked days harvest data (see run_basgra_nz)
+    :param matrix_weather: checked weather data
+    :param auto_harvest: see run_basgra_nz
+    :return: (nevents, 7) float array, columns: day (1 based index of the day in matrix_weather) then the
+             days_harvest_keys after doy
+    """
+    values = days_harvest.loc[:, _harvest_event_cols[1:]].values.astype(float)
+    if auto_harvest:
+        day = np.arange(1, len(days_harvest) + 1)
+    else:
+        start = pd.to_datetime('{}-{:03d}'.format(matrix_weather['year'].iloc[0], matrix_weather['doy'].iloc[0]),
+                               format='%Y-%j')
+        strs = ['{}-{:03d}'.format(int(e), int(f)) for e, f in days_harvest[['year', 'doy']].itertuples(False, None)]
+        day = (pd.to_datetime(strs, format='%Y-%j') - start).days.values + 1
+        order = np.argsort(day, kind='stable')
+        day, values = day[order], values[order]
+        assert (np.diff(day) > 0).all(), 'days_harvest cannot have duplicate days'
+
+    if len(day) > 0 and day[0] != 1:
+        warn('weed_dm_frac is na for the first day of simulation, setting to first valid weed_dm_frac\n'
+             'this does not affect the harvesting only the calculation of the DMH_weed variable.')
+    return np.concatenate((day[:, np.newaxis], values), axis=1)
+
+
+def _pack_weather_deltas(weather_deltas, supply_pet):
+    """
+    pack a weather_deltas dictionary (see run_basgra_nz) into a (len(weather_delta_keys), 12) array for fortran,
+    missing keys are set to no change (add 0, mult 1)
+    :param weather_deltas: None or dictionary
+    :param supply_pet: see run_basgra_nz
+    :return: np.ndarray
+    """
+    out = np.zeros((len(weather_delta_keys), 12), float)
+    out[1::2] = 1  # the multipliers
+    if weather_deltas is None:
+        return out
+
+    assert isinstance(weather_deltas, dict), 'weather_deltas must be None or a dictionary'
+    bad_keys = set(weather_deltas.keys()) - set(weather_delta_keys)
+    assert len(bad_keys) == 0, 'unexpected keys in weather_deltas: {}'.format(bad_keys)
+    unused = ('vpa', 'wind') if supply_pet else ('pet',)
+    for k, v in weather_deltas.items():
+        assert k.split('_')[0] not in unused, '{} cannot be used with supply_pet={}'.format(k, supply_pet)
+        v = np.atleast_1d(v).astype(float)
+        assert v.shape in ((1,), (12,)), 'weather_deltas values must be a single value or 12 monthly values'
+        assert not np.isnan(v).any(), 'weather_deltas cannot have na values'
+        out[weather_delta_keys.index(k)] = v
+    return out
+
+
+def _run_basgra_batch(dll_path, params, matrix_weather, harvest_events, doy_irr, weather_deltas, run_sets,
+                      verbose, out_idx=None, out=None, stops=None, event_log=False, soa=False):
+    """
+    run fortran BASGRA_BATCH on packed inputs, each input is a stack of one or more sets and run_sets picks the sets
+    used by each run, see fortran_BASGRA_NZ/basgraf.f95.  the inputs are not checked beyond their shapes.
+    :param dll_path: path to the DLL
+    :param params: (n_param_sets, NPAR) float
+    :param matrix_weather: (n_weather_sets, ndays, nweather) float
+    :param harvest_events: (n_harvest_sets, nevents, 7) float sparse harvest events (see _get_harvest_events),
+                           sets with fewer events are padded with rows of day 0
+    :param doy_irr: (n_doy_irr_sets, nirr) int, shorter sets can be padded with 0
+    :param weather_deltas: (n_delta_sets, len(weather_delta_keys), 12) float
+    :param run_sets: (nrun, 5) int, the zero based index of the params, weather, harvest, doy_irr and weather delta
+                     set for each run
+    :param verbose: boolean
+    :param out_idx: None (all outputs) or the (zero based) index in out_cols of the output variables to keep
+    :param out: None or a c-contiguous (nrun, ndays, len(out_idx)) array of the dtype of the DLL (e.g. an np.memmap)
+                which fortran writes the output into directly
+    :param stops: None or (nstop, 4) float stop conditions shared by all runs (see _pack_stop_conditions), the
+                  output of a run after the day it stopped is set to nan
+    :param event_log: boolean, if True return the event log of the runs
+    :param soa: boolean, if True run fortran BASGRA_BATCH_SOA, the structure of arrays kernel which simulates the
+                consecutive runs that only differ in their weather set together, the outputs match to rounding
+    :return: y (nrun, ndays, len(out_idx)) float (out if it was passed),
+             stop_info (nrun, 2) int the zero based day each run stopped on and the (zero based) index of the stop
+             condition, -1 and -1 if the run was not stopped
+             events None or structured array (event_log_dtype) of the events of all of the runs, ordered by run
+             then day, run is the (zero based) run index and day the (zero based) day index
+    """
+    nout = len(out_cols)
+    if out_idx is None:
+        out_idx = np.arange(nout)
+    out_idx = np.ascontiguousarray(out_idx, dtype=np.int32) + 1  # fortran indexing
+    assert out_idx.ndim == 1 and (out_idx >= 1).all() and (out_idx <= nout).all(), 'out_idx out of range'
+    real, c_real_p = _real_dtype(dll_path)
+    params = np.ascontiguousarray(params, dtype=real)
+    matrix_weather = np.ascontiguousarray(matrix_weather, dtype=real)
+    harvest_events = np.ascontiguousarray(harvest_events, dtype=real)
+    doy_irr = np.ascontiguousarray(doy_irr, dtype=np.int32)
+    weather_deltas = np.ascontiguousarray(weather_deltas, dtype=real)
+    run_sets = np.atleast_2d(run_sets)
+    if stops is None:
+        stops = np.zeros((0, 4))
+    stops = np.ascontiguousarray(stops, dtype=real)
+
+    nruns = len(run_sets)
+    ndays = matrix_weather.shape[1]
+    nsets = np.array([len(params), len(matrix_weather), len(harvest_events), len(doy_irr), len(weather_deltas)])
+    assert params.ndim == 2 and params.shape[1] == len(param_keys), 'params must be (nsets, {})'.format(
+        len(param_keys))
+    assert matrix_weather.ndim == 3, 'matrix_weather must be (nsets, ndays, nweather)'
+    assert ndays <= _max_weather_size, 'maximum run size is {} days'.format(_max_weather_size)
+    assert harvest_events.ndim == 3 and harvest_events.shape[2] == len(_harvest_event_cols), (
+        'harvest_events must be (nsets, nevents, {})'.format(len(_harvest_event_cols)))
+    assert (harvest_events[:, :, 0] >= 0).all() and (harvest_events[:, :, 0] <= ndays).all(), (
+        'harvest event days must be between 1 and ndays (0 for padding)')
+    assert doy_irr.ndim == 2, 'doy_irr must be (nsets, nirr)'
+    assert weather_deltas.shape[1:] == (len(weather_delta_keys), 12), 'weather_deltas must be (nsets, {}, 12)'.format(
+        len(weather_delta_keys))
+    assert run_sets.shape == (nruns, 5), 'run_sets must be (nruns, 5)'
+    assert (run_sets >= 0).all() and (run_sets < nsets[np.newaxis]).all(), 'run_sets index a missing set'
+    run_sets = np.ascontiguousarray(run_sets + 1, dtype=np.int32)  # fortran indexing
+    assert stops.ndim == 2 and stops.shape[1] == 4, 'stops must be (nstop, 4)'
+
+    if out is None:
+        y = np.zeros((nruns, ndays, len(out_idx)), real)  # cannot set these to nan's or it breaks fortran
+    else:
+        y = out
+        assert y.shape == (nruns, ndays, len(out_idx)), 'out must be (nruns, ndays, nvars)'
+        assert y.dtype == real and y.flags.c_contiguous, 'out must be a c-contiguous {} array'.format(real)
+        assert y.flags.writeable, 'out must be writeable'
+    stop_info = np.zeros((nruns, 2), np.int32)
+    nlog = np.zeros(nruns, np.int32)
 
     # make pointers
-    # arrays # 99% sure this works
-    params_p = np.asfortranarray(params).ctypes.data_as(ct.POINTER(ct.c_double))  # 1d array, float
-    matrix_weather_p = np.asfortranarray(matrix_weather).ctypes.data_as(ct.POINTER(ct.c_double))  # 2d array, float
-    days_harvest_p = np.asfortranarray(days_harvest).ctypes.data_as(ct.POINTER(ct.c_double))  # 2d array, float
-    y_p = np.asfortranarray(y).ctypes.data_as(ct.POINTER(ct.c_double))  # 2d array, float
-    doy_irr_p = np.asfortranarray(doy_irr).ctypes.data_as(ct.POINTER(ct.c_long))
-
-    # integers
-    ndays_p = ct.pointer(ct.c_int(ndays))
-    nirr_p = ct.pointer(ct.c_int(nirr))
-    nout_p = ct.pointer(ct.c_int(nout))
-    verb_p = ct.pointer(ct.c_bool(verbose))
-
-    # load DLL 
+    c_int_p = ct.POINTER(ct.c_int)
+
     for_basgra = ct.CDLL(dll_path)
+    batch = for_basgra.BASGRA_BATCH_SOA_ if soa else for_basgra.BASGRA_BATCH_  # same arguments
+    batch(ct.pointer(ct.c_int(nruns)), run_sets.ctypes.data_as(c_int_p),
+          ct.pointer(ct.c_int(nsets[0])), params.ctypes.data_as(c_real_p),
+          ct.pointer(ct.c_int(nsets[1])), ct.pointer(ct.c_int(ndays)),
+          matrix_weather.ctypes.data_as(c_real_p),
+          ct.pointer(ct.c_int(nsets[2])), ct.pointer(ct.c_int(harvest_events.shape[1])),
+          harvest_events.ctypes.data_as(c_real_p),
+          ct.pointer(ct.c_int(nsets[3])), ct.pointer(ct.c_int(doy_irr.shape[1])),
+          doy_irr.ctypes.data_as(c_int_p),
+          ct.pointer(ct.c_int(nsets[4])), weather_deltas.ctypes.data_as(c_real_p),
+          ct.pointer(ct.c_int(len(stops))), stops.ctypes.data_as(c_real_p),
+          ct.pointer(ct.c_bool(event_log)),
+          ct.pointer(ct.c_int(nout)), ct.pointer(ct.c_int(len(out_idx))),
+          out_idx.ctypes.data_as(c_int_p), y.ctypes.data_as(c_real_p),
+          stop_info.ctypes.data_as(c_int_p), nlog.ctypes.data_as(c_int_p),
+          ct.pointer(ct.c_bool(verbose)))
+
+    stop_info = stop_info.astype(int) - 1  # zero based, -1 if not stopped
+    for i in np.where(stop_info[:, 0] >= 0)[0]:
+        y[i, stop_info[i, 0] + 1:] = np.nan
 
-    # run BASGRA
-    for_basgra.BASGRA_(params_p, matrix_weather_p, days_harvest_p, ndays_p, nout_p, nirr_p, doy_irr_p, y_p, verb_p)
+    events = None
+    if event_log:
+        # the records were appended to a buffer in fortran, copy them out now that their number is known
+        evlog = np.zeros((nlog.sum(), 6), real)
+        for_basgra.BASGRA_EVENT_LOG_(ct.pointer(ct.c_int(len(evlog))), evlog.ctypes.data_as(c_real_p))
+        events = _format_event_log(evlog, nlog)
+    return y, stop_info, events
 
-    # format results
-    y_p = np.ctypeslib.as_array(y_p, (ndays, nout))
-    y_p = y_p.flatten(order='C').reshape((ndays, nout), order='F')
-    y_p = pd.DataFrame(y_p, out_index, out_cols)
-    strs = ['{}-{:03d}'.format(int(e), int(f)) for e, f in y_p[['year', 'doy']].itertuples(False, None)]
-    y_p.loc[:, 'date'] = pd.to_datetime(strs, format='%Y-%j')
-    y_p.set_index('date', inplace=True)
 
-    return y_p
+def _format_event_log(records, nlog):
+    """
+    convert the fortran event log to a structured array
+    :param records: (nrecords, 6) float the fortran event log (day, event, 4 values) of all of the runs in run order
+    :param nlog: (nrun,) the number of records of each run
+    :return: structured array (event_log_dtype)
+    """
+    events = np.zeros(len(records), event_log_dtype)
+    events['run'] = np.repeat(np.arange(len(nlog)), nlog)
+    events['day'] = records[:, 0].astype(int) - 1
+    events['event'] = np.array(list(event_log_keys))[records[:, 1].astype(int) - 1]
+    events['values'] = records[:, 2:]
+    return events
 
 
-def _trans_manual_harv(days_harvest, matrix_weather):
+def event_log_frame(events, event, dates=None):
     """
-    translates manual harvest data to the format expected by fortran, check the details of the data in here.
-    :param days_harvest: manual harvest data
-    :param matrix_weather: weather data, mostly to get the right size
-    :return: days_harvest (correct format for fortran code)
+    the records of one kind of event from an event log as a dataframe with named columns
+    :param events: the event log from run_basgra_nz or run_basgra_multisite (event_log=True)
+    :param event: one of input_output_keys.event_log_keys ('harvest', 'reseed', 'irrigation')
+    :param dates: None or the dates of the days (e.g. the index of the run_basgra_nz output), if passed a date column
+                  is added
+    :return: pd.DataFrame with columns run, day, (date), and the values named as per event_log_keys[event]
     """
-    days_harvest = days_harvest.set_index(['year', 'doy'])
-    days_harvest_out = pd.DataFrame({'year': matrix_weather.loc[:, 'year'],
-                                     'doy': matrix_weather.loc[:, 'doy'],
-                                     'frac_harv': np.zeros(len(matrix_weather)),  # set filler values
-                                     'harv_trig': np.zeros(len(matrix_weather)) - 1,  # set flag to not harvest
-                                     'harv_targ': np.zeros(len(matrix_weather)),  # set filler values
-                                     'weed_dm_frac': np.zeros(len(matrix_weather))*np.nan,  # set nas, filled later
-                                     'reseed_trig': np.zeros(len(matrix_weather)) -1,  # set flag to not reseed
-                                     'reseed_basal': np.zeros(len(matrix_weather)),  # set filler values
-                                     })
-    days_harvest_out = days_harvest_out.set_index(['year', 'doy'])
-    for k in set(days_harvest_keys) - {'year', 'doy'}:
-        days_harvest_out.loc[days_harvest.index, k] = days_harvest.loc[:, k]
+    assert event in event_log_keys, 'event must be one of {}'.format(list(event_log_keys))
+    events = events[events['event'] == event]
+    out = pd.DataFrame({'run': events['run'], 'day': events['day']})
+    if dates is not None:
+        out['date'] = pd.DatetimeIndex(dates)[events['day']]
+    for i, k in enumerate(event_log_keys[event]):
+        out[k] = events['values'][:, i]
+    return out
 
-    days_harvest_out = days_harvest_out.reset_index()
 
-    # fill the weed fraction so that DMH_WEED is always calculated
+def fast_path_stats(enable=None, dll_path='default', supply_pet=True):
+    """
+    the number of days simulated (in this process) since the last call and how many of them were on the frost free
+    fast path.  on a fast path day there is no snow, soil frost or surface pool ice and the day is too warm (DAVTMP
+    above 0 and TrainSnow) for any to form, so the snow and frost physics are skipped.  the output is exactly the same
+    as with the full physics.  the counts are reset by each call
+    :param enable: None (leave as is), True or False to switch the fast path on or off (e.g. to compare with the full
+                   physics)
+    :param dll_path: see run_basgra_nz
+    :param supply_pet: see run_basgra_nz
+    :return: dictionary of {'days': days simulated, 'fast_days': days on the fast path, 'fast_fraction': fraction}
+    """
+    dll_path = _get_dll_path(dll_path, supply_pet)
+    for_basgra = ct.CDLL(dll_path)
+    nfast, nrun = ct.c_int(0), ct.c_int(0)
+    mode = -1 if enable is None else int(bool(enable))
+    for_basgra.BASGRA_FAST_PATH_(ct.pointer(ct.c_int(mode)), ct.byref(nfast), ct.byref(nrun))
+    return {'days': nrun.value, 'fast_days': nfast.value,
+            'fast_fraction': nfast.value / nrun.value if nrun.value > 0 else np.nan}
+
+
+def _solve_harvfrin(clv_cres_ect, fhageer, hagre_stuff, goal, tol=1e-5, dll_path='default', supply_pet=True):
+    """
+    run the harvest fraction solver of the fortran code (plant.f95 solve_harvfrin) on its own, i.e. solve
+    clv_cres_ect * x * 10 + x ** (1 - fhageer) * hagre_stuff * 10 = goal for the harvest fraction x
+    :param clv_cres_ect: array like, the harvestable leaf terms
+    :param fhageer: array like, HAGERE (0-1)
+    :param hagre_stuff: array like, the harvestable stem terms
+    :param goal: array like, the rye dry matter to remove (kg DM ha-1)
+    :param tol: the relative tolerance on x, the model uses 1e-5
+    :param dll_path: see run_basgra_nz
+    :param supply_pet: see run_basgra_nz
+    :return: x (harvest fractions, 1 if the goal cannot be met), niter (the iterations used) as arrays
+    """
+    assert ((np.asarray(fhageer) >= 0) & (np.asarray(fhageer) <= 1)).all(), 'fhageer (HAGERE) must be between 0 and 1'
+    dll_path = _get_dll_path(dll_path, supply_pet)
+    real, c_real_p = _real_dtype(dll_path)
+    inputs = np.broadcast_arrays(clv_cres_ect, fhageer, hagre_stuff, goal)
+    inputs = [np.ascontiguousarray(e, dtype=real).ravel() for e in inputs]
+    n = len(inputs[0])
+    x = np.zeros(n, real)
+    niter = np.zeros(n, np.int32)
+    for_basgra = ct.CDLL(dll_path)
+    for_basgra.BASGRA_SOLVE_HARVFRIN_(ct.pointer(ct.c_int(n)), *[e.ctypes.data_as(c_real_p) for e in inputs],
+                                      ct.byref(np.ctypeslib.as_ctypes_type(real)(tol)), x.ctypes.data_as(c_real_p),
+                                      niter.ctypes.data_as(_c_int_p))
+    return x, niter
+
+
+def _pack_stop_conditions(stop_conditions):
+    """
+    check and pack the stop conditions for fortran
+    :param stop_conditions: None or a list of (var, kind, threshold) or (var, kind, threshold, ndays) where:
+                            var: an output variable (out_cols)
+                            kind: 'below' (var < threshold), 'above' (var > threshold) or 'total_above' (the total of
+                                  var from the start of the run > threshold, e.g. for IRRIG)
+                            threshold: float
+                            ndays: the number of consecutive days the condition must be met on (default 1)
+                            e.g. [('BASAL', 'below', 5), ('DM', 'below', 1000, 120), ('IRRIG', 'total_above', 500)]
+    :return: None or (nstop, 4) float array of the 1 based index of var, the kind code, threshold and ndays
+    """
+    if stop_conditions is None:
+        return None
+    assert len(stop_conditions) > 0, 'stop_conditions must not be empty, pass None for no stop conditions'
+    out = np.zeros((len(stop_conditions), 4))
+    for i, condition in enumerate(stop_conditions):
+        assert len(condition) in (3, 4), 'stop conditions must be (var, kind, threshold[, ndays]), got {}'.format(
+            condition)
+        var, kind, threshold = condition[:3]
+        ndays = condition[3] if len(condition) == 4 else 1
+        assert var in out_cols, 'unexpected stop condition variable: {}'.format(var)
+        assert kind in _stop_kinds, 'stop condition kind must be one of {}, got {}'.format(list(_stop_kinds), kind)
+        assert np.isfinite(threshold), 'stop condition threshold must be finite'
+        assert int(ndays) == ndays and ndays >= 1, 'stop condition ndays must be an integer >= 1'
+        out[i] = [out_cols.index(var) + 1, _stop_kinds[kind], threshold, ndays]
+    return out
 
-    if pd.isna(days_harvest_out.weed_dm_frac).iloc[0]:
-        warn('weed_dm_frac is na for the first day of simulation, setting to first valid weed_dm_frac\n'
-             'this does not affect the harvesting only the calculation of the DMH_weed variable.')
 
-        idx = np.where(pd.notna(days_harvest_out.weed_dm_frac))[0][0]  # get first non-nan value
-        id_val = pd.Series(days_harvest_out.index).iloc[0]
-        days_harvest_out.loc[id_val, 'weed_dm_frac'] = days_harvest_out.loc[:, 'weed_dm_frac'].iloc[idx]
+def _format_stop(stop_info, index):
+    """
+    format the stop_info of one run for run_basgra_nz
+    :param stop_info: (2,) zero based stop day and condition index, -1 if the run was not stopped
+    :param index: the date index of the output
+    :return: None or dictionary of {'date': date, 'condition': condition index}
+    """
+    if stop_info[0] < 0:
+        return None
+    return {'date': index[stop_info[0]], 'condition': int(stop_info[1])}
 
-    days_harvest_out.loc[:, 'weed_dm_frac'] = days_harvest_out.loc[:, 'weed_dm_frac'].fillna(method='ffill')
 
-    return days_harvest_out
+def _format_output(y, out_index):
+    """
+    format the (ndays, nout) output of one run as a dataframe with a date index
+    :param y: (ndays, nout) array
+    :param out_index: the index of matrix_weather
+    :return: pd.DataFrame
+    """
+    y = pd.DataFrame(y, out_index, out_cols)
+    # the days are consecutive (see _test_basgra_inputs), so the dates run on from the first day, which is always
+    # set even if the run was stopped early
+    start = pd.to_datetime('{}-{:03d}'.format(int(y['year'].iloc[0]), int(y['doy'].iloc[0])), format='%Y-%j')
+    y.loc[:, 'date'] = pd.date_range(start, periods=len(y), freq='D')
+    y.set_index('date', inplace=True)
+    return y
 
 
 def _test_basgra_inputs(params, matrix_weather, days_harvest, verbose, _matrix_weather_keys,
@@ -204,40 +1340,19 @@ def _test_basgra_inputs(params, matrix_weather, days_harvest, verbose, _matrix_w
     assert isinstance(verbose, bool), 'verbose must be boolean'
     assert isinstance(params, dict)
     assert set(params.keys()) == set(param_keys), 'incorrect params keys'
-    assert not any([np.isnan(e) for e in params.values()]), 'params cannot have na data'
-
-    assert params['reseed_harv_delay'] >= 1, 'harvest delay must be >=1'
-    assert params['reseed_harv_delay'] % 1 < 1e5, 'harvest delay must effectively be an integer'
-
 
-    # check matrix weather
+    # check matrix weather, the values (na, contiguous dates, etc.) are checked on the packed arrays (validate_inputs)
     assert isinstance(matrix_weather, pd.DataFrame)
     assert set(matrix_weather.keys()) == set(_matrix_weather_keys), 'incorrect keys for matrix_weather'
     assert pd.api.types.is_integer_dtype(matrix_weather.doy), 'doy must be an integer datatype in matrix_weather'
     assert pd.api.types.is_integer_dtype(matrix_weather.year), 'year must be an integer datatype in matrix_weather'
     assert len(matrix_weather) <= _max_weather_size, 'maximum run size is {} days'.format(_max_weather_size)
-    assert not matrix_weather.isna().any().any(), 'matrix_weather cannot have na values'
-
-    # check to make sure there are no missing days in matrix_weather
-    start_year = matrix_weather['year'].min()
-    start_day = matrix_weather.loc[matrix_weather.year == start_year, 'doy'].min()
-
-    stop_year = matrix_weather['year'].max()
-    stop_day = matrix_weather.loc[matrix_weather.year == stop_year, 'doy'].max()
-
-    expected_days = pd.Series(pd.date_range(start=pd.to_datetime('{}-{}'.format(start_year, start_day), format='%Y-%j'),
-                                            end=pd.to_datetime('{}-{}'.format(stop_year, stop_day), format='%Y-%j')))
-    check = (matrix_weather['year'].values == expected_days.dt.year.values).all() and (
-            matrix_weather['doy'].values == expected_days.dt.dayofyear.values).all()
-    assert check, 'the date range of matrix_weather contains missing or duplicate days'
 
     # check harvest data
     assert isinstance(days_harvest, pd.DataFrame)
     assert set(days_harvest.keys()) == set(days_harvest_keys), 'incorrect keys for days_harvest'
     assert pd.api.types.is_integer_dtype(days_harvest.doy), 'doy must be an integer datatype in days_harvest'
     assert pd.api.types.is_integer_dtype(days_harvest.year), 'year must be an integer datatype in days_harvest'
-    assert not days_harvest.isna().any().any(), 'days_harvest cannot have na data'
-    assert (days_harvest['frac_harv'] <= 1).all(), 'frac_harv cannot be greater than 1'
     if params['fixed_removal'] > 0.9:
         assert (days_harvest['harv_trig'] >=
                 days_harvest['harv_targ']).all(), 'when using fixed harvest mode the harv_trig>=harv_targ'
@@ -246,22 +1361,19 @@ def _test_basgra_inputs(params, matrix_weather, days_harvest, verbose, _matrix_w
         assert len(matrix_weather) == len(
             days_harvest), 'days_harvest and matrix_weather must be the same length(ndays)'
 
-        check = (days_harvest['year'].values == expected_days.dt.year.values).all() and (
-                days_harvest['doy'].values == expected_days.dt.dayofyear.values).all()
-        assert check, 'the date range of matrix_weather contains missing or duplicate days'
-    else:
-
-        strs = ['{}-{:03d}'.format(int(e), int(f)) for e, f in days_harvest[['year', 'doy']].itertuples(False, None)]
-        harvest_dt = pd.to_datetime(strs, format='%Y-%j')
-        assert harvest_dt.min() >= expected_days.min(), 'days_harvest must start at or after first day of simulation'
-        assert harvest_dt.max() <= expected_days.max(), 'days_harvest must stop at or before last day of simulation'
+        check = (days_harvest[['year', 'doy']].values == matrix_weather[['year', 'doy']].values).all()
+        assert check, 'days_harvest and matrix_weather dates must match'
+    elif len(days_harvest) > 0:
+        # the weather dates are contiguous (validate_inputs) so the first and last rows are the simulation period
+        dates = days_harvest['year'].values * 1000 + days_harvest['doy'].values
+        weather_dates = matrix_weather['year'].values * 1000 + matrix_weather['doy'].values
+        assert dates.min() >= weather_dates[0], 'days_harvest must start at or after first day of simulation'
+        assert dates.max() <= weather_dates[-1], 'days_harvest must stop at or before last day of simulation'
 
     # doy_irr tests
     assert isinstance(doy_irr, np.ndarray), 'doy_irr must be convertable to a numpy array'
     assert doy_irr.ndim == 1, 'doy_irr must be 1d'
     assert pd.api.types.is_integer_dtype(doy_irr), 'doy_irr must be integers'
-    assert doy_irr.max() <= 366, 'entries doy_irr must not be greater than 366'
-    assert doy_irr.min() >= 0, 'entries doy_irr must not be less than 0'
 
 
 if __name__ == '__main__':
@@ -0,0 +1,156 @@
+"""
+the accuracy of the single precision (float32) DLLs (dll_path='single'): every case in test_basgra_python.py is run
+with both the default (float64) and the single precision DLLs and the deviation of each output column is reported, so
+that the precision given up by running large screening ensembles in float32 is known.  run this file for the report.
+
+ Created: 19/10/2026
+ """
+import inspect
+import numpy as np
+import pandas as pd
+import check_basgra_python.test_basgra_python as test_basgra_python
+from input_output_keys import out_cols, farm_out_keys
+
+_stat_cols = ['max_abs', 'mean_abs', 'max_rel', 'scale', 'nan_mismatch']
+
+
+def compare_precision(double, single, columns):
+    """
+    the deviation of single precision output from the double precision output of the same runs per output column
+    :param double: (..., len(columns)) float64 output (array or dataframe)
+    :param single: (..., len(columns)) float32 output
+    :param columns: the output variable of each column
+    :return: pd.DataFrame index: columns, columns:
+             max_abs: maximum absolute deviation
+             mean_abs: mean absolute deviation
+             max_rel: max_abs relative to the scale of the column (0 if the scale is 0)
+             scale: maximum absolute value of the double precision output
+             nan_mismatch: number of values that are nan in only one of the outputs (e.g. a run stopped on a
+                           different day), these are not included in the other stats
+    """
+    double = np.asarray(double, float).reshape(-1, len(columns))
+    single = np.asarray(single, float).reshape(-1, len(columns))
+    assert double.shape == single.shape, 'double and single must have the same shape'
+    nan_double, nan_single = np.isnan(double), np.isnan(single)
+    both = ~nan_double & ~nan_single
+    dev = np.where(both, np.abs(single - double), 0)
+    scale = np.where(both, np.abs(double), 0).max(axis=0, initial=0)
+    out = pd.DataFrame(index=pd.Index(list(columns), name='variable'), columns=_stat_cols, dtype=float)
+    out['max_abs'] = dev.max(axis=0, initial=0)
+    out['mean_abs'] = dev.sum(axis=0) / np.maximum(both.sum(axis=0), 1)
+    out['max_rel'] = np.where(scale > 0, out['max_abs'] / np.where(scale > 0, scale, 1), 0)
+    out['scale'] = scale
+    out['nan_mismatch'] = (nan_double != nan_single).sum(axis=0)
+    return out
+
+
+class _PrecisionRecorder(object):
+    def __init__(self):
+        """
+        replaces the run functions of test_basgra_python with versions that also run the single precision DLLs and
+        record the deviation of each run, the double precision output is returned so the tests run as normal
+        """
+        self.cases = []
+        self.test_name = None
+        self._originals = {}
+
+    def _record(self, double, single, columns):
+        self.cases.append(('{} {}'.format(self.test_name, len(self.cases)),
+                           compare_precision(double, single, columns)))
+
+    def _wrap(self, name, compare):
+        func = getattr(test_basgra_python, name)
+        self._originals[name] = func
+
+        def wrapped(*args, **kwargs):
+            out = func(*args, **kwargs)
+            if kwargs.get('dll_path', 'default') == 'default':
+                single_kwargs = dict(kwargs, dll_path='single')
+                if 'out' in single_kwargs:
+                    single_kwargs['out'] = None  # a preallocated float64 output cannot be used by the float32 DLLs
+                compare(out, func(*args, **single_kwargs), kwargs)
+            return out
+
+        setattr(test_basgra_python, name, wrapped)
+
+    def __enter__(self):
+        def first(out):
+            return out[0] if isinstance(out, tuple) else out
+
+        def site(double, single, kwargs):
+            double, single = first(double), first(single)
+            self._record(double, single, double.columns)
+
+        def deltas(double, single, kwargs):
+            double, single = first(double), first(single)
+            for k in double.keys():
+                self._record(double[k], single[k], double[k].columns)
+
+        def multisite(double, single, kwargs):
+            columns = kwargs.get('out_vars') or out_cols
+            self._record(first(double), first(single), columns)
+
+        def farm(double, single, kwargs):
+            self._record(double[0], single[0], kwargs.get('out_vars') or out_cols)
+            self._record(double[1], single[1], farm_out_keys)
+
+        self._wrap('run_basgra_nz', site)
+        self._wrap('run_basgra_nz_deltas', deltas)
+        self._wrap('run_basgra_multisite', multisite)
+        self._wrap('run_basgra_farm', farm)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for name, func in self._originals.items():
+            setattr(test_basgra_python, name, func)
+
+
+def precision_report(tests=None):
+    """
+    run the cases of test_basgra_python.py with the double and single precision DLLs and report the deviations.
+    the single precision runs are only compared, the tests check the double precision runs as normal.  the
+    simulations of BasgraSimulation match run_basgra_nz exactly so they are not run again
+    :param tests: None (all tests) or a list of the names of the test functions to run
+    :return: (summary, cases, failed) where:
+             summary: pd.DataFrame index: output variable, columns: max_abs, mean_abs (of all cases), max_rel,
+                      scale, nan_mismatch (sum over the cases) and worst_case (the case with the largest max_rel)
+             cases: dictionary of {case name: pd.DataFrame of that case, see compare_precision}
+             failed: dictionary of {test name: exception} of the tests whose own checks failed, the runs of these
+                     tests after the failure were not compared
+    """
+    functions = [f for n, f in inspect.getmembers(test_basgra_python, inspect.isfunction)
+                 if n.startswith('test_') and f.__module__ == test_basgra_python.__name__]
+    functions = sorted(functions, key=lambda f: f.__code__.co_firstlineno)
+    if tests is not None:
+        bad = set(tests) - {f.__name__ for f in functions}
+        assert len(bad) == 0, 'unexpected tests: {}'.format(bad)
+        functions = [f for f in functions if f.__name__ in tests]
+
+    failed = {}
+    with _PrecisionRecorder() as recorder:
+        for function in functions:
+            recorder.test_name = function.__name__
+            try:
+                function()
+            except Exception as val:
+                failed[function.__name__] = val
+    cases = dict(recorder.cases)
+    assert len(cases) > 0, 'no cases were run'
+
+    stacked = pd.concat(cases, names=['case'])
+    grouped = stacked.groupby(level='variable', sort=False)
+    summary = grouped[['max_abs', 'max_rel', 'scale']].max()
+    summary['mean_abs'] = grouped['mean_abs'].mean()
+    summary['nan_mismatch'] = grouped['nan_mismatch'].sum()
+    summary['worst_case'] = grouped['max_rel'].idxmax().str[0]
+    summary = summary[_stat_cols + ['worst_case']]
+    return summary, cases, failed
+
+
+if __name__ == '__main__':
+    summary, cases, failed = precision_report()
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+        print('\n\nsingle precision deviation of {} cases'.format(len(cases)))
+        print(summary.sort_values('max_rel', ascending=False))
+    if len(failed) > 0:
+        print('\nthe checks of these tests failed, their later runs were not compared: {}'.format(list(failed)))
@@ -6,8 +6,10 @@ import pandas as pd
 import os
 import numpy as np
 import sys
+from warnings import warn
 sys.path.append("..")
 
+from input_output_keys import days_harvest_keys
 from supporting_functions.conversions import convert_RH_vpa
 from supporting_functions.woodward_2020_params import get_woodward_mean_full_params
 
@@ -307,4 +309,44 @@ if __name__ == '__main__':
     # days_harvest.to_csv(r"C:\Users\BTHRO\Downloads\days_harvest.csv")
     params1, matrix_weather1, days_harvest1, doy_irr1 = _compair_pet()
 
-    # print(params)
\ No newline at end of file
+    # print(params)
+
+
+def _trans_manual_harv(days_harvest, matrix_weather):
+    """
+    translates manual harvest data to the daily (auto harvest) format.  run_basgra_nz passes the manual harvest rows
+    straight to fortran as sparse events (basgra_python._get_harvest_events), this is kept to check that a manual
+    harvest run matches the equivalent daily (auto harvest) run.
+    :param days_harvest: manual harvest data
+    :param matrix_weather: weather data, mostly to get the right size
+    :return: days_harvest (correct format for fortran code)
+    """
+    days_harvest = days_harvest.set_index(['year', 'doy'])
+    days_harvest_out = pd.DataFrame({'year': matrix_weather.loc[:, 'year'],
+                                     'doy': matrix_weather.loc[:, 'doy'],
+                                     'frac_harv': np.zeros(len(matrix_weather)),  # set filler values
+                                     'harv_trig': np.zeros(len(matrix_weather)) - 1,  # set flag to not harvest
+                                     'harv_targ': np.zeros(len(matrix_weather)),  # set filler values
+                                     'weed_dm_frac': np.zeros(len(matrix_weather))*np.nan,  # set nas, filled later
+                                     'reseed_trig': np.zeros(len(matrix_weather)) -1,  # set flag to not reseed
+                                     'reseed_basal': np.zeros(len(matrix_weather)),  # set filler values
+                                     })
+    days_harvest_out = days_harvest_out.set_index(['year', 'doy'])
+    for k in set(days_harvest_keys) - {'year', 'doy'}:
+        days_harvest_out.loc[days_harvest.index, k] = days_harvest.loc[:, k]
+
+    days_harvest_out = days_harvest_out.reset_index()
+
+    # fill the weed fraction so that DMH_WEED is always calculated
+
+    if pd.isna(days_harvest_out.weed_dm_frac).iloc[0]:
+        warn('weed_dm_frac is na for the first day of simulation, setting to first valid weed_dm_frac\n'
+             'this does not affect the harvesting only the calculation of the DMH_weed variable.')
+
+        idx = np.where(pd.notna(days_harvest_out.weed_dm_frac))[0][0]  # get first non-nan value
+        id_val = pd.Series(days_harvest_out.index).iloc[0]
+        days_harvest_out.loc[id_val, 'weed_dm_frac'] = days_harvest_out.loc[:, 'weed_dm_frac'].iloc[idx]
+
+    days_harvest_out.loc[:, 'weed_dm_frac'] = days_harvest_out.loc[:, 'weed_dm_frac'].fillna(method='ffill')
+
+    return days_harvest_out
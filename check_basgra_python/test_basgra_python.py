@@ -5,10 +5,13 @@
 import os
 import numpy as np
 import pandas as pd
-from basgra_python import run_basgra_nz, _trans_manual_harv
-from input_output_keys import matrix_weather_keys_pet
+from basgra_python import run_basgra_nz, _solve_harvfrin, run_basgra_nz_deltas, run_basgra_multisite, \
+    iter_basgra_multisite, event_log_frame, BasgraSimulation, run_basgra_farm, fast_path_stats, validate_inputs, \
+    BasgraInputError
+from input_output_keys import matrix_weather_keys_pet, out_cols, event_log_keys, state_keys, farm_out_keys, param_keys
 from check_basgra_python.support_for_tests import establish_org_input, get_org_correct_values, get_lincoln_broadfield, \
-    test_dir, establish_peyman_input, _clean_harvest, base_auto_harvest_data, base_manual_harvest_data
+    test_dir, establish_peyman_input, _clean_harvest, base_auto_harvest_data, base_manual_harvest_data, \
+    _trans_manual_harv
 
 from supporting_functions.plotting import plot_multiple_results  # used in test development and debugging
 
@@ -433,6 +436,59 @@ def test_weed_fraction_man(update_data=False):
     _output_checks(out, correct_out)
 
 
+def test_harvfrin_solver(update_data=False):
+    print('testing the harvest fraction solver')
+
+    def f(x, clv_cres_ect, fhageer, hagre_stuff):
+        return clv_cres_ect * x * 10 + x ** (1 - fhageer) * hagre_stuff * 10
+
+    rng = np.random.default_rng(26)
+    n = 2000
+    clv_cres_ect = rng.uniform(1, 500, n)
+    fhageer = rng.uniform(0.5, 0.95, n)
+    hagre_stuff = rng.uniform(1, 500, n)
+    goal = f(1, clv_cres_ect, fhageer, hagre_stuff) * 10 ** rng.uniform(-4, -0.001, n)
+
+    # the root is bracketed in (0, 1) and matches a bisection to the tolerance
+    x, niter = _solve_harvfrin(clv_cres_ect, fhageer, hagre_stuff, goal)
+    assert ((x > 0) & (x < 1)).all()
+    lo, hi = np.full(n, -700.), np.zeros(n)  # bisection of ln(x), as some of the roots are tiny
+    for _ in range(100):
+        mid = 0.5 * (lo + hi)
+        above = f(np.exp(mid), clv_cres_ect, fhageer, hagre_stuff) > goal
+        hi = np.where(above, mid, hi)
+        lo = np.where(above, lo, mid)
+    assert np.allclose(x, np.exp(0.5 * (lo + hi)), rtol=1e-4, atol=0)
+    assert np.allclose(f(x, clv_cres_ect, fhageer, hagre_stuff), goal, rtol=1e-4, atol=0)
+    assert (niter >= 1).all() and (niter < 50).all() and niter.mean() < 10, niter.mean()
+
+    # a goal at or above the harvestable material harvests everything without iterating
+    x, niter = _solve_harvfrin(clv_cres_ect, fhageer, hagre_stuff, f(1, clv_cres_ect, fhageer, hagre_stuff) * 1.1)
+    assert (x == 1).all() and (niter == 0).all()
+
+    # the solver only holds for HAGERE between 0 and 1
+    try:
+        _solve_harvfrin(10, 1.3, 200, 150)
+        raise ValueError('HAGERE > 1 should raise an assertion error')
+    except AssertionError:
+        pass
+
+    # the iterations are reported in the event log on harvest days, 0 without opt_harvfrin
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    params['fixed_removal'] = 0
+    for opt_harvfrin in [0, 1]:
+        params['opt_harvfrin'] = opt_harvfrin
+        out, events = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose, event_log=True)
+        harvests = event_log_frame(events, 'harvest')
+        assert len(harvests) > 0
+        if opt_harvfrin:
+            assert (harvests['HARVFRIN_NITER'] > 0).any()
+            assert (harvests['HARVFRIN_NITER'] < 50).all()
+        else:
+            assert (harvests['HARVFRIN_NITER'] == 0).all()
+
+
 # automatic harvesting tests
 
 def test_auto_harv_trig(update_data=False):
@@ -636,6 +692,639 @@ def test_reseed(update_data=False):
 
 
 
+def test_weather_deltas(update_data=False):
+    print('testing weather deltas')
+    # deltas applied in fortran must match the same change made to matrix_weather
+    def month(mw):
+        dates = ['{}-{:03d}'.format(y, d) for y, d in mw[['year', 'doy']].itertuples(False, None)]
+        return pd.to_datetime(dates, format='%Y-%j').month.values - 1
+
+    monthly = np.linspace(0.7, 1.2, 12)
+
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    weather_deltas = {'tmin_add': 1.5, 'tmax_add': np.arange(12) / 4, 'rain_mult': monthly, 'pet_mult': 1.1}
+    out = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose, weather_deltas=weather_deltas)
+
+    m = month(matrix_weather)
+    matrix_weather.loc[:, 'tmin'] += 1.5
+    matrix_weather.loc[:, 'tmax'] += (np.arange(12) / 4)[m]
+    matrix_weather.loc[:, 'rain'] *= monthly[m]
+    matrix_weather.loc[:, 'pet'] *= 1.1
+    correct_out = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose)
+    _output_checks(out, correct_out)
+
+    params, matrix_weather, days_harvest, doy_irr = establish_peyman_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    weather_deltas = {'radn_mult': monthly, 'vpa_mult': 0.9, 'wind_add': 0.5}
+    out = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose, supply_pet=False,
+                        weather_deltas=weather_deltas)
+
+    m = month(matrix_weather)
+    matrix_weather.loc[:, 'radn'] *= monthly[m]
+    matrix_weather.loc[:, 'vpa'] *= 0.9
+    matrix_weather.loc[:, 'wind'] += 0.5
+    correct_out = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose, supply_pet=False)
+    _output_checks(out, correct_out)
+
+
+def test_weather_delta_grid(update_data=False):
+    print('testing weather delta grid')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    scenarios = {
+        'base': None,
+        'warm': {'tmin_add': 2, 'tmax_add': 2},
+        'dry': {'rain_mult': 0.8, 'pet_mult': 1.05},
+    }
+    outs = run_basgra_nz_deltas(params, matrix_weather, days_harvest, doy_irr, scenarios, verbose=verbose)
+    for k, weather_deltas in scenarios.items():
+        correct_out = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose,
+                                    weather_deltas=weather_deltas)
+        _output_checks(outs[k], correct_out)
+
+
+
+def test_multisite(update_data=False):
+    print('testing multisite')
+    # each site of the multisite run must match run_basgra_nz for that site
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    weather = []
+    for i in range(3):
+        mw = matrix_weather.copy()
+        mw.loc[:, 'tmin'] += i
+        mw.loc[:, 'rain'] *= 1 - 0.2 * i
+        weather.append(mw.loc[:, matrix_weather_keys_pet].values)
+    weather = np.stack(weather)
+    site_params = pd.DataFrame({'LAT': [-35., -41., -45.], 'IRRIGF': [0., 0.5, 1.]})
+    site_irr = [doy_irr, [0], list(range(1, 100))]
+
+    out_vars = ['DM', 'YIELD', 'BASAL', 'IRRIG']
+    out = run_basgra_multisite(params, weather, days_harvest, site_irr, site_params=site_params, verbose=verbose,
+                               auto_harvest=False)
+    out2 = run_basgra_multisite(params, weather, days_harvest, site_irr, site_params=site_params, verbose=verbose,
+                                auto_harvest=False, out_vars=out_vars, chunk_size=2)
+    idx = [out_cols.index(e) for e in out_vars]
+    assert np.array_equal(out[:, :, idx], out2, equal_nan=True), 'out_vars and chunking should not change results'
+
+    # output written straight into a preallocated array, and weather shared by all of the sites
+    out3 = np.zeros(out2.shape)
+    run_basgra_multisite(params, np.repeat(weather[:1], 3, axis=0), days_harvest, site_irr, site_params=site_params,
+                         verbose=verbose, auto_harvest=False, out_vars=out_vars, out=out3)
+    out4 = run_basgra_multisite(params, weather[0], days_harvest, site_irr, site_params=site_params, verbose=verbose,
+                                auto_harvest=False, out_vars=out_vars)
+    assert np.array_equal(out3, out4, equal_nan=True), 'shared weather should match repeated weather'
+
+    # workers writing straight into a .npy file, the chunks are offset by the header and the earlier chunks
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'out.npy')
+        out5 = np.lib.format.open_memmap(path, mode='w+', dtype=float, shape=out2.shape)
+        out5[:] = -1
+        run_basgra_multisite(params, weather, days_harvest, site_irr, site_params=site_params, verbose=verbose,
+                             auto_harvest=False, out_vars=out_vars, nprocesses=2, chunk_size=2, out=out5)
+        del out5
+        assert np.array_equal(np.load(path), out2, equal_nan=True), 'the file should match the in memory output'
+
+    # streamed chunks
+    streamed = iter_basgra_multisite(params, weather, days_harvest, site_irr, site_params=site_params,
+                                     verbose=verbose, auto_harvest=False, out_vars=out_vars, chunk_size=2)
+    starts, chunks = zip(*streamed)
+    assert starts == (0, 2), 'chunks should be yielded in order'
+    assert np.array_equal(np.concatenate(chunks), out2, equal_nan=True), 'streamed chunks should match'
+
+    for i in range(3):
+        site_param = dict(params)
+        site_param.update(site_params.iloc[i].to_dict())
+        mw = pd.DataFrame(weather[i], columns=matrix_weather_keys_pet, index=matrix_weather.index)
+        mw = mw.astype({'year': int, 'doy': int})
+        correct_out = run_basgra_nz(site_param, mw, days_harvest, site_irr[i], verbose=verbose)
+        _output_checks(pd.DataFrame(out[i], columns=out_cols), correct_out)
+
+
+def test_harvest_events(update_data=False):
+    print('testing sparse harvest events')
+    # manual harvests are passed to fortran as sparse events, they must match the daily (auto harvest) format
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    days_harvest.loc[days_harvest.index[-1], 'reseed_trig'] = 1  # reseed on the last harvest day
+    params['reseed_harv_delay'] = 500  # longer than the rest of the run
+
+    out = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose)
+    daily = _trans_manual_harv(days_harvest, matrix_weather)
+    correct_out = run_basgra_nz(params, matrix_weather, daily, doy_irr, verbose=verbose, auto_harvest=True)
+    _output_checks(out, correct_out)
+    assert out['RESEEDED'].sum() == 1, 'the last harvest day should reseed'
+
+    # the order of the manual harvest rows does not matter
+    shuffled = days_harvest.sample(frac=1, random_state=1)
+    _output_checks(run_basgra_nz(params, matrix_weather, shuffled, doy_irr, verbose=verbose), correct_out)
+
+
+def test_shared_inputs(update_data=False):
+    print('testing that inputs are not modified')
+    # reseeding must not change the inputs, so one harvest set can be shared by many runs
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    days_harvest.loc[:, 'reseed_trig'] = 1  # reseed on every harvest day
+    params['reseed_harv_delay'] = 40
+    inputs = (dict(params), matrix_weather.copy(), days_harvest.copy(), list(doy_irr))
+
+    out = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose)
+    assert params == inputs[0], 'params should not be modified'
+    assert matrix_weather.equals(inputs[1]), 'matrix_weather should not be modified'
+    assert days_harvest.equals(inputs[2]), 'days_harvest should not be modified'
+    assert list(doy_irr) == inputs[3], 'doy_irr should not be modified'
+
+    weather = matrix_weather.loc[:, matrix_weather_keys_pet].values
+    multi = run_basgra_multisite(params, weather, days_harvest, doy_irr, site_params=pd.DataFrame({'LAT': [-35.] * 3}),
+                                 verbose=verbose, auto_harvest=False)
+    for i in range(3):
+        assert np.array_equal(multi[i], multi[0], equal_nan=True), 'runs sharing inputs should match'
+    assert out['RESEEDED'].sum() > 1, 'the test should reseed more than once'
+
+
+def test_stop_conditions(update_data=False):
+    print('testing stop conditions')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    full = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose)
+
+    # conditions which are never met give the full run
+    out, stop = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose,
+                              stop_conditions=[('BASAL', 'below', -1)])
+    assert stop is None, 'the run should not stop'
+    assert np.array_equal(out.values, full.values, equal_nan=True), 'an unmet stop condition should not change the run'
+
+    # each kind stops on the first day it is met, the output up to then matches the full run
+    total_evap = full['EVAP'].cumsum()
+    conditions = [('DM', 'above', full['DM'].iloc[100]), ('EVAP', 'total_above', total_evap.iloc[-1] / 2),
+                  ('BASAL', 'below', full['BASAL'].max() + 1, 10)]
+    expected_days = [(full['DM'] > conditions[0][2]).values.argmax(),
+                     (total_evap > conditions[1][2]).values.argmax(),
+                     9]
+    for condition, expected in zip(conditions, expected_days):
+        out, stop = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose,
+                                  stop_conditions=[('BASAL', 'below', -1), condition])
+        assert stop == {'date': full.index[expected], 'condition': 1}, 'unexpected stop for {}'.format(condition)
+        assert np.array_equal(out.values[:expected + 1], full.values[:expected + 1], equal_nan=True)
+        assert np.isnan(out.values[expected + 1:]).all(), 'output after the stop should be nan'
+
+    # the first condition met is reported and each site stops on its own
+    weather = matrix_weather.loc[:, matrix_weather_keys_pet].values
+    site_params = pd.DataFrame({'BASALI': [params['BASALI'], params['BASALI'] * 0.01]})
+    multi, stops = run_basgra_multisite(params, weather, days_harvest, doy_irr, site_params=site_params,
+                                        verbose=verbose, auto_harvest=False, out_vars=['DM'],
+                                        stop_conditions=[('BASAL', 'below', full['BASAL'].min() - 0.01),
+                                                         conditions[1]])
+    assert stops[0].tolist() == [expected_days[1], 1], 'the first site should stop on the evaporation total'
+    assert stops[1, 1] == 0 and stops[1, 0] < expected_days[1], 'the second site should stop on low BASAL'
+    assert np.isnan(multi[1, stops[1, 0] + 1:]).all() and not np.isnan(multi[1, :stops[1, 0] + 1]).any()
+
+
+def test_event_log(update_data=False):
+    print('testing the event log')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input('lincoln')
+    matrix_weather = get_lincoln_broadfield()
+    matrix_weather.loc[:, 'max_irr'] = 15
+    matrix_weather.loc[:, 'irr_trig'] = 0.5
+    matrix_weather.loc[:, 'irr_targ'] = 1
+    matrix_weather = matrix_weather.loc[:, matrix_weather_keys_pet]
+    params['IRRIGF'] = 1
+    # as per test_reseed, these values are set to make observable changes and are not reasonable values.
+    params['reseed_harv_delay'] = 40
+    params['reseed_LAI'] = 3
+    params['reseed_TILG2'] = 10
+    params['reseed_TILG1'] = 40
+    params['reseed_TILV'] = 5000
+    params['reseed_CLV'] = 100
+    params['reseed_CRES'] = 25
+    params['reseed_CST'] = 10
+    params['reseed_CSTUB'] = 0.5
+    doy_irr = list(range(305, 367)) + list(range(1, 91))
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    days_harvest.loc[days_harvest.index[::3], 'reseed_trig'] = 1  # reseed on some of the harvest days
+    days_harvest.loc[:, 'reseed_basal'] = 0.8
+
+    full = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose)
+    out, events = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose, event_log=True)
+    assert np.array_equal(out.values, full.values, equal_nan=True), 'the event log should not change the output'
+    assert (events['run'] == 0).all()
+    assert (np.diff(events['day']) >= 0).all(), 'events should be in the order they happened'
+
+    # the events match the daily output
+    checks = {'harvest': out['HARVFR'] > 0, 'reseed': out['RESEEDED'] > 0, 'irrigation': out['IRRIG'] > 0}
+    for event, days in checks.items():
+        frame = event_log_frame(events, event, out.index)
+        assert len(frame) > 0, 'the test should have {} events'.format(event)
+        if event == 'harvest':
+            assert set(np.where(days)[0]) <= set(frame['day']), 'missing harvest events'
+        else:
+            assert np.array_equal(frame['day'], np.where(days)[0]), 'unexpected {} days'.format(event)
+        assert (frame['date'].values == out.index[frame['day']].values).all()
+        for k in event_log_keys[event]:
+            if k == 'HARVFRIN_NITER':
+                continue  # not a daily output, see test_harvfrin_solver
+            assert np.allclose(frame[k].values, out[k].values[frame['day']]), '{} {} does not match'.format(event, k)
+
+    # batch runs, run is the site index and the log is the same with or without the daily output
+    weather = matrix_weather.loc[:, matrix_weather_keys_pet].values
+    site_params = pd.DataFrame({'BASALI': [params['BASALI'], params['BASALI'] * 0.5, params['BASALI']]})
+    multi, multi_events = run_basgra_multisite(params, weather, days_harvest, doy_irr, site_params=site_params,
+                                               verbose=verbose, auto_harvest=False, out_vars=[], event_log=True,
+                                               chunk_size=2)
+    assert multi.shape == (3, len(out), 0)
+    assert np.array_equal(multi_events[multi_events['run'] == 0], events)
+    site_2 = multi_events[multi_events['run'] == 2]
+    site_2['run'] = 0
+    assert np.array_equal(site_2, events)
+    assert not np.array_equal(multi_events[multi_events['run'] == 1]['values'], events['values'])
+
+
+def test_simulation_stepping(update_data=False):
+    print('testing the day stepping simulation')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input('lincoln')
+    matrix_weather = get_lincoln_broadfield()
+    matrix_weather.loc[:, 'max_irr'] = 15
+    matrix_weather.loc[:, 'irr_trig'] = 0.5
+    matrix_weather.loc[:, 'irr_targ'] = 1
+    matrix_weather = matrix_weather.loc[:, matrix_weather_keys_pet]
+    params['IRRIGF'] = 1
+    # as per test_reseed, these values are set to make observable changes and are not reasonable values.
+    params['reseed_harv_delay'] = 40
+    params['reseed_LAI'] = 3
+    params['reseed_TILG2'] = 10
+    params['reseed_TILG1'] = 40
+    params['reseed_TILV'] = 5000
+    params['reseed_CLV'] = 100
+    params['reseed_CRES'] = 25
+    params['reseed_CST'] = 10
+    params['reseed_CSTUB'] = 0.5
+    doy_irr = list(range(305, 367)) + list(range(1, 91))
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    days_harvest.loc[days_harvest.index[::3], 'reseed_trig'] = 1
+    days_harvest.loc[:, 'reseed_basal'] = 0.8
+    params2 = params.copy()
+    params2['BASALI'] = params['BASALI'] * 0.5
+
+    full = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose)
+    full2 = run_basgra_nz(params2, matrix_weather, days_harvest, doy_irr, verbose=verbose)
+    assert full['RESEEDED'].sum() > 0 and full['IRRIG'].sum() > 0
+
+    # two simulations advanced in turn by uneven blocks match their full runs exactly
+    sim = BasgraSimulation(params, matrix_weather, days_harvest, doy_irr, verbose=verbose)
+    sim2 = BasgraSimulation(params2, matrix_weather, days_harvest, doy_irr, verbose=verbose)
+    assert sim.day == 0 and len(sim.outputs_so_far) == 0
+    assert tuple(sim.state.keys()) == state_keys
+    assert np.isclose(sim.state['BASAL'], params['BASALI'])
+    blocks = [1, 30, 7, 365, 90, 2, 400]
+    i = 0
+    while not (sim.done and sim2.done):
+        block = sim.advance(blocks[i % len(blocks)])
+        assert len(block) == min(blocks[i % len(blocks)], len(full) - sim.day + len(block))
+        sim2.advance(blocks[(i + 3) % len(blocks)])
+        i += 1
+    assert sim.day == len(full)
+    assert len(sim.advance(10)) == 0, 'no days are left to simulate'
+    out = sim.outputs_so_far
+    assert (out.index == full.index).all()
+    assert np.array_equal(out.values, full.values, equal_nan=True)
+    assert np.array_equal(sim2.outputs_so_far.values, full2.values, equal_nan=True)
+    sim.free()
+    sim2.free()
+
+    # overrides of the weather and state only change the days after them
+    with BasgraSimulation(params, matrix_weather, days_harvest, doy_irr, verbose=verbose) as sim:
+        sim.advance(200)
+        sim.set_state(sim.state)  # setting the state does not change it
+        no_irr = sim.advance(400, overrides={'max_irr': 0})
+        assert no_irr['IRRIG'].sum() == 0 and full['IRRIG'].iloc[200:600].sum() > 0
+        rest = sim.advance(len(full))
+        assert np.array_equal(sim.outputs_so_far.values[:200], full.values[:200], equal_nan=True)
+        assert not np.allclose(rest['WAL'].values, full['WAL'].values[600:])
+
+    with BasgraSimulation(params, matrix_weather, days_harvest, doy_irr, verbose=verbose) as sim:
+        sim.advance(100)
+        # the state after a day is the state reported in the output of the next day
+        for k in ['CLV', 'LAI', 'TILV', 'WAL', 'ROOTD']:
+            assert sim.state[k] == full[k].iloc[100], k
+        wet = sim.advance(1, overrides={'WAL': full['WAL'].iloc[100] + 20})
+        assert wet['WAL'].iloc[0] == full['WAL'].iloc[100] + 20
+        assert sim.advance(1)['WAL'].iloc[0] > full['WAL'].iloc[101]
+
+
+def test_farm(update_data=False):
+    print('testing farm runs')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input('lincoln')
+    matrix_weather = get_lincoln_broadfield()
+    matrix_weather.loc[:, 'max_irr'] = 15
+    matrix_weather.loc[:, 'irr_trig'] = 0.6
+    matrix_weather.loc[:, 'irr_targ'] = 1
+    matrix_weather = matrix_weather.loc[:, matrix_weather_keys_pet]
+    params['IRRIGF'] = 1
+    doy_irr = list(range(305, 367)) + list(range(1, 91))
+    days_harvest = base_auto_harvest_data(matrix_weather)
+    days_harvest.loc[:, 'frac_harv'] = 1
+    days_harvest.loc[:, 'harv_trig'] = 2500
+    days_harvest.loc[:, 'harv_targ'] = 1500
+    days_harvest.drop(columns=['date'], inplace=True)
+    paddock_params = pd.DataFrame({'BASALI': np.linspace(0.5, 1, 6), 'WCST': np.linspace(0.35, 0.5, 6)})
+
+    # without a budget or capacity the paddocks are independent
+    out, farm = run_basgra_farm(params, matrix_weather, days_harvest, doy_irr, paddock_params=paddock_params,
+                                verbose=verbose)
+    multi = run_basgra_multisite(params, matrix_weather.values, days_harvest, doy_irr, site_params=paddock_params,
+                                 verbose=verbose)
+    assert np.array_equal(out, multi, equal_nan=True), 'an unlimited farm should match the multisite run'
+    assert list(farm.columns) == list(farm_out_keys) and len(farm) == len(matrix_weather)
+    assert (farm['n_deferred'] == 0).all()
+    assert np.allclose(farm['irr_requested'], farm['irr_applied'])
+
+    # shared irrigation budget and harvest capacity
+    area = np.array([1., 2, 1, 1, 3, 1])
+    out_vars = ['IRRIG', 'IRRIG_DEM', 'HARVFR', 'DM']
+    out, farm = run_basgra_farm(params, matrix_weather, days_harvest, doy_irr, paddock_params=paddock_params,
+                                area=area, farm_max_irr=3, rotation=[5, 4, 3, 2, 1, 0], harvest_capacity=1,
+                                verbose=verbose, out_vars=out_vars)
+    assert out.shape == (6, len(matrix_weather), len(out_vars))
+    applied = (out[:, :, 0] * area[:, np.newaxis]).sum(axis=0) / area.sum()
+    assert np.allclose(applied, farm['irr_applied'])
+    assert (applied <= 3 + 1e-9).all(), 'the farm budget should not be exceeded'
+    assert farm['irr_requested'].sum() > farm['irr_applied'].sum(), 'the budget should limit the irrigation'
+    harvested = (out[:, :, 2] > 0).sum(axis=0)
+    assert (harvested == farm['n_harvested']).all()
+    assert harvested.max() == 1, 'at most one paddock should be harvested a day'
+    assert farm['n_deferred'].sum() > 0, 'the capacity should defer some harvests'
+
+    # no harvests on days without capacity
+    capacity = np.ones(len(matrix_weather), int)
+    capacity[:200] = 0
+    out, farm = run_basgra_farm(params, matrix_weather, days_harvest, doy_irr, paddock_params=paddock_params,
+                                harvest_capacity=capacity, verbose=verbose, out_vars=out_vars)
+    assert (out[:, :200, 2] == 0).all() and farm['n_harvested'].iloc[:200].sum() == 0
+
+
+def test_forecast(update_data=False):
+    print('testing forecasts from the current state')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input('lincoln')
+    matrix_weather = get_lincoln_broadfield()
+    matrix_weather.loc[:, 'max_irr'] = 15
+    matrix_weather.loc[:, 'irr_trig'] = 0.6
+    matrix_weather.loc[:, 'irr_targ'] = 1
+    matrix_weather = matrix_weather.loc[:, matrix_weather_keys_pet]
+    params['IRRIGF'] = 1
+    params['opt_harvfrin'] = 1
+    doy_irr = list(range(305, 367)) + list(range(1, 91))
+    days_harvest = base_auto_harvest_data(matrix_weather)
+    days_harvest.loc[:, 'frac_harv'] = 1
+    days_harvest.loc[:, 'harv_trig'] = 3000
+    days_harvest.loc[:, 'harv_targ'] = 1500
+    days_harvest.drop(columns=['date'], inplace=True)
+    full = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose, auto_harvest=True)
+
+    # the history only needs weather up to today, a member with the observed weather matches the full run
+    today, ndays = 500, 90
+    forecast_weather = matrix_weather.values[today:today + ndays]
+    dry = forecast_weather.copy()
+    dry[:, matrix_weather_keys_pet.index('rain')] = 0
+    members = np.stack([forecast_weather, dry, forecast_weather])
+    forecast_harvest = days_harvest.iloc[today:today + ndays]
+    with BasgraSimulation(params, matrix_weather.iloc[:today], days_harvest.iloc[:today], doy_irr,
+                          verbose=verbose, auto_harvest=True) as sim:
+        sim.advance(today)
+        state = sim.state
+        y = sim.forecast(members, forecast_harvest)
+        assert y.shape == (3, ndays, len(out_cols))
+        assert np.array_equal(y[0], full.values[today:today + ndays], equal_nan=True)
+        assert np.array_equal(y[2], y[0], equal_nan=True)
+        assert y[1, :, out_cols.index('WAL')].mean() < y[0, :, out_cols.index('WAL')].mean()
+        assert sim.state == state, 'forecasting should not change the simulation'
+
+    # the simulation can be advanced after a forecast
+    with BasgraSimulation(params, matrix_weather, days_harvest, doy_irr, verbose=verbose, auto_harvest=True) as sim:
+        sim.advance(today)
+        y = sim.forecast(members, forecast_harvest, out_vars=['DM', 'IRRIG'])
+        assert np.array_equal(y[0], full[['DM', 'IRRIG']].values[today:today + ndays])
+        sim.advance(len(full))
+        assert np.array_equal(sim.outputs_so_far.values, full.values, equal_nan=True)
+
+
+def test_frost_free_fast_path(update_data=False):
+    print('testing the frost free fast path')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+
+    # a colder climate so that there is snow and soil frost on some days
+    cold_weather = matrix_weather.copy()
+    cold_weather.loc[:, ['tmin', 'tmax']] -= 8
+
+    for weather, all_fast in zip([matrix_weather, cold_weather], [True, False]):
+        fast_path_stats(enable=False)
+        full = run_basgra_nz(params, weather, days_harvest, doy_irr, verbose=verbose)
+        stats = fast_path_stats(enable=True)
+        assert stats['days'] == len(weather) and stats['fast_days'] == 0
+
+        fast = run_basgra_nz(params, weather, days_harvest, doy_irr, verbose=verbose)
+        stats = fast_path_stats()
+        assert stats['days'] == len(weather)
+        assert (stats['fast_days'] == len(weather)) == all_fast
+        assert stats['fast_days'] > 0
+        assert fast.equals(full), 'the fast path must give exactly the same output'
+
+
+def test_single_precision(update_data=False):
+    print('testing the single precision dlls')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    double = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose)
+    single = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose, dll_path='single')
+    assert (single.dtypes == np.float32).all()
+    assert (single.index == double.index).all()
+
+    # see check_basgra_python/precision_report.py for the deviations of all of the tests
+    check_vars = ['DM', 'YIELD', 'BASAL', 'WAL', 'PAW', 'LAI', 'TILTOT']
+    deviation = (single[check_vars] - double[check_vars]).abs().max() / double[check_vars].abs().max()
+    assert (deviation < 1e-3).all(), deviation
+
+    # the batch runs return float32 too and only accept a float32 out array
+    sites = run_basgra_multisite(params, matrix_weather.loc[:, matrix_weather_keys_pet].values, days_harvest,
+                                 doy_irr, verbose=verbose, auto_harvest=False, dll_path='single', out_vars=['DM'])
+    assert sites.dtype == np.float32
+    assert np.array_equal(sites[0, :, 0], single['DM'].values)
+
+
+def test_soa_batch(update_data=False):
+    print('testing the structure of arrays batch kernel')
+    # weather realisations of one site, with some cold runs for snow and soil frost and a range of irrigation triggers
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    params.update({'reseed_harv_delay': 40, 'reseed_LAI': 3, 'reseed_TILG2': 10, 'reseed_TILG1': 40,
+                   'reseed_TILV': 5000, 'reseed_CLV': 100, 'reseed_CRES': 25, 'reseed_CST': 10, 'reseed_CSTUB': 0.5})
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    auto_harvest = base_auto_harvest_data(matrix_weather).drop(columns='date')
+    for key, val in zip(['frac_harv', 'harv_trig', 'harv_targ', 'weed_dm_frac'], [0.8, 2500, 1500, 0.1]):
+        auto_harvest.loc[:, key] = val
+    auto_harvest.loc[auto_harvest.doy == 200, 'reseed_trig'] = 0.8
+    auto_harvest.loc[auto_harvest.doy == 200, 'reseed_basal'] = 0.9
+
+    rng = np.random.default_rng(1)
+    n = 12
+    weather = np.repeat(matrix_weather.loc[:, matrix_weather_keys_pet].values[np.newaxis], n, axis=0)
+    c = matrix_weather_keys_pet.index
+    weather[:, :, c('rain')] *= rng.uniform(0, 2, (n, 1))
+    weather[:, :, [c('tmin'), c('tmax')]] += rng.normal(0, 1, (n, len(matrix_weather), 1))
+    weather[:3, :, [c('tmin'), c('tmax')]] -= 6
+    weather[:, :, c('max_irr')] = 10
+    weather[:, :, c('irr_trig')] = rng.uniform(0.3, 0.9, (n, 1))
+    weather[:, :, c('irr_targ')] = 1
+
+    # the lanes use the vector maths library where the compiler has one, so the output can differ by rounding
+    stop_conditions = [('BASAL', 'below', 0.85), ('EVAP', 'total_above', 600)]
+    for harvest, auto, irr in zip([days_harvest, auto_harvest], [False, True], [doy_irr, [1, 2, 50, 51, 300]]):
+        kwargs = dict(verbose=verbose, auto_harvest=auto)
+        scalar = run_basgra_multisite(params, weather, harvest, irr, **kwargs)
+        soa = run_basgra_multisite(params, weather, harvest, irr, soa=True, chunk_size=5, **kwargs)
+        assert np.allclose(soa, scalar, rtol=1e-4, atol=1e-4, equal_nan=True), 'soa should match the scalar kernel'
+
+        scalar, scalar_stops = run_basgra_multisite(params, weather, harvest, irr, stop_conditions=stop_conditions,
+                                                    **kwargs)
+        soa, soa_stops = run_basgra_multisite(params, weather, harvest, irr, stop_conditions=stop_conditions,
+                                              soa=True, **kwargs)
+        assert np.array_equal(soa_stops, scalar_stops), 'each lane should stop on the same day'
+        assert np.allclose(soa, scalar, rtol=1e-4, atol=1e-4, equal_nan=True)
+
+        scalar, scalar_events = run_basgra_multisite(params, weather, harvest, irr, event_log=True, **kwargs)
+        soa, soa_events = run_basgra_multisite(params, weather, harvest, irr, event_log=True, soa=True, chunk_size=5,
+                                               **kwargs)
+        assert len(scalar_events) > 0
+        for key in ['run', 'day', 'event']:
+            assert np.array_equal(soa_events[key], scalar_events[key]), 'the lanes should log the same events'
+        assert np.allclose(soa_events['values'], scalar_events['values'], rtol=1e-4, atol=1e-4, equal_nan=True)
+    assert (scalar_stops[:, 0] >= 0).any() and (scalar_stops[:, 0] < 0).any(), 'only some of the lanes should stop'
+
+    streamed = iter_basgra_multisite(params, weather, days_harvest, doy_irr, verbose=verbose, auto_harvest=False,
+                                     out_vars=['DM'], chunk_size=5, soa=True)
+    starts, chunks = zip(*streamed)
+    assert starts == (0, 5, 10)
+    scalar = run_basgra_multisite(params, weather, days_harvest, doy_irr, verbose=verbose, auto_harvest=False,
+                                  out_vars=['DM'])
+    assert np.allclose(np.concatenate(chunks), scalar, rtol=1e-4, atol=1e-4, equal_nan=True)
+
+    # as per test_single_precision
+    check_vars = [out_cols.index(e) for e in ['DM', 'YIELD', 'BASAL', 'WAL', 'PAW', 'LAI']]
+    scalar = run_basgra_multisite(params, weather, days_harvest, doy_irr, verbose=verbose, auto_harvest=False,
+                                  dll_path='single')
+    soa = run_basgra_multisite(params, weather, days_harvest, doy_irr, verbose=verbose, auto_harvest=False,
+                               dll_path='single', soa=True)
+    assert soa.dtype == np.float32
+    deviation = np.abs(soa - scalar)[:, :, check_vars].max(axis=(0, 1)) / np.abs(scalar[:, :, check_vars]).max(
+        axis=(0, 1))
+    assert (deviation < 1e-3).all(), deviation
+
+
+def test_input_validation(update_data=False):
+    print('testing the input validation')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    weather = np.repeat(matrix_weather.loc[:, matrix_weather_keys_pet].values[np.newaxis], 3, axis=0)
+    site_params = pd.DataFrame({'IRRIGF': [0., 0.5, 1.], 'reseed_harv_delay': [20, 20, 20]})
+    site_irr = [doy_irr, [0], list(range(1, 100))]
+
+    def get_errors(**kwargs):
+        inputs = dict(params=params, matrix_weather=weather, days_harvest=days_harvest, doy_irr=site_irr,
+                      site_params=site_params)
+        inputs.update(kwargs)
+        try:
+            run_basgra_multisite(verbose=verbose, auto_harvest=False, **inputs)
+        except BasgraInputError as val:
+            return val.errors[['code', 'set', 'index']].tolist(), val.n_errors
+        raise ValueError('the inputs should not have passed validation')
+
+    bad = weather.copy()
+    bad[2, 10, 5] = np.nan
+    assert get_errors(matrix_weather=bad) == ([(3, 2, 10)], 1)
+
+    bad = np.delete(weather, 100, axis=1)  # a missing day
+    assert get_errors(matrix_weather=bad) == ([(5, 0, 100), (5, 1, 100), (5, 2, 100)], 3)
+
+    bad = weather.copy()
+    bad[1, :, 0] += 4  # contiguous, but not the dates of the other sites
+    errors, n_errors = get_errors(matrix_weather=bad)
+    assert errors == [(6, 1, i) for i in range(100)] and n_errors == weather.shape[1], 'only 100 errors are kept'
+
+    bad = site_params.copy()
+    bad.loc[1, 'reseed_harv_delay'] = 0
+    assert get_errors(site_params=bad) == ([(2, 1, param_keys.index('reseed_harv_delay'))], 1)
+
+    assert get_errors(doy_irr=[doy_irr, [0], [1, 400]]) == ([(10, 2, 1)], 1)
+
+    bad = site_params.copy()
+    bad['HAGERE'] = [0.8, 1.3, -0.1]
+    ihagere = param_keys.index('HAGERE')
+    assert get_errors(site_params=bad) == ([(11, 1, ihagere), (11, 2, ihagere)], 2)
+
+    # the packed arrays can be checked directly, e.g. before a large batch
+    params_array = np.array([params[k] for k in param_keys])[np.newaxis]
+    events = np.zeros((2, 3, 7))
+    events[:, :2, 0] = [[1, 5], [5, 1]]  # the second set is not sorted by day
+    events[0, 1, 1] = 1.5  # frac_harv
+    errors = validate_inputs(params_array, weather, events, np.array([[1, 2, 0]]))
+    assert errors[['code', 'set', 'index']].tolist() == [(8, 0, 1), (9, 1, 1)], errors
+    assert (errors['input'] == 'harvest_events').all()
+    assert len(validate_inputs(params_array, weather, events[:1, :1], np.array([[1, 2, 0]]))) == 0
+
+    # the values of single site dataframes are checked on the packed arrays too
+    bad = matrix_weather.copy()
+    bad.iloc[3, bad.columns.get_loc('rain')] = np.nan
+    try:
+        run_basgra_nz(params, bad, days_harvest, doy_irr, verbose=verbose)
+    except BasgraInputError as val:
+        assert val.errors[['code', 'set', 'index']].tolist() == [(3, 0, 3)]
+    else:
+        raise ValueError('nan weather should not have passed validation')
+
+
+def test_stale_dll_check(update_data=False):
+    print('testing the stale dll check')
+    import tempfile
+    import basgra_python
+    org_dir = basgra_python._fortran_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            basgra_python._fortran_dir = tmp
+            dll_path = os.path.join(tmp, 'BASGRA_pet.DLL')
+            assert basgra_python._dll_is_stale(dll_path), 'a missing dll is stale'
+            for name, mtime in [('plant.f95', 100), ('BASGRA_pet.DLL', 200), ('notes.txt', 300)]:
+                with open(os.path.join(tmp, name), 'w') as f:
+                    f.write('')
+                os.utime(os.path.join(tmp, name), (mtime, mtime))
+            assert not basgra_python._dll_is_stale(dll_path), 'only the fortran code is checked'
+            os.utime(os.path.join(tmp, 'plant.f95'), (300, 300))
+            assert basgra_python._dll_is_stale(dll_path), 'a dll older than the fortran code is stale'
+        finally:
+            basgra_python._fortran_dir = org_dir
+
+        # a bat which can not be run raises an error instead of being ignored
+        try:
+            basgra_python._run_bat(os.path.join(tmp, 'missing.bat'))
+            raise ValueError('a failed build should raise an error')
+        except EnvironmentError:
+            pass
+
+    # a double precision build in place of the single precision dll is refused
+    org_single = basgra_python._libpath_pet_single
+    try:
+        basgra_python._libpath_pet_single = basgra_python._get_dll_path('default', True)
+        basgra_python._checked_dlls.discard(basgra_python._libpath_pet_single)
+        basgra_python._get_dll_path('single', True)
+        raise ValueError('a double precision dll should not be accepted as single precision')
+    except EnvironmentError:
+        pass
+    finally:
+        basgra_python._libpath_pet_single = org_single
+    assert basgra_python._real_dtype(basgra_python._get_dll_path('single', True))[0] == np.float32
+
+
 if __name__ == '__main__':
 
     # input types tests
@@ -658,6 +1347,7 @@ if __name__ == '__main__':
     test_weed_fixed_harv_auto()
     test_auto_harv_fixed()
     test_weed_fraction_man()
+    test_harvfrin_solver()
 
     # test reseed
     test_reseed()
@@ -665,4 +1355,45 @@ if __name__ == '__main__':
     # input data for manual harvest check
     test_trans_manual_harv()
 
+    # climate change deltas
+    test_weather_deltas()
+    test_weather_delta_grid()
+
+    # batch runs
+    test_multisite()
+
+    # harvest input
+    test_harvest_events()
+    test_shared_inputs()
+
+    # early termination
+    test_stop_conditions()
+
+    # event log
+    test_event_log()
+
+    # day stepping api
+    test_simulation_stepping()
+
+    # farm runs
+    test_farm()
+
+    # forecasts
+    test_forecast()
+
+    # frost free fast path
+    test_frost_free_fast_path()
+
+    # single precision
+    test_single_precision()
+
+    # structure of arrays batch kernel
+    test_soa_batch()
+
+    # input validation
+    test_input_validation()
+
+    # dll builds
+    test_stale_dll_check()
+
     print('\n\nall established tests passed')
@@ -0,0 +1,625 @@
+"""
+ Created: 19/10/2026
+ behavioural tests of the modules in supporting_functions
+ """
+import os
+import json
+import shutil
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from basgra_python import BasgraSimulation, run_basgra_multisite, run_basgra_nz
+from input_output_keys import matrix_weather_keys_pet, matrix_weather_keys_penman, out_cols, days_harvest_keys
+from check_basgra_python.support_for_tests import establish_org_input, base_auto_harvest_data, _clean_harvest, \
+    get_lincoln_broadfield
+from supporting_functions.conversions import convert_RH_vpa, convert_wind_to_2m
+from supporting_functions.weather_preprocessing import calc_vpa, calc_wind_2m, calc_reference_pet, ffill_days, \
+    prepare_weather
+from supporting_functions.weather_generator import WeatherGenerator
+from supporting_functions.result_store import ResultStore, hash_input
+from supporting_functions.ensemble_stats import EnsembleStats
+from supporting_functions.result_sinks import run_to_sinks, ReducerSink, MemmapSink, CsvSink, ParquetSink, \
+    SinkWriter, annual_total
+from supporting_functions.irrigation_optimiser import IrrigationOptimiser, sample_strategies, grid_strategies, \
+    pareto_rank, window_doys, total_yield
+from supporting_functions.harvest_optimiser import HarvestOptimiser, schedule_keys
+from supporting_functions.surrogate import Surrogate, latin_hypercube
+from supporting_functions.forecast import forecast_members
+from supporting_functions.run_manager import GridRunManager
+
+verbose = False
+
+
+def test_weather_preprocessing(update_data=False):
+    print('testing the vectorised weather preprocessing')
+    rng = np.random.default_rng(1)
+    nsites, ndays = 3, 50
+    tmin = rng.uniform(-5, 15, (nsites, ndays))
+    tmax = tmin + rng.uniform(0, 15, (nsites, ndays))
+    rh = rng.uniform(20, 100, (nsites, ndays))
+    wind = rng.uniform(0, 10, (nsites, ndays))
+    heights = np.array([2., 3., 10.])
+
+    # the vectorised conversions must match supporting_functions.conversions
+    assert np.allclose(calc_vpa(rh, tmin, tmax), convert_RH_vpa(rh, tmin, tmax), rtol=1e-12)
+    vpa = np.zeros((nsites, ndays))
+    assert calc_vpa(rh, tmin, tmax, out=vpa) is vpa
+    assert np.allclose(vpa, convert_RH_vpa(rh, tmin, tmax), rtol=1e-12)
+    assert np.allclose(calc_wind_2m(wind, 10.), convert_wind_to_2m(wind, 10.), rtol=1e-12)
+    assert np.allclose(calc_wind_2m(wind, heights), convert_wind_to_2m(wind, heights[:, np.newaxis]), rtol=1e-12)
+
+    # FAO-56 example 18 (Uccle, 6 July) the reference pet is 3.9 mm/day
+    pet = calc_reference_pet(np.array([[12.3]]), np.array([[21.5]]), np.array([[22.07]]), np.array([[1.409]]),
+                             np.array([[2.078]]), np.array([187]), 50.8, 100.)
+    assert np.isclose(pet[0, 0], 3.9, atol=0.05), pet
+
+    # forward filling matches pandas
+    data = rng.uniform(0, 1, (nsites, ndays))
+    data[rng.uniform(0, 1, data.shape) < 0.3] = np.nan
+    data[:, 0] = 1
+    assert np.array_equal(ffill_days(data), pd.DataFrame(data.T).fillna(method='ffill').values.T)
+
+    # packed penman weather
+    doy = np.arange(1, ndays + 1)
+    year = np.full(ndays, 2020)
+    rain = rng.uniform(0, 10, (nsites, ndays))
+    radn = rng.uniform(1, 30, (nsites, ndays))
+    raw_rh = rh.copy()
+    raw_rh[:, 10] = np.nan
+    weather = prepare_weather(year, doy, tmin, tmax, rain, radn, rh=raw_rh, wind=wind, wind_height=heights)
+    assert weather.shape == (nsites, ndays, len(matrix_weather_keys_penman))
+    col = {k: weather[:, :, i] for i, k in enumerate(matrix_weather_keys_penman)}
+    assert np.array_equal(col['doy'][1], doy) and np.array_equal(col['tmin'], tmin)
+    expect_vpa = convert_RH_vpa(raw_rh, tmin, tmax)
+    expect_vpa[:, 10] = expect_vpa[:, 9]
+    assert np.allclose(col['vpa'], expect_vpa, rtol=1e-12)
+    assert np.allclose(col['wind'], convert_wind_to_2m(wind, heights[:, np.newaxis]), rtol=1e-12)
+    assert (col['max_irr'] == 10).all()
+
+    # packed pet weather, supplied or calculated
+    weather = prepare_weather(year, doy, tmin, tmax, rain, radn, supply_pet=True, pet=rain)
+    assert np.array_equal(weather[:, :, matrix_weather_keys_pet.index('pet')], rain)
+    weather = prepare_weather(year, doy, tmin, tmax, rain, radn, rh=rh, wind=wind, supply_pet=True, lat=-43.)
+    assert (weather[:, :, matrix_weather_keys_pet.index('pet')] > 0).all()
+
+    # missing values at the start cannot be filled
+    raw_rh[:, 0] = np.nan
+    try:
+        prepare_weather(year, doy, tmin, tmax, rain, radn, rh=raw_rh, wind=wind)
+        raise AssertionError('leading missing values should raise an error')
+    except ValueError:
+        pass
+
+
+def test_weather_generator(update_data=False):
+    print('testing the stochastic weather generator')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    matrix_weather = matrix_weather.loc[:, matrix_weather_keys_pet]
+    ndays, nreal = 730, 7
+    generator = WeatherGenerator(matrix_weather, seed=42)
+    full = generator.generate('2011-01-01', ndays, nreal)
+    assert full.shape == (nreal, ndays, len(matrix_weather_keys_pet))
+    assert np.isfinite(full).all()
+
+    # realisations do not depend on the chunk size, the chunk or on re-fitting with the same seed
+    for chunk_size in [1, 3, 7, 10]:
+        chunks = [(start, stop, y.copy()) for start, stop, y in
+                  generator.iter_chunks('2011-01-01', ndays, nreal, chunk_size=chunk_size)]
+        assert [e[0] for e in chunks] == list(range(0, nreal, chunk_size))
+        assert np.array_equal(np.concatenate([e[2] for e in chunks]), full), chunk_size
+    assert np.array_equal(generator.generate('2011-01-01', ndays, (2, 5)), full[2:5])
+    assert np.array_equal(WeatherGenerator(matrix_weather, seed=42).generate('2011-01-01', ndays, nreal), full)
+    assert not np.array_equal(WeatherGenerator(matrix_weather, seed=43).generate('2011-01-01', ndays, nreal), full)
+
+    # the generated weather resembles the observed weather
+    col = {k: full[:, :, i] for i, k in enumerate(matrix_weather_keys_pet)}
+    assert abs((col['rain'] > 0.1).mean() - (matrix_weather.rain > 0.1).mean()) < 0.05
+    assert abs(col['rain'].sum(axis=1).mean() / 2 - matrix_weather.rain.sum() / len(matrix_weather) * 365) < 150
+    for k in ['tmin', 'tmax', 'radn', 'pet']:
+        assert abs(col[k].mean() - matrix_weather[k].mean()) < 0.1 * matrix_weather[k].std(), k
+    assert (col['tmax'] > col['tmin']).all() and (col['radn'] >= 0).all()
+    assert np.array_equal(col['doy'][0, :3], [1, 2, 3]) and (col['year'][:, -1] == 2012).all()
+
+    # a realisation can be run directly
+    days_harvest = base_auto_harvest_data(generator.to_matrix_weather(full[0]))
+    days_harvest.drop(columns=['date'], inplace=True)
+    out = run_basgra_nz(params, generator.to_matrix_weather(full[0]), days_harvest, doy_irr, verbose=verbose,
+                        auto_harvest=True)
+    assert len(out) == ndays and np.isfinite(out['DM']).all()
+
+
+def test_result_store(update_data=False):
+    print('testing the result store')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    single = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose)
+    weather = np.stack([matrix_weather.loc[:, matrix_weather_keys_pet].values] * 3)
+    weather[:, :, matrix_weather_keys_pet.index('rain')] *= np.array([0.5, 1, 1.5])[:, np.newaxis]
+    out_vars = ['DM', 'YIELD', 'BASAL']
+    multi = run_basgra_multisite(params, weather, days_harvest, doy_irr, verbose=False, auto_harvest=False,
+                                 out_vars=out_vars)
+    dates = pd.DatetimeIndex(single.index)
+
+    for backend in ['parquet', 'hdf5']:
+        path = tempfile.mkdtemp()
+        try:
+            store = ResultStore(path, backend=backend, dtypes={'DM': 'float64'})
+            store.write(single, 'site 1', 'base', params=params, inputs={'matrix_weather': matrix_weather})
+            store.write(multi[:2], 'site 2', 'wet', out_vars=out_vars, dates=dates)
+
+            # appending from a re-opened store keeps the backend and numbers the realisations on
+            store = ResultStore(path, backend='parquet' if backend == 'hdf5' else 'hdf5', dtypes={'DM': 'float64'})
+            assert store.backend == backend
+            store.write(multi[2:], 'site 2', 'wet', out_vars=out_vars, dates=dates)
+            assert store.sites() == ['site 1', 'site 2'] and store.scenarios('site 2') == ['wet']
+            try:
+                store.write(multi[:1], 'site 2', 'wet', realisations=[1], out_vars=out_vars, dates=dates)
+                raise ValueError('storing a realisation twice should raise an assertion error')
+            except AssertionError:
+                pass
+
+            dm = store.read('DM', 'site 2', 'wet')
+            assert list(dm.columns) == [0, 1, 2] and dm.index.equals(pd.DatetimeIndex(dates, name='date'))
+            assert np.array_equal(dm.values.T, multi[:, :, 0]), 'float64 variables are stored exactly'
+            yld = store.read('YIELD', 'site 2', 'wet', realisations=[2, 0])
+            assert list(yld.columns) == [0, 2] and yld.values.dtype == np.float32
+            assert np.array_equal(yld.values.T, multi[[0, 2], :, 1].astype(np.float32))
+
+            basal = store.read('BASAL', 'site 1', 'base')
+            assert np.array_equal(basal[0].values, single['BASAL'].values.astype(np.float32))
+            meta = store.metadata['partitions']['site 1/base']
+            assert meta['out_vars'] == list(out_cols) and meta['realisations'] == [0]
+            assert meta['input_hashes']['matrix_weather'] == hash_input(matrix_weather)
+            assert meta['params']['LAT'] == params['LAT']
+        finally:
+            shutil.rmtree(path)
+
+
+def test_ensemble_stats(update_data=False):
+    print('testing the online ensemble statistics')
+    rng = np.random.default_rng(3)
+    out_vars = ['DM', 'PAW', 'IRRIG']
+    dates = pd.date_range('2020-01-01', periods=4)
+    quantiles = np.array([0, 0.05, 0.5, 0.95, 1])
+    y = rng.gamma(2., 500., (3000, len(dates), len(out_vars))) + 1e4  # offset to stress the variance update
+
+    # the quantiles are exact (inverted cdf) for fewer members than k, otherwise within the rank error
+    for n, k, tol in [(100, 128, 0), (3000, 128, 0.02), (3000, 512, 0.006)]:
+        stats = EnsembleStats(variables=['IRRIG', 'DM'], quantiles=quantiles, k=k, seed=1)
+        stats.open(out_vars, dates)
+        for start in range(0, n, 37):
+            stats.update(y[start:min(start + 37, n)])
+        data = y[:n][:, :, [2, 0]]
+        assert stats.n == n
+        assert np.allclose(stats.mean, data.mean(axis=0), rtol=1e-12)
+        assert np.allclose(stats.std, data.std(axis=0, ddof=1), rtol=1e-9)
+        assert np.array_equal(stats.min, data.min(axis=0)) and np.array_equal(stats.max, data.max(axis=0))
+
+        estimate = stats.get_quantiles()
+        if tol == 0:
+            assert np.array_equal(estimate, np.quantile(data, quantiles, axis=0, method='inverted_cdf'))
+        else:
+            # the rank error of the estimate
+            rank = (data[np.newaxis] <= estimate[:, np.newaxis]).mean(axis=1)
+            assert (np.abs(rank - quantiles[:, np.newaxis, np.newaxis]) <= tol).all()
+            assert np.array_equal(estimate[[0, -1]], np.quantile(data, [0, 1], axis=0))
+
+    # merging the stats of separate processes matches a single pass
+    parts = []
+    for chunk in np.array_split(y, 3):
+        part = EnsembleStats(variables=out_vars, quantiles=quantiles, k=4096)
+        part.open(out_vars, dates)
+        part.update(chunk)
+        parts.append(part)
+    merged = parts[0].merge(parts[1]).merge(parts[2])
+    assert merged.n == len(y)
+    assert np.allclose(merged.mean, y.mean(axis=0), rtol=1e-12)
+    assert np.allclose(merged.std, y.std(axis=0, ddof=1), rtol=1e-9)
+    assert np.array_equal(merged.get_quantiles(), np.quantile(y, quantiles, axis=0, method='inverted_cdf'))
+    summary = merged.summary()
+    single = EnsembleStats(variables=out_vars)
+    single.open(out_vars, dates)
+    single.update(y[:1])
+    assert np.isnan(single.std).all()
+    assert set(summary) == {'mean', 'std', 'min', 'max', '0%', '5%', '50%', '95%', '100%'}
+    assert summary['50%'].index.equals(pd.DatetimeIndex(dates, name='date'))
+
+    # as a sink of an ensemble run
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    weather = np.stack([matrix_weather.loc[:, matrix_weather_keys_pet].values] * 5)
+    weather[:, :, matrix_weather_keys_pet.index('tmin')] += np.arange(5)[:, np.newaxis]
+    stats = EnsembleStats(variables=['DM', 'BASAL'], quantiles=[0.5])
+    run_to_sinks(stats, params, weather, days_harvest, doy_irr, auto_harvest=False, chunk_size=2)
+    out = run_basgra_multisite(params, weather, days_harvest, doy_irr, auto_harvest=False, out_vars=['DM', 'BASAL'])
+    assert np.allclose(stats.mean, out.mean(axis=0), rtol=1e-12)
+    assert np.array_equal(stats.get_quantiles()[0], np.median(out, axis=0))
+
+
+class _ListSink(object):
+    """
+    a duck typed sink (not a ResultSink) which records the writes, optionally failing on a start or waiting for an
+    event before each write
+    """
+
+    def __init__(self, fail_at=None, wait=None):
+        self.fail_at = fail_at
+        self.wait = wait
+        self.starts = []
+        self.closed = False
+
+    def open(self, out_vars, dates):
+        pass
+
+    def write(self, start, y):
+        if self.wait is not None:
+            self.wait.wait()
+        if start == self.fail_at:
+            raise ValueError('failed writing {}'.format(start))
+        self.starts.append(start)
+
+    def close(self):
+        self.closed = True
+
+
+def test_result_sinks(update_data=False):
+    print('testing the result sinks')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    weather = np.stack([matrix_weather.loc[:, matrix_weather_keys_pet].values] * 5)
+    weather[:, :, matrix_weather_keys_pet.index('tmin')] += np.arange(5)[:, np.newaxis]
+    out_vars = ['DM', 'YIELD']
+    kwargs = dict(auto_harvest=False, chunk_size=2, out_vars=out_vars)
+    out = run_basgra_multisite(params, weather, days_harvest, doy_irr, auto_harvest=False, out_vars=out_vars)
+    dates = pd.to_datetime(['{}-{:03d}'.format(e, f) for e, f in matrix_weather[['year', 'doy']].values],
+                           format='%Y-%j').rename('date')
+
+    outdir = tempfile.mkdtemp()
+    try:
+        sinks = [ReducerSink(), ReducerSink(annual_total('YIELD')),
+                 MemmapSink(os.path.join(outdir, 'out.npy'), len(weather)),
+                 CsvSink(os.path.join(outdir, 'csv')),
+                 ParquetSink(os.path.join(outdir, 'store'), 'site', dtypes={'DM': 'float64'})]
+        run_to_sinks(sinks, params, weather, days_harvest, doy_irr, **kwargs)
+        whole, annual, memmap, csv, parquet = sinks
+
+        assert np.array_equal(whole.result, out, equal_nan=True)
+        frames = whole.to_dataframes()
+        assert sorted(frames) == list(range(len(weather)))
+        assert frames[3].index.equals(dates) and list(frames[3].columns) == out_vars
+        assert np.array_equal(frames[3].values, out[3], equal_nan=True)
+        try:
+            annual.to_dataframes()
+            raise ValueError('to_dataframes of a reduced output should raise an assertion error')
+        except AssertionError:
+            pass
+
+        years = pd.DataFrame(out[:, :, 1].T, index=dates).groupby(dates.year).sum()
+        assert annual.result.shape == (len(weather), len(years))
+        assert np.allclose(annual.result, years.values.T, rtol=1e-12)
+
+        assert np.array_equal(np.load(memmap.path), out, equal_nan=True)
+        for i in [0, 4]:
+            run = pd.read_csv(os.path.join(csv.outdir, csv.name.format(i)), index_col='date', parse_dates=True)
+            assert run.index.equals(dates) and list(run.columns) == out_vars
+            assert np.allclose(run.values, out[i], rtol=1e-12, equal_nan=True)
+        store = ResultStore(parquet.path)
+        dm = store.read('DM', 'site', 'base')
+        assert list(dm.columns) == list(range(len(weather)))
+        assert np.array_equal(dm.values.T, out[:, :, 0], equal_nan=True)
+    finally:
+        shutil.rmtree(outdir)
+
+    # an error in a sink is raised from run_to_sinks (a single sink need not be a ResultSink), and the sinks closed
+    sink = _ListSink(fail_at=2)
+    try:
+        run_to_sinks(sink, params, weather, days_harvest, doy_irr, **kwargs)
+        raise AssertionError('an error in a sink should be raised')
+    except RuntimeError as e:
+        assert isinstance(e.__cause__, ValueError)
+    assert sink.starts == [0] and sink.closed
+
+    # backpressure, put blocks while the queue is full until the sink catches up
+    go = threading.Event()
+    sink = _ListSink(wait=go)
+    writer = SinkWriter([sink], maxsize=1)
+    y = np.zeros((1, 2, 1))
+    writer.put(0, y)  # taken by the writer thread, which waits
+    writer.put(1, y)  # fills the queue
+    producer = threading.Thread(target=writer.put, args=(2, y))
+    producer.start()
+    producer.join(0.2)
+    assert producer.is_alive(), 'put should block while the queue is full'
+    go.set()
+    producer.join(5)
+    assert not producer.is_alive()
+    writer.close()
+    assert sink.starts == [0, 1, 2]
+
+
+def _irrigated_lincoln_input():
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input('lincoln')
+    matrix_weather = get_lincoln_broadfield().iloc[:730]
+    matrix_weather.loc[:, 'max_irr'] = 10
+    matrix_weather.loc[:, 'irr_trig'] = 0.6
+    matrix_weather.loc[:, 'irr_targ'] = 1
+    matrix_weather = matrix_weather.loc[:, matrix_weather_keys_pet]
+    params['IRRIGF'] = 1
+    params['opt_harvfrin'] = 1
+    doy_irr = list(range(305, 367)) + list(range(1, 91))
+    days_harvest = base_auto_harvest_data(matrix_weather)
+    days_harvest.loc[:, 'frac_harv'] = 1
+    days_harvest.loc[:, 'harv_trig'] = 3000
+    days_harvest.loc[:, 'harv_targ'] = 1500
+    days_harvest.drop(columns=['date'], inplace=True)
+    return params, matrix_weather, days_harvest, doy_irr
+
+
+def test_irrigation_optimiser(update_data=False):
+    print('testing the irrigation strategy optimiser')
+    assert window_doys(360, 2) == [360, 361, 362, 363, 364, 365, 366, 1, 2]
+    assert list(pareto_rank(np.array([1., 2, 2, 3, 1]), np.array([1., 3, 2, 2, np.nan]))) == [0, 0, 1, 2, 1]
+    assert np.allclose(total_yield(np.array([[0, 1, 0.5, 1.5, 2]]), np.array([150, 151, 152, 153, 154])), 3)
+
+    space = {'irr_trig': (0.3, 0.8), 'irr_targ': [0.8, 1.], 'IRRIGF': 1., 'doy_irr': [(305, 90), (1, 366)]}
+    strategies = sample_strategies(space, 12, seed=1)
+    assert len(strategies) == 12 and (strategies.irr_targ >= strategies.irr_trig).all()
+    assert np.array_equal(np.sort((strategies.irr_trig.values - 0.3) // (0.5 / 12)), np.arange(12))
+    assert len(grid_strategies(space, n_levels=3)) == 3 * 2 * 1 * 2
+
+    params, matrix_weather, days_harvest, doy_irr = _irrigated_lincoln_input()
+    optimiser = IrrigationOptimiser(params, matrix_weather, days_harvest, batch_size=5)
+
+    # an evaluation matches run_basgra_nz, a short horizon matches the start of the full run
+    full = optimiser.evaluate(strategies)
+    short = optimiser.evaluate(strategies.iloc[:3], ndays=200)
+    for i in range(3):
+        weather = matrix_weather.copy()
+        weather.loc[:, 'irr_trig'] = strategies.irr_trig.iloc[i]
+        weather.loc[:, 'irr_targ'] = strategies.irr_targ.iloc[i]
+        out = run_basgra_nz(params, weather, days_harvest, window_doys(*strategies.iloc[i][['irr_start', 'irr_stop']]),
+                            verbose=verbose, auto_harvest=True)
+        assert np.isclose(full.IRRIG.iloc[i], out.IRRIG.sum()), i
+        assert np.isclose(full.YIELD.iloc[i], total_yield(out.YIELD.values, out.doy.values)[0]), i
+        assert np.isclose(short.IRRIG.iloc[i], out.IRRIG.iloc[:200].sum()), i
+    assert full.IRRIG.max() > full.IRRIG.min() > 0
+
+    # successive halving with a water cap
+    max_irrig = full.IRRIG.median()
+    results = optimiser.optimise(strategies, max_irrig=max_irrig, yield_target=0, eta=2, min_keep=3)
+    assert (results.IRRIG <= max_irrig).all() and results.IRRIG.is_monotonic_increasing
+    assert results.pareto.any() and results.feasible.all()
+    assert list(optimiser.history.groupby('horizon').size()) == [12, 6, 3]
+    best = full.loc[full.IRRIG <= max_irrig]
+    assert results.YIELD.max() <= best.YIELD.max() + 1e-9
+
+
+def test_harvest_optimiser(update_data=False):
+    print('testing the harvest schedule optimiser')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    params['fixed_removal'] = 0
+    optimiser = HarvestOptimiser(params, matrix_weather, doy_irr, batch_size=3)
+    nseas = len(optimiser.seasons)
+    assert optimiser.columns[-1] == 'fixed_removal' and len(optimiser.columns) == nseas * len(schedule_keys) + 1
+
+    # an evaluation matches run_basgra_nz with the same auto harvest data
+    x = np.array([[3000., 1500., 1.], [2500., 1000., 0.75]])[:, np.newaxis].repeat(nseas, axis=1)
+    x[1, 0] = [4000., 2000., 0.5]  # a different spring
+    candidates = optimiser.to_frame(x, np.zeros(2))
+    results = optimiser.evaluate(candidates)
+    assert optimiser.n_runs == 2
+    harvest = optimiser.harvest_arrays(x)
+    for i in range(2):
+        days_harvest = pd.DataFrame(harvest[i], columns=days_harvest_keys)
+        days_harvest = days_harvest.astype({'year': int, 'doy': int})
+        out = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=verbose, auto_harvest=True)
+        assert np.isclose(results.YIELD.iloc[i], total_yield(out.YIELD.values, out.doy.values)[0])
+        assert np.isclose(results.min_BASAL.iloc[i], out.BASAL.min())
+    assert results.YIELD.iloc[0] != results.YIELD.iloc[1]
+
+    # values are snapped to the grid, and runs on the same grid point come from the cache
+    off_grid = candidates.copy()
+    off_grid.loc[:, optimiser.columns[:-1]] += 0.01
+    again = optimiser.evaluate(off_grid)
+    assert optimiser.n_runs == 2 and optimiser.n_cache_hits == 2
+    assert np.array_equal(again.values, results.values)
+
+    # a short compass search, the best candidate is the best feasible candidate visited
+    min_basal = results.min_BASAL.min()
+    best, history = optimiser.optimise(min_basal, n_starts=2, max_iter=2, seed=1)
+    assert set(history.iteration) == {0, 1, 2}
+    assert best.feasible and best.min_BASAL >= min_basal
+    assert np.isclose(best.YIELD, history.loc[history.feasible, 'YIELD'].max())
+    assert optimiser.n_runs < len(history) + 2
+
+    # harv_targ is snapped to at most harv_trig, otherwise the runs go nan (or fail with fixed_removal)
+    above = optimiser.to_frame(np.array([[[2000., 2499., 1.]] * nseas]), np.ones(1))
+    snapped = optimiser.evaluate(above)
+    assert (snapped.filter(like='harv_targ').values == 2000).all() and np.isfinite(snapped.YIELD).all()
+
+    # a longer search with both removal methods only visits finite runs and finds a finite, feasible best
+    best, history = optimiser.optimise(0.1, n_starts=2, fixed_removal=[0, 1], max_iter=8, seed=0)
+    assert set(history.iteration) == set(range(9))
+    assert (history.filter(like='harv_targ').values <= history.filter(like='harv_trig').values).all()
+    assert np.isfinite(history.YIELD).all() and np.isfinite(history.min_BASAL).all()
+    assert best.feasible and np.isfinite(best.YIELD)
+    assert np.isclose(best.YIELD, history.loc[history.feasible, 'YIELD'].max())
+
+
+def test_surrogate(update_data=False):
+    print('testing the surrogate models')
+    bounds = np.array([[0., 1.], [10., 20.]])
+    x = latin_hypercube(bounds, 8, seed=1)
+    for i in range(2):
+        strata = np.sort(((x[:, i] - bounds[i, 0]) / (bounds[i, 1] - bounds[i, 0]) * 8).astype(int))
+        assert np.array_equal(strata, np.arange(8))
+
+    params, matrix_weather, days_harvest, doy_irr = _irrigated_lincoln_input()
+    space = {'irr_trig': (0.3, 0.8), 'max_irr': (3., 15.), 'IRRIGF': (0.5, 1.)}
+    surrogate = Surrogate(space, summaries=['YIELD', 'IRRIG'], max_degree=3)
+    surrogate.set_inputs(params, matrix_weather, days_harvest, doy_irr, batch_size=40)
+    validation = surrogate.fit(n_train=80, n_validate=20, seed=1)
+    assert list(validation.index) == ['YIELD', 'IRRIG']
+    assert validation.loc['IRRIG', 'r2'] > 0.9, validation
+    assert (validation.degree > 0).all() and (validation.degree <= 3).all()
+
+    # single point queries match the batch prediction, queries outside of the ranges are run with the kernel
+    point = {'irr_trig': 0.5, 'max_irr': 10., 'IRRIGF': 0.8}
+    x = np.array([[0.5, 10., 0.8], [0.9, 10., 0.8]])
+    assert np.allclose(list(surrogate.query(point).values()), surrogate.predict(x[:1])[0], rtol=1e-10)
+    out = surrogate.query(x)
+    assert surrogate.n_kernel_queries == 1
+    assert np.array_equal(out[1], surrogate.run_kernel(x[1:])[0])
+    kernel = surrogate.run_kernel(x[:1])[0]
+    assert np.all(np.abs(out[0] - kernel) < 3 * validation['max_abs_error'].values + 1e-6)
+
+    # a saved surrogate predicts the same
+    path = tempfile.mkdtemp()
+    try:
+        surrogate.save(os.path.join(path, 'surrogate.npz'))
+        loaded = Surrogate.load(os.path.join(path, 'surrogate.npz'))
+        assert loaded.names == surrogate.names and np.array_equal(loaded.degree, surrogate.degree)
+        assert np.array_equal(loaded.predict(x), surrogate.predict(x))
+        assert loaded.validation.equals(validation)
+    finally:
+        shutil.rmtree(path)
+
+
+def test_pasture_growth(update_data=False):
+    print('testing the pasture growth rate on harvest days')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = base_auto_harvest_data(matrix_weather)
+    days_harvest.loc[:, 'frac_harv'] = 1
+    days_harvest.loc[:, 'harv_trig'] = 3000
+    days_harvest.loc[:, 'harv_targ'] = 2000
+    days_harvest.drop(columns=['date'], inplace=True)
+    members = matrix_weather.loc[:, matrix_weather_keys_pet].values[np.newaxis]
+
+    # weeds and the calculated (rather than actual) removal must not show up as growth on harvest days
+    for weed_dm_frac, opt_harvfrin in [(0.3, 1), (0, 0), (0, 1)]:
+        params['opt_harvfrin'] = opt_harvfrin
+        days_harvest.loc[:, 'weed_dm_frac'] = weed_dm_frac
+        with BasgraSimulation(params, matrix_weather, days_harvest, doy_irr, verbose=verbose,
+                              auto_harvest=True) as sim:
+            sim.advance(1)
+            y, dates = forecast_members(sim, members[:, 1:], days_harvest.iloc[1:],
+                                        variables=('DM', 'PGR', 'HARVFR'))
+        assert len(dates) == len(matrix_weather) - 1
+        pgr = y[0, :, 1]
+        harvested = y[0, :, 2] > 0
+        assert harvested.sum() >= 5
+        neighbours = np.zeros_like(harvested)
+        neighbours[1:] |= harvested[:-1]
+        neighbours[:-1] |= harvested[1:]
+        neighbours &= ~harvested
+        assert np.isfinite(pgr).all()
+        assert (pgr[harvested] > -10).all() and (pgr[harvested] < 150).all(), pgr[harvested]
+        assert abs(pgr[harvested].mean() - pgr[neighbours].mean()) < 40
+
+
+def test_grid_run_manager(update_data=False):
+    print('testing the resumable grid run manager')
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    weather = matrix_weather.loc[:, matrix_weather_keys_pet].values
+    grid_weather = np.repeat(weather[np.newaxis, np.newaxis], 6, axis=1).reshape((2, 3) + weather.shape)
+    grid_weather[..., matrix_weather_keys_pet.index('tmin')] += np.arange(6).reshape(2, 3, 1)
+    mask = np.array([[True, True, False], [True, True, True]])
+    out_vars = ['DM', 'YIELD']
+    correct = run_basgra_multisite(params, grid_weather[mask], days_harvest, doy_irr, verbose=False,
+                                   auto_harvest=False, out_vars=out_vars)
+
+    kwargs = dict(params=params, days_harvest=days_harvest, doy_irr=doy_irr, chunk_size=2, out_vars=out_vars,
+                  auto_harvest=False)
+    outdir = tempfile.mkdtemp()
+    try:
+        manager = GridRunManager(outdir, grid_weather, mask, **kwargs)
+        assert manager.remaining_chunks == [0, 1, 2]
+        assert np.isnan(manager.to_grid('YIELD')).all()
+        assert manager.to_grid('YIELD').shape == mask.shape + (len(weather),)
+        manager.run(nprocesses=1, verbose=verbose)
+        grid = manager.to_grid('YIELD')
+        assert np.isnan(grid[0, 2]).all()
+        assert np.array_equal(grid[mask], correct[:, :, 1])
+
+        # a job killed after chunk 2 was written but before the manifest recorded it, with chunk 1 missing
+        os.remove(os.path.join(outdir, manager.chunk_name.format(1)))
+        with open(os.path.join(outdir, manager.manifest_name)) as f:
+            manifest = json.load(f)
+        manifest['finished'] = [0]
+        with open(os.path.join(outdir, manager.manifest_name), 'w') as f:
+            json.dump(manifest, f)
+        mtimes = [os.path.getmtime(os.path.join(outdir, manager.chunk_name.format(i))) for i in [0, 2]]
+
+        manager = GridRunManager(outdir, grid_weather, mask, **kwargs)
+        assert manager.remaining_chunks == [1], 'only the missing chunk should be run'
+        manager.run(nprocesses=2, verbose=verbose)
+        assert manager.remaining_chunks == []
+        assert mtimes == [os.path.getmtime(os.path.join(outdir, manager.chunk_name.format(i))) for i in [0, 2]]
+        assert np.array_equal(manager.to_grid('DM')[mask], correct[:, :, 0])
+
+        # a finished run does nothing and a run set up differently is refused
+        manager.run(nprocesses=2, verbose=verbose)
+        try:
+            GridRunManager(outdir, grid_weather, mask, **dict(kwargs, chunk_size=3))
+            raise AssertionError('a different chunk size should raise an error')
+        except ValueError:
+            pass
+
+        # as is a run with a different mask, weather or parameters
+        other_mask = mask.copy()
+        other_mask[[0, 1], 2] = [True, False]  # the same number of cells
+        other_weather = grid_weather.copy()
+        other_weather[0, 0, 0, matrix_weather_keys_pet.index('tmin')] += 1
+        other_params = dict(params, DRATE=params['DRATE'] + 1)
+        for other in [dict(mask=other_mask), dict(weather_source=other_weather),
+                      dict(params=other_params)]:
+            setup = dict(kwargs, weather_source=grid_weather, mask=mask)
+            setup.update(other)
+            try:
+                GridRunManager(outdir, **setup)
+                raise AssertionError('a run with different inputs should raise an error: {}'.format(list(other)))
+            except ValueError:
+                pass
+    finally:
+        shutil.rmtree(outdir)
+
+    # more chunks than processes, run from a .npy weather file
+    outdir = tempfile.mkdtemp()
+    try:
+        weather_path = os.path.join(outdir, 'weather.npy')
+        np.save(weather_path, grid_weather)
+        manager = GridRunManager(os.path.join(outdir, 'run'), weather_path, mask, **dict(kwargs, chunk_size=1))
+        manager.run(nprocesses=2, verbose=verbose)
+        assert np.array_equal(manager.to_grid('DM')[mask], correct[:, :, 0])
+    finally:
+        shutil.rmtree(outdir)
+
+
+if __name__ == '__main__':
+    # weather preparation
+    test_weather_preprocessing()
+    test_weather_generator()
+
+    # result storage
+    test_result_store()
+
+    # ensemble statistics
+    test_ensemble_stats()
+    test_result_sinks()
+
+    # optimisers
+    test_irrigation_optimiser()
+    test_harvest_optimiser()
+
+    # surrogates
+    test_surrogate()
+
+    # forecasts
+    test_pasture_growth()
+
+    # gridded runs
+    test_grid_run_manager()
+
+    print('\n\nall supporting function tests passed')
@@ -0,0 +1,90 @@
+"""
+benchmark of the batch kernel (BASGRA_BATCH with a whole batch of realisations in one fortran call) against the
+scalar path (one realisation per fortran call, as per run_basgra_nz) at batch sizes of 8 to 4096 realisations.  the
+realisations are the example site with a range of irrigation fractions (IRRIGF), the times are in micro seconds per
+realisation day.  benchmark_soa compares the scalar batch kernel with the structure of arrays kernel
+(BASGRA_BATCH_SOA, soa=True) on weather realisations of the example site
+
+ Created: 19/10/2026
+ """
+import time
+import numpy as np
+import pandas as pd
+from basgra_python import run_basgra_multisite
+from check_basgra_python.support_for_tests import establish_org_input, _clean_harvest
+from input_output_keys import matrix_weather_keys_pet
+
+
+def benchmark_batch(batch_sizes=(8, 32, 128, 512, 1024, 4096), out_vars=('DM', 'YIELD', 'IRRIG'), repeats=3,
+                    dll_path='default'):
+    """
+    time the batch and scalar paths of run_basgra_multisite
+    :param batch_sizes: the number of realisations to run
+    :param out_vars: the output variables to keep, all 72 outputs of 4096 realisations is c. 5 GB
+    :param repeats: the best of this many runs is reported
+    :param dll_path: see basgra_python.run_basgra_nz, e.g. 'single' for the single precision DLLs
+    :return: pd.DataFrame index: batch size, columns: scalar, batch (micro seconds per realisation day) and speedup
+    """
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    matrix_weather = matrix_weather.loc[:, matrix_weather_keys_pet].values
+    ndays = len(matrix_weather)
+
+    out = pd.DataFrame(index=pd.Index(batch_sizes, name='batch_size'), columns=['scalar', 'batch', 'speedup'],
+                       dtype=float)
+    for n in batch_sizes:
+        site_params = pd.DataFrame({'IRRIGF': np.linspace(0, 1, n)})
+        for col, chunk_size in zip(['scalar', 'batch'], [1, n]):
+            times = []
+            for _ in range(repeats):
+                t = time.perf_counter()
+                run_basgra_multisite(params, matrix_weather, days_harvest, doy_irr, site_params=site_params,
+                                     auto_harvest=False, out_vars=list(out_vars), chunk_size=chunk_size,
+                                     dll_path=dll_path)
+                times.append(time.perf_counter() - t)
+            out.loc[n, col] = min(times) / (n * ndays) * 1e6
+    out['speedup'] = out['scalar'] / out['batch']
+    return out
+
+
+def benchmark_soa(batch_sizes=(8, 32, 128, 512, 1024, 4096), out_vars=('DM', 'YIELD', 'IRRIG'), repeats=3,
+                  dll_path='default', seed=1):
+    """
+    time the scalar (BASGRA_BATCH) and structure of arrays (BASGRA_BATCH_SOA) kernels of run_basgra_multisite, the
+    whole batch is one fortran call for both
+    :param batch_sizes: the number of weather realisations to run
+    :param out_vars: the output variables to keep
+    :param repeats: the best of this many runs is reported
+    :param dll_path: see basgra_python.run_basgra_nz, e.g. 'single' for the single precision DLLs
+    :param seed: seed for the weather realisations (rain scaled by 0.5-1.5, temperature shifted by N(0, 1) C)
+    :return: pd.DataFrame index: batch size, columns: scalar, soa (micro seconds per realisation day) and speedup
+    """
+    params, matrix_weather, days_harvest, doy_irr = establish_org_input()
+    days_harvest = _clean_harvest(days_harvest, matrix_weather)
+    matrix_weather = matrix_weather.loc[:, matrix_weather_keys_pet].values
+    ndays = len(matrix_weather)
+    rain, tmin, tmax = [matrix_weather_keys_pet.index(e) for e in ['rain', 'tmin', 'tmax']]
+    rng = np.random.default_rng(seed)
+
+    out = pd.DataFrame(index=pd.Index(batch_sizes, name='batch_size'), columns=['scalar', 'soa', 'speedup'],
+                       dtype=float)
+    for n in batch_sizes:
+        weather = np.repeat(matrix_weather[np.newaxis], n, axis=0)
+        weather[:, :, rain] *= rng.uniform(0.5, 1.5, (n, 1))
+        weather[:, :, [tmin, tmax]] += rng.normal(0, 1, (n, 1, 1))
+        for col, soa in zip(['scalar', 'soa'], [False, True]):
+            times = []
+            for _ in range(repeats):
+                t = time.perf_counter()
+                run_basgra_multisite(params, weather, days_harvest, doy_irr, auto_harvest=False,
+                                     out_vars=list(out_vars), chunk_size=n, dll_path=dll_path, soa=soa)
+                times.append(time.perf_counter() - t)
+            out.loc[n, col] = min(times) / (n * ndays) * 1e6
+    out['speedup'] = out['scalar'] / out['soa']
+    return out
+
+
+if __name__ == '__main__':
+    print('micro seconds per realisation day')
+    print(benchmark_batch())
+    print(benchmark_soa())
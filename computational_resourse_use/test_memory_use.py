@@ -8,6 +8,7 @@ $ pip install -U memory_profiler
  """
 from basgra_python import run_basgra_nz
 from check_basgra_python.support_for_tests import establish_org_input, _clean_harvest
+from supporting_functions.weather_generator import WeatherGenerator
 import numpy as np
 import pandas as pd
 from memory_profiler import profile
@@ -29,13 +30,10 @@ def support_for_memory_usage():
     start_year = matrix_weather['year'].min()
     start_day = matrix_weather.loc[matrix_weather.year == start_year, 'doy'].min()
 
-    # set up a maximum run time
-    idxs = np.random.random_integers(0, len(matrix_weather) - 1, 36600)
-    matrix_weather = matrix_weather.iloc[idxs]
-    expected_days = pd.Series(pd.date_range(start=pd.to_datetime('{}-{}'.format(start_year, start_day), format='%Y-%j'),
-                                            periods=36600))
-    matrix_weather.loc[:, 'year'] = expected_days.dt.year.values
-    matrix_weather.loc[:, 'doy'] = expected_days.dt.dayofyear.values
+    # set up a maximum run time, seeded synthetic weather fitted to the example site
+    gen = WeatherGenerator(matrix_weather, seed=1)
+    matrix_weather = gen.to_matrix_weather(gen.generate(pd.to_datetime('{}-{}'.format(start_year, start_day),
+                                                                       format='%Y-%j'), 36600, 1)[0])
 
     days_harvest = _clean_harvest(days_harvest, matrix_weather)
     out = run_basgra_nz(params, matrix_weather, days_harvest, doy_irr, verbose=False)
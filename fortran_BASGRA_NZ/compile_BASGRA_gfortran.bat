@@ -2,14 +2,33 @@
 :: get gfortan: https://sourceforge.net/projects/mingwbuilds/files/host-windows/releases/4.8.1/64-bit/threads-posix/seh/x64-4.8.1-release-posix-seh-rev5.7z/download
 
 :: this section creates the BASGRA DLL which expects PET to be supplied
-gfortran -x f95-cpp-input -Dweathergen -O3 -c -fdefault-real-8 brent.f95 parameters_site.f95 parameters_plant.f95 environment.f95 resources.f95 soil.f95 plant.f95 set_params.f95 basgraf.f95
-gfortran -shared -o BASGRA_pet.DLL brent.o parameters_site.o parameters_plant.o environment.o resources.o soil.o plant.o set_params.o basgraf.o
+gfortran -x f95-cpp-input -Dweathergen -O3 -fstack-arrays -c -fdefault-real-8 parameters_site.f95 parameters_plant.f95 environment.f95 resources.f95 soil.f95 plant.f95 set_params.f95 basgraf.f95 || goto failed
+gfortran -shared -o BASGRA_pet.DLL parameters_site.o parameters_plant.o environment.o resources.o soil.o plant.o set_params.o basgraf.o || goto failed
 del *.o
 del *.mod
 
 :: this section creates the BASGRA DLL which expects PET to be calculated by the peyman equation
-gfortran -x f95-cpp-input -O3 -c -fdefault-real-8 brent.f95 parameters_site.f95 parameters_plant.f95 environment.f95 resources.f95 soil.f95 plant.f95 set_params.f95 basgraf.f95
-gfortran -shared -o BASGRA_peyman.DLL brent.o parameters_site.o parameters_plant.o environment.o resources.o soil.o plant.o set_params.o basgraf.o
+gfortran -x f95-cpp-input -O3 -fstack-arrays -c -fdefault-real-8 parameters_site.f95 parameters_plant.f95 environment.f95 resources.f95 soil.f95 plant.f95 set_params.f95 basgraf.f95 || goto failed
+gfortran -shared -o BASGRA_peyman.DLL parameters_site.o parameters_plant.o environment.o resources.o soil.o plant.o set_params.o basgraf.o || goto failed
 del *.o
 del *.mod
-pause
\ No newline at end of file
+
+:: this section creates the single precision (float32) BASGRA DLL which expects PET to be supplied
+gfortran -x f95-cpp-input -Dweathergen -Dsingle -O3 -fstack-arrays -c parameters_site.f95 parameters_plant.f95 environment.f95 resources.f95 soil.f95 plant.f95 set_params.f95 basgraf.f95 || goto failed
+gfortran -shared -o BASGRA_pet_single.DLL parameters_site.o parameters_plant.o environment.o resources.o soil.o plant.o set_params.o basgraf.o || goto failed
+del *.o
+del *.mod
+
+:: this section creates the single precision (float32) BASGRA DLL which expects PET to be calculated by the peyman equation
+gfortran -x f95-cpp-input -Dsingle -O3 -fstack-arrays -c parameters_site.f95 parameters_plant.f95 environment.f95 resources.f95 soil.f95 plant.f95 set_params.f95 basgraf.f95 || goto failed
+gfortran -shared -o BASGRA_peyman_single.DLL parameters_site.o parameters_plant.o environment.o resources.o soil.o plant.o set_params.o basgraf.o || goto failed
+del *.o
+del *.mod
+
+pause
+exit /b 0
+
+:: a failed build exits with an error code, so python (basgra_python._run_bat) can tell that it failed
+:failed
+pause
+exit /b 1
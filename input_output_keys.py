@@ -130,7 +130,7 @@ param_keys = (
 
     # new for harvest, certainly parameters
     'fixed_removal',  # sudo boolean defines if auto_harv_targ is fixed amount or amount to harvest to
-    'opt_harvfrin',  # # sudo boolean(1=True, 0=False) if True, harvest fraction is estimated by brent zero optimisation
+    'opt_harvfrin',  # # sudo boolean(1=True, 0=False) if True, harvest fraction is estimated by a safeguarded newton solver
     # if false, HARVFRIN = DM_RYE_RM/DMH_RYE.  As the harvest fraction is non-linearly related to the
     # harvest, the amount harvested may be significantly greather than expected depending on CST
     'reseed_harv_delay',  # number of days to delay harvest after reseed, must be >=1 and must be a whole number
@@ -190,6 +190,24 @@ matrix_weather_keys_penman = (
     'irr_targ',  # fraction of field capacity to irrigate to (fraction 0-1)
 )
 
+weather_delta_keys = (  # climate change deltas applied inside BASGRA, weather = weather * {var}_mult + {var}_add
+    # each is either a single value or 12 monthly values (Jan-Dec), rain, radn, pet, vpa and wind are kept >= 0
+    'tmin_add',  # degrees C
+    'tmin_mult',  # fraction
+    'tmax_add',  # degrees C
+    'tmax_mult',  # fraction
+    'rain_add',  # mm/day
+    'rain_mult',  # fraction
+    'radn_add',  # MJ/m2
+    'radn_mult',  # fraction
+    'pet_add',  # mm/day, only used when pet is supplied
+    'pet_mult',  # fraction, only used when pet is supplied
+    'vpa_add',  # kPa, only used when pet is calculated via penman
+    'vpa_mult',  # fraction, only used when pet is calculated via penman
+    'wind_add',  # m/s, only used when pet is calculated via penman
+    'wind_mult',  # fraction, only used when pet is calculated via penman
+)
+
 out_cols = (
     # varname, # shortname, # units
     'Time',  # Time, #  (y)
@@ -280,6 +298,56 @@ out_cols = (
 
 )
 
+event_log_keys = {  # the values of each kind of event in the event log (event_log=True), see basgra_python.py
+    'harvest': ('DM_RYE_RM', 'DM_WEED_RM', 'HARVFRIN', 'HARVFRIN_NITER'),  # on harvest days, HARVFRIN_NITER is
+    # the iterations of the harvest fraction estimate (opt_harvfrin), 0 if it was not estimated
+    'reseed': ('BASAL', 'DM', 'LAI'),  # on reseed days, the state after the reseed
+    'irrigation': ('IRRIG', 'IRRIG_DEM', 'PAW'),  # on days with irrigation
+}
+
+farm_out_keys = (  # the daily farm output of basgra_python.run_basgra_farm
+    'irr_requested',  # mm d-1 over the farm area, the irrigation the paddocks asked for
+    'irr_applied',  # mm d-1 over the farm area, the irrigation applied (at most farm_max_irr)
+    'n_harvested',  # number of paddocks harvested (at most harvest_capacity)
+    'n_deferred',  # number of paddocks ready to harvest which were deferred by the harvest capacity
+)
+
+state_keys = (  # the state carried between days, see basgra_python.BasgraSimulation, order as in fortran pack_state
+    # varname, # units
+    'AGE',  # d, age of the sward (days simulated)
+    'BASAL',  # fraction (0-1), basal area (BASAL in the output is %)
+    'CLV',  # gC m-2, leaf C
+    'CLVD',  # gC m-2, dead leaf C
+    'CRES',  # gC m-2, reserve C
+    'CRT',  # gC m-2, root C
+    'CST',  # gC m-2, stem C
+    'CSTUB',  # gC m-2, stubble C
+    'DAYL',  # d d-1, day length of the last day
+    'DRYSTOR',  # mm, frozen water (snow) in the snow pack
+    'Fdepth',  # m, frost depth
+    'LAI',  # m2 m-2, leaf area index
+    'LT50',  # degC, hardening
+    'O2',  # mol m-2, soil oxygen
+    'PHEN',  # -, phenological stage
+    'ROOTD',  # m, root depth
+    'Sdepth',  # m, snow depth
+    'TANAER',  # d, time under anaerobic conditions
+    'TILG1',  # m-2, generative tillers
+    'TILG2',  # m-2, elongating tillers
+    'TILV',  # m-2, vegetative tillers
+    'VERN',  # -, vernalisation
+    'VERND',  # d, vernalisation days
+    'WAL',  # mm, soil water
+    'WALS',  # mm, water in the rapid surface layer (max 25 mm)
+    'WAPL',  # mm, liquid water in the surface pool
+    'WAPS',  # mm, ice in the surface pool
+    'WAS',  # mm, ice in the soil
+    'WETSTOR',  # mm, liquid water in the snow pack
+    'YIELD',  # tDM ha-1, yield of the last harvest
+    'YIELD_RYE',  # tDM ha-1, rye grass yield of the last harvest
+    'YIELD_WEED',  # tDM ha-1, weed yield of the last harvest
+)
+
 site_param_keys = (
     'LAT',  # LAT,  # degN, # Latitude
     'WCI',  # WCI,  # m3 m-3, # Initial value of volumetric water content
@@ -310,7 +378,7 @@ site_param_keys = (
     'CO2A',  # woodward set to 350   # CO2 concentration in atmosphere (ppm)
     'poolInfilLimit',  # woodward set to  0.2     # m Soil frost depth limit for water infiltration
     'fixed_removal',  # sudo boolean(1=True, 0=False) defines if auto_harv_targ is fixed amount or amount to harvest to,
-    'opt_harvfrin',  # # sudo boolean(1=True, 0=False) if True, harvest fraction is estimated by brent zero optimisation
+    'opt_harvfrin',  # # sudo boolean(1=True, 0=False) if True, harvest fraction is estimated by a safeguarded newton solver
     # if false, HARVFRIN = DM_RYE_RM/DMH_RYE.  As the harvest fraction is non-linearly related to the
     # harvest, the amount harvested may be significantly greather than expected depending on CST
     'reseed_harv_delay',  # number of days to delay harvest after reseed, must be >=1
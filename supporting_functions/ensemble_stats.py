@@ -0,0 +1,166 @@
+"""
+online ensemble statistics: the per day mean, standard deviation, min, max and quantiles of output variables across
+the members of an ensemble, updated as each chunk of runs arrives so the members never need to be stored.
+
+the mean and variance are updated with Welford's algorithm (combined per chunk as in Chan et al. 1979).  the
+quantiles come from a mergeable compactor (KLL type) sketch: every run adds one value to each (day, variable), so the
+sketches of all of the (day, variable) cells have the same structure and are updated together as arrays.  each level
+of the sketch holds at most k values; a full level is sorted and every second value is promoted to the next level
+with twice the weight.  the quantiles are exact while there are no more than k members and the rank error grows
+slowly (c. log2(n / k) / k) after that.
+
+an EnsembleStats is a sink for supporting_functions.result_sinks.run_to_sinks, and the statistics of separate
+processes can be combined with merge.
+
+ Created: 19/10/2026
+ """
+import numpy as np
+import pandas as pd
+from supporting_functions.result_sinks import ResultSink
+
+
+class EnsembleStats(ResultSink):
+    def __init__(self, variables=('DM', 'PAW', 'IRRIG'), quantiles=(0.05, 0.5, 0.95), k=128, ddof=1, seed=None):
+        """
+        :param variables: the output variables to summarise
+        :param quantiles: the quantiles (0-1) to estimate
+        :param k: number of values per level of the quantile sketch, larger is more accurate but uses more memory
+                  (c. k * log2(n / k) values per day and variable)
+        :param ddof: delta degrees of freedom of the standard deviation (1 as per pandas)
+        :param seed: seed of the random offsets used when compacting the quantile sketch
+        """
+        self.variables = list(variables)
+        self.quantiles = np.atleast_1d(quantiles).astype(float)
+        assert ((self.quantiles >= 0) & (self.quantiles <= 1)).all(), 'quantiles must be between 0 and 1'
+        assert k >= 2, 'k must be at least 2'
+        self.k = int(k)
+        self.ddof = ddof
+        self.rng = np.random.default_rng(seed)
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+        self.levels = []  # (ndays, nvars, n_values) arrays, the values of level h each have a weight of 2 ** h
+
+    def open(self, out_vars, dates):
+        """
+        set the variables of the arrays passed to write/update and the dates of the days
+        :param out_vars: the variables of the output arrays (must include self.variables)
+        :param dates: the dates of the days
+        """
+        super(EnsembleStats, self).open(out_vars, dates)
+        missing = set(self.variables) - set(self.out_vars)
+        assert len(missing) == 0, 'variables not in out_vars: {}'.format(missing)
+        self._var_idx = np.array([self.out_vars.index(e) for e in self.variables])
+
+    def write(self, start, y):
+        self.update(y)
+
+    def update(self, y):
+        """
+        add the output of a chunk of runs
+        :param y: (n_runs, ndays, len(out_vars)) output array, e.g. from basgra_python.iter_basgra_multisite
+        """
+        y = np.asarray(y, dtype=float)[:, :, self._var_idx]
+        n_b = len(y)
+        if n_b == 0:
+            return
+        mean_b = y.mean(axis=0)
+        m2_b = ((y - mean_b) ** 2).sum(axis=0)
+        self._combine(n_b, mean_b, m2_b, y.min(axis=0), y.max(axis=0), [np.moveaxis(y, 0, -1)])
+
+    def merge(self, other):
+        """
+        add the statistics of another EnsembleStats (e.g. from another process) of the same variables and days
+        :param other: EnsembleStats
+        :return: self
+        """
+        assert other.variables == self.variables, 'can only merge stats of the same variables'
+        if other.n > 0:
+            self._combine(other.n, other.mean, other.m2, other.min, other.max, other.levels)
+        return self
+
+    def _combine(self, n_b, mean_b, m2_b, min_b, max_b, levels_b):
+        if self.n == 0:
+            self.n, self.mean, self.m2 = n_b, mean_b.copy(), m2_b.copy()
+            self.min, self.max = min_b.copy(), max_b.copy()
+        else:
+            n = self.n + n_b
+            delta = mean_b - self.mean
+            self.mean += delta * (n_b / n)
+            self.m2 += m2_b + delta ** 2 * (self.n * n_b / n)
+            self.n = n
+            np.minimum(self.min, min_b, out=self.min)
+            np.maximum(self.max, max_b, out=self.max)
+
+        for h, values in enumerate(levels_b):
+            if h < len(self.levels):
+                self.levels[h] = np.concatenate((self.levels[h], values), axis=-1)
+            else:
+                self.levels.append(values.copy())
+        self._compact()
+
+    def _compact(self):
+        h = 0
+        while h < len(self.levels):
+            values = self.levels[h]
+            size = values.shape[-1]
+            if size > self.k:
+                values = np.sort(values, axis=-1)
+                npair = size // 2 * 2
+                offset = self.rng.integers(2)
+                promoted = values[..., offset:npair:2]
+                self.levels[h] = values[..., npair:]  # the odd value out (if any) stays on this level
+                if h + 1 < len(self.levels):
+                    self.levels[h + 1] = np.concatenate((self.levels[h + 1], promoted), axis=-1)
+                else:
+                    self.levels.append(promoted)
+            h += 1
+
+    def get_quantiles(self, quantiles=None):
+        """
+        estimate quantiles from the sketch (the inverted cdf, i.e. the smallest value with a cumulative weight of at
+        least q * n), the 0 and 1 quantiles are the exact min and max
+        :param quantiles: None (self.quantiles) or the quantiles (0-1) to estimate
+        :return: (len(quantiles), ndays, nvars) array
+        """
+        assert self.n > 0, 'no runs have been added'
+        quantiles = self.quantiles if quantiles is None else np.atleast_1d(quantiles).astype(float)
+        values = np.concatenate(self.levels, axis=-1)
+        weights = np.concatenate([np.full(e.shape[-1], 2. ** h) for h, e in enumerate(self.levels)])
+        order = np.argsort(values, axis=-1)
+        values = np.take_along_axis(values, order, axis=-1)
+        cum_weight = np.cumsum(weights[order], axis=-1)
+        out = np.empty((len(quantiles),) + values.shape[:-1])
+        for i, q in enumerate(quantiles):
+            idx = (cum_weight < q * self.n).sum(axis=-1, keepdims=True)
+            idx = np.minimum(idx, values.shape[-1] - 1)
+            out[i] = np.take_along_axis(values, idx, axis=-1)[..., 0]
+        # the extremes may have been compacted out of the sketch, but they are known exactly
+        out[quantiles <= 0] = self.min
+        out[quantiles >= 1] = self.max
+        return out
+
+    @property
+    def std(self):
+        # nan (as per pandas) if there are too few runs for the degrees of freedom
+        if self.n <= self.ddof:
+            return np.full(self.m2.shape, np.nan)
+        return np.sqrt(self.m2 / (self.n - self.ddof))
+
+    def summary(self):
+        """
+        the summary statistics as dataframes indexed like the output of run_basgra_nz
+        :return: dictionary of {stat: pd.DataFrame (index: date, columns: variables)}, stats are 'mean', 'std',
+                 'min', 'max' and the quantiles as percentages (e.g. '5%', '50%', '95%')
+        """
+        assert self.n > 0, 'no runs have been added'
+        stats = {'mean': self.mean, 'std': self.std, 'min': self.min, 'max': self.max}
+        for q, values in zip(self.quantiles, self.get_quantiles()):
+            stats['{:g}%'.format(q * 100)] = values
+        out = {}
+        for k, values in stats.items():
+            out[k] = pd.DataFrame(values, index=self.dates, columns=self.variables)
+            out[k].index.name = 'date'
+        return out
@@ -0,0 +1,94 @@
+"""
+operational forecasts: the pasture of one or more sites over the coming weeks for an ensemble of weather futures,
+starting from the modelled state of each site today.  the history of each site is simulated once (a
+basgra_python.BasgraSimulation advanced to today) and every member of the ensemble starts from a copy of that state
+in one fortran call (BasgraSimulation.forecast), so the history is not re-run for each member.  the members are
+summarised per day with supporting_functions.ensemble_stats.EnsembleStats.
+
+ Created: 19/10/2026
+ """
+import numpy as np
+import pandas as pd
+from supporting_functions.ensemble_stats import EnsembleStats
+
+# the output variables needed to calculate the pasture growth rate
+_pgr_vars = ['DM', 'RYE_YIELD']
+
+
+def pasture_growth(dm, rye_yield, doy, dm_start, yield_start):
+    """
+    pasture growth rate (PGR, kg DM/ha/day): the change in DM from the previous day plus the DM actually harvested,
+    which is the daily increase in RYE_YIELD (DM and RYE_YIELD are ryegrass only, the weed removal is not counted).
+    RYE_YIELD is reset on doy 152, so the harvest of that day is RYE_YIELD itself
+    :param dm: (n_members, n_days) DM output (kg DM/ha, after any harvest)
+    :param rye_yield: (n_members, n_days) RYE_YIELD output (tDM/ha, cumulative since the last doy 152)
+    :param doy: (n_days,) day of year of each day
+    :param dm_start: DM of the day before the first day (nan if unknown)
+    :param yield_start: RYE_YIELD of the day before the first day (nan if unknown)
+    :return: (n_members, n_days) float array
+    """
+    dm = np.atleast_2d(dm)
+    rye_yield = np.atleast_2d(rye_yield)
+    previous = np.concatenate((np.full((len(dm), 1), dm_start, dtype=float), dm[:, :-1]), axis=1)
+    previous_yield = np.concatenate((np.full((len(dm), 1), yield_start, dtype=float), rye_yield[:, :-1]), axis=1)
+    previous_yield[:, np.asarray(doy) == 152] = 0
+    return dm - previous + (rye_yield - previous_yield) * 1000
+
+
+def forecast_members(sim, member_weather, days_harvest=None, variables=('DM', 'PGR')):
+    """
+    forecast one site from the current state of its simulation
+    :param sim: basgra_python.BasgraSimulation advanced to the last day before the forecast
+    :param member_weather: (n_members, n_days, nweather) float array, see BasgraSimulation.forecast
+    :param days_harvest: None or auto harvest data of the forecast days, see BasgraSimulation.forecast
+    :param variables: output variables, 'PGR' is the pasture growth rate (see pasture_growth)
+    :return: (n_members, n_days, len(variables)) float array, dates (pd.DatetimeIndex)
+    """
+    variables = list(variables)
+    member_weather = np.asarray(member_weather)
+    out_vars = [e for e in variables if e != 'PGR']
+    if 'PGR' in variables:
+        out_vars += [e for e in _pgr_vars if e not in out_vars]
+    y = sim.forecast(member_weather, days_harvest, out_vars=out_vars)
+
+    columns = {v: y[:, :, i] for i, v in enumerate(out_vars)}
+    if 'PGR' in variables:
+        dm_start, yield_start = np.nan, np.nan
+        if sim.day > 0:
+            dm_start = sim.outputs_so_far['DM'].iloc[-1]
+            yield_start = sim.outputs_so_far['RYE_YIELD'].iloc[-1]
+        columns['PGR'] = pasture_growth(columns['DM'], columns['RYE_YIELD'], member_weather[0, :, 1], dm_start,
+                                        yield_start)
+    out = np.stack([columns[v] for v in variables], axis=-1)
+
+    dates = pd.to_datetime(['{}-{:03d}'.format(int(e), int(f)) for e, f in member_weather[0, :, :2]],
+                           format='%Y-%j')
+    return out, dates
+
+
+def forecast_sites(sims, member_weather, days_harvest=None, variables=('DM', 'PGR'), quantiles=(0.1, 0.5, 0.9),
+                   k=None):
+    """
+    forecast a number of sites (e.g. farms) and summarise the members of each site per day
+    :param sims: dictionary of {site: basgra_python.BasgraSimulation}, each advanced to the last day before the
+                 forecast
+    :param member_weather: (n_members, n_days, nweather) float array shared by all sites or dictionary of
+                           {site: array}, see BasgraSimulation.forecast
+    :param days_harvest: None, auto harvest data of the forecast days shared by all sites or dictionary of
+                         {site: data or None}
+    :param variables: output variables to summarise, 'PGR' is the pasture growth rate (see pasture_growth)
+    :param quantiles: the quantiles (0-1) of the members to return
+    :param k: None (exact quantiles) or the size of the quantile sketch, see EnsembleStats
+    :return: dictionary of {site: {stat: pd.DataFrame (index: date, columns: variables)}}, the stats are as per
+             EnsembleStats.summary ('mean', 'std', 'min', 'max' and the quantiles as percentages e.g. '50%')
+    """
+    out = {}
+    for site, sim in sims.items():
+        weather = member_weather[site] if isinstance(member_weather, dict) else member_weather
+        harvest = days_harvest[site] if isinstance(days_harvest, dict) else days_harvest
+        y, dates = forecast_members(sim, weather, harvest, variables)
+        stats = EnsembleStats(variables, quantiles, k=max(len(y), 2) if k is None else k)
+        stats.open(variables, dates)
+        stats.update(y)
+        out[site] = stats.summary()
+    return out
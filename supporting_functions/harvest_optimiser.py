@@ -0,0 +1,280 @@
+"""
+optimisation of auto harvest schedules: a search of the harvest trigger, target and fraction of each season for the
+schedule with the most yield that keeps the sward persistent (the lowest BASAL of the run at or above a limit).  the
+days harvest data of a batch of candidates is built as one (n_candidates, ndays, len(days_harvest_keys)) array from
+the season of each day (no dataframe per candidate) and the batch is run with basgra_python.run_basgra_multisite.
+
+the search is a compass (pattern) search on a grid of values: from each start every variable is moved up and down by
+its step, the best improvement is taken and the steps are halved when there is none.  the neighbours of all of the
+starts are run as one batch and the results are cached by their grid values, so candidates that are visited again
+(which is common in a pattern search) are not run again.
+
+ Created: 19/10/2026
+ """
+import numpy as np
+import pandas as pd
+from basgra_python import run_basgra_multisite
+from input_output_keys import days_harvest_keys, matrix_weather_keys_pet, matrix_weather_keys_penman
+from supporting_functions.irrigation_optimiser import total_yield
+
+# months of each season (southern hemisphere)
+default_seasons = {
+    'spring': (9, 10, 11),
+    'summer': (12, 1, 2),
+    'autumn': (3, 4, 5),
+    'winter': (6, 7, 8),
+}
+
+# the auto harvest keys set per season, with default bounds and grid resolution
+schedule_keys = ('harv_trig', 'harv_targ', 'frac_harv')
+default_bounds = {
+    'harv_trig': (1500., 4500.),  # kg DM/ha
+    'harv_targ': (500., 2500.),  # kg DM/ha
+    'frac_harv': (0.5, 1.),
+}
+default_resolution = {
+    'harv_trig': 50.,
+    'harv_targ': 50.,
+    'frac_harv': 0.05,
+}
+
+
+class HarvestOptimiser(object):
+    def __init__(self, params, matrix_weather, doy_irr, days_harvest=None, seasons=None, bounds=None,
+                 resolution=None, supply_pet=True, dll_path='default', nprocesses=1, batch_size=256, verbose=False):
+        """
+        :param params: dictionary of the parameters shared by all candidates (see run_basgra_nz), fixed_removal is
+                       set per candidate
+        :param matrix_weather: weather dataframe, see run_basgra_nz
+        :param doy_irr: see run_basgra_nz
+        :param days_harvest: None or auto harvest data (one row per day, see run_basgra_nz) for the values that are
+                             not searched (weed_dm_frac, reseed_trig and reseed_basal). None is no weeds and no
+                             reseeding
+        :param seasons: None (default_seasons) or dictionary of {season: months}, every month must be in one season
+        :param bounds: None or dictionary of {key: (low, high)} to replace default_bounds
+        :param resolution: None or dictionary of {key: resolution} to replace default_resolution, the grid that the
+                           candidates are snapped to (and cached by)
+        :param supply_pet: see run_basgra_nz
+        :param dll_path: see run_basgra_nz
+        :param nprocesses: number of processes to run each batch in, see run_basgra_multisite
+        :param batch_size: number of candidates per call of run_basgra_multisite (limits the memory used)
+        :param verbose: see run_basgra_nz
+        """
+        keys = matrix_weather_keys_pet if supply_pet else matrix_weather_keys_penman
+        self.params = params
+        self.weather = np.ascontiguousarray(matrix_weather.loc[:, keys].values, dtype=float)
+        ndays = len(self.weather)
+        dates = pd.to_datetime(['{}-{:03d}'.format(int(e), int(f)) for e, f in self.weather[:, :2]],
+                               format='%Y-%j')
+
+        self.seasons = dict(default_seasons if seasons is None else seasons)
+        months = [m for e in self.seasons.values() for m in e]
+        assert sorted(months) == list(range(1, 13)), 'every month must be in exactly one season'
+        month_season = np.zeros(13, int)
+        for i, e in enumerate(self.seasons.values()):
+            month_season[list(e)] = i
+        self._day_season = month_season[dates.month]
+
+        self.bounds = dict(default_bounds)
+        self.bounds.update({} if bounds is None else bounds)
+        self.resolution = dict(default_resolution)
+        self.resolution.update({} if resolution is None else resolution)
+        assert set(self.bounds.keys()) == set(schedule_keys), 'bounds must only have the keys {}'.format(schedule_keys)
+        assert set(self.resolution.keys()) == set(schedule_keys), 'resolution must only have the keys {}'.format(
+            schedule_keys)
+        self._low = np.array([self.bounds[k][0] for k in schedule_keys])
+        self._high = np.array([self.bounds[k][1] for k in schedule_keys])
+        self._res = np.array([self.resolution[k] for k in schedule_keys])
+        assert (self._high >= self._low).all() and (self._res > 0).all(), 'bad bounds or resolution'
+        self._trig, self._targ = schedule_keys.index('harv_trig'), schedule_keys.index('harv_targ')
+        assert self._low[self._targ] <= self._low[self._trig], (
+            'the lowest harv_targ must be at most the lowest harv_trig')
+
+        # the harvest data that is not searched, the searched columns are filled per batch
+        self._base_harvest = np.zeros((ndays, len(days_harvest_keys)))
+        self._base_harvest[:, :2] = self.weather[:, :2]
+        if days_harvest is None:
+            self._base_harvest[:, days_harvest_keys.index('reseed_trig')] = -1
+            self._base_harvest[:, days_harvest_keys.index('reseed_basal')] = 1
+        else:
+            assert len(days_harvest) == ndays, 'days_harvest must have one row per day'
+            assert (days_harvest[['year', 'doy']].values == self.weather[:, :2]).all(), (
+                'days_harvest and matrix_weather dates must match')
+            for k in ('weed_dm_frac', 'reseed_trig', 'reseed_basal'):
+                self._base_harvest[:, days_harvest_keys.index(k)] = days_harvest[k].values
+        self._harvest_idx = [days_harvest_keys.index(k) for k in schedule_keys]
+
+        self.doy_irr = doy_irr
+        self.supply_pet = supply_pet
+        self.dll_path = dll_path
+        self.nprocesses = nprocesses
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self._cache = {}
+        self.n_runs = 0
+        self.n_cache_hits = 0
+
+    @property
+    def columns(self):
+        """
+        the columns of a candidates dataframe
+        """
+        return ['{}_{}'.format(s, k) for s in self.seasons for k in schedule_keys] + ['fixed_removal']
+
+    def to_frame(self, x, fixed_removal):
+        """
+        candidates as a dataframe
+        :param x: (n, nseasons, len(schedule_keys)) array of the values of each season
+        :param fixed_removal: (n,) array of the fixed_removal of each candidate
+        :return: pd.DataFrame with the columns self.columns
+        """
+        x = np.asarray(x, dtype=float)
+        data = np.concatenate((x.reshape(len(x), -1), np.asarray(fixed_removal, float)[:, np.newaxis]), axis=1)
+        return pd.DataFrame(data, columns=self.columns)
+
+    def from_frame(self, candidates):
+        """
+        the (x, fixed_removal) arrays of a candidates dataframe, see to_frame
+        """
+        x = candidates.loc[:, self.columns[:-1]].values.reshape(len(candidates), len(self.seasons),
+                                                                len(schedule_keys))
+        return x, candidates['fixed_removal'].values
+
+    def _snap(self, x):
+        x = np.clip(x, self._low, self._high)
+        x = self._low + np.round((x - self._low) / self._res) * self._res
+        # harv_targ must be at most harv_trig (see basgra_python._test_basgra_inputs), the highest grid value that is
+        targ = np.minimum(x[..., self._targ], x[..., self._trig])
+        low, res = self._low[self._targ], self._res[self._targ]
+        x[..., self._targ] = low + np.floor((targ - low) / res + 1e-9) * res
+        return x
+
+    def _key(self, x, fixed_removal):
+        return tuple(np.round((x - self._low) / self._res).astype(int).ravel()) + (int(fixed_removal),)
+
+    def harvest_arrays(self, x):
+        """
+        the auto harvest data of candidates
+        :param x: (n, nseasons, len(schedule_keys)) array of the values of each season
+        :return: (n, ndays, len(days_harvest_keys)) array, see run_basgra_multisite
+        """
+        x = np.asarray(x)
+        assert (x[..., self._targ] <= x[..., self._trig]).all(), 'harv_targ must be at most harv_trig'
+        out = np.repeat(self._base_harvest[np.newaxis], len(x), axis=0)
+        out[:, :, self._harvest_idx] = x[:, self._day_season]
+        return out
+
+    def evaluate(self, candidates):
+        """
+        run candidates (snapped to the grid), candidates that have been run before are taken from the cache
+        :param candidates: pd.DataFrame with the columns self.columns
+        :return: a copy of candidates (snapped) with the columns 'YIELD' (total, tDM/ha) and 'min_BASAL' (the lowest
+                 BASAL of the run, %)
+        """
+        x, fixed_removal = self.from_frame(candidates)
+        x = self._snap(x)
+        yields, basal = self._evaluate(x, fixed_removal)
+        out = self.to_frame(x, fixed_removal)
+        out.index = candidates.index
+        out['YIELD'] = yields
+        out['min_BASAL'] = basal
+        return out
+
+    def _evaluate(self, x, fixed_removal):
+        keys = [self._key(e, f) for e, f in zip(x, fixed_removal)]
+        new = {}
+        for i, k in enumerate(keys):
+            if k not in self._cache and k not in new:
+                new[k] = i
+        self.n_cache_hits += len(keys) - len(new)
+        idx = np.array(list(new.values()), int)
+        for start in range(0, len(idx), self.batch_size):
+            batch = idx[start:start + self.batch_size]
+            site_params = pd.DataFrame({'fixed_removal': np.asarray(fixed_removal, float)[batch]})
+            out = run_basgra_multisite(self.params, self.weather, self.harvest_arrays(x[batch]), self.doy_irr,
+                                       site_params=site_params, verbose=self.verbose, dll_path=self.dll_path,
+                                       supply_pet=self.supply_pet, auto_harvest=True, out_vars=['YIELD', 'BASAL'],
+                                       nprocesses=self.nprocesses)
+            yields = total_yield(out[:, :, 0], self.weather[:, 1])
+            basal = out[:, :, 1].min(axis=1)
+            for i, y, b in zip(batch, yields, basal):
+                self._cache[keys[i]] = (y, b)
+            self.n_runs += len(batch)
+        results = np.array([self._cache[k] for k in keys]).reshape(len(keys), 2)
+        return results[:, 0], results[:, 1]
+
+    def optimise(self, min_basal, starts=None, n_starts=4, fixed_removal=None, max_iter=50, seed=None):
+        """
+        compass search for the schedule with the most yield whose lowest BASAL is at least min_basal
+        :param min_basal: the lowest BASAL (%) allowed during the run
+        :param starts: None or pd.DataFrame of the starting candidates (columns self.columns)
+        :param n_starts: if starts is None, the number of random starts for each value of fixed_removal (the first
+                         is the middle of the bounds)
+        :param fixed_removal: if starts is None, the values of fixed_removal to search from, default is the value
+                              in params
+        :param max_iter: maximum number of iterations
+        :param seed: seed of the random starts
+        :return: best (pd.Series, the best feasible candidate or the candidate closest to min_basal if none are
+                 feasible), history (pd.DataFrame of every candidate visited, in order, with the columns of evaluate,
+                 'iteration' and 'feasible')
+        """
+        nseas, nkey = len(self.seasons), len(schedule_keys)
+        if starts is None:
+            rng = np.random.default_rng(seed)
+            if fixed_removal is None:
+                fixed_removal = [self.params['fixed_removal']]
+            x = self._low + rng.random((n_starts * len(fixed_removal), nseas, nkey)) * (self._high - self._low)
+            x[::n_starts] = (self._low + self._high) / 2
+            fr = np.repeat(np.asarray(fixed_removal, float), n_starts)
+        else:
+            x, fr = self.from_frame(starts)
+        x = self._snap(np.asarray(x, dtype=float))
+        nst = len(x)
+        step = np.repeat(((self._high - self._low) / 4)[np.newaxis], nst, axis=0)  # (nst, nkey) step per key
+
+        def feasible(yields, basal):
+            return (basal >= min_basal) & np.isfinite(yields)
+
+        def score(yields, basal):
+            # feasible candidates by yield, then the others by how close they are to min_basal (runs that went nan
+            # are last, as np.argmax would pick a nan score)
+            closeness = np.where(np.isnan(basal), -np.inf, np.minimum(basal - min_basal, 0))
+            return np.where(feasible(yields, basal), yields, closeness - 1e9)
+
+        yields, basal = self._evaluate(x, fr)
+        best = score(yields, basal)
+        history = [self.to_frame(x, fr).assign(YIELD=yields, min_BASAL=basal, iteration=0)]
+
+        for it in range(1, max_iter + 1):
+            active = (step >= self._res).any(axis=1)
+            if not active.any():
+                break
+            # the neighbours of each active start: each variable up and down by its step
+            moves = np.zeros((2 * nseas * nkey, nseas, nkey))
+            for j in range(nseas * nkey):
+                moves[2 * j].flat[j] = 1
+                moves[2 * j + 1].flat[j] = -1
+            starts_idx = np.repeat(np.flatnonzero(active), len(moves))
+            neighbours = x[starts_idx] + np.tile(moves, (active.sum(), 1, 1)) * step[starts_idx][:, np.newaxis]
+            neighbours = self._snap(neighbours)
+            n_yields, n_basal = self._evaluate(neighbours, fr[starts_idx])
+            history.append(self.to_frame(neighbours, fr[starts_idx]).assign(YIELD=n_yields, min_BASAL=n_basal,
+                                                                             iteration=it))
+            n_score = score(n_yields, n_basal).reshape(active.sum(), len(moves))
+            for i, s, scores in zip(np.flatnonzero(active), range(active.sum()), n_score):
+                j = np.argmax(scores)
+                if scores[j] > best[i]:
+                    x[i] = neighbours[s * len(moves) + j]
+                    best[i] = scores[j]
+                    yields[i], basal[i] = n_yields[s * len(moves) + j], n_basal[s * len(moves) + j]
+                else:
+                    step[i] /= 2
+
+        history = pd.concat(history, ignore_index=True)
+        history['feasible'] = feasible(history['YIELD'].values, history['min_BASAL'].values)
+        i = np.argmax(best)
+        out = self.to_frame(x[[i]], fr[[i]]).iloc[0]
+        out['YIELD'] = yields[i]
+        out['min_BASAL'] = basal[i]
+        out['feasible'] = feasible(yields[i], basal[i])
+        return out, history
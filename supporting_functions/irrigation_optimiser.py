@@ -0,0 +1,285 @@
+"""
+optimisation of irrigation strategies: a search of the irrigation trigger and target, IRRIGF, irr_frm_paw and the
+irrigation window for the strategies that give the most yield for the least water.  the candidates are run in
+batches with basgra_python.run_basgra_multisite (one candidate per site, so the inputs are checked once per batch and
+the batches can run in several processes) and poor candidates are dropped early by successive halving: every
+candidate is run over a short horizon (the start of the period), the best 1/eta of them (by pareto rank of total
+IRRIG vs total YIELD) are run over a horizon eta times longer and so on until the survivors are run over the whole
+period.  the irrigation of a run over a horizon is the same as the first days of the full run, so candidates that
+already use more than the water cap over a short horizon can never meet it and are always dropped.
+
+ Created: 19/10/2026
+ """
+import itertools
+import numpy as np
+import pandas as pd
+from basgra_python import run_basgra_multisite
+from input_output_keys import matrix_weather_keys_pet, matrix_weather_keys_penman
+
+# the keys of an irrigation strategy that are set in the weather and the parameters of each candidate, the irrigation
+# window (doy_irr) is set by the columns irr_start and irr_stop
+strategy_weather_keys = ('irr_trig', 'irr_targ')
+strategy_param_keys = ('IRRIGF', 'irr_frm_paw')
+
+
+def window_doys(start, stop):
+    """
+    the days of year of an irrigation window
+    :param start: first day of year to irrigate
+    :param stop: last day of year to irrigate, the window wraps over the new year if stop < start
+    :return: list of days of year
+    """
+    start, stop = int(start), int(stop)
+    assert 1 <= start <= 366 and 1 <= stop <= 366, 'the irrigation window must be days of year (1-366)'
+    if stop >= start:
+        return list(range(start, stop + 1))
+    return list(range(start, 367)) + list(range(1, stop + 1))
+
+
+def _get_windows(value):
+    if isinstance(value, tuple):
+        value = [value]
+    assert all(len(e) == 2 for e in value), 'doy_irr must be a (start, stop) window or a list of windows'
+    return [(int(e[0]), int(e[1])) for e in value]
+
+
+def _check_space(space):
+    bad_keys = set(space.keys()) - set(strategy_weather_keys + strategy_param_keys + ('doy_irr',))
+    assert len(bad_keys) == 0, 'unexpected keys in the strategy space: {}'.format(bad_keys)
+
+
+def _finish_strategies(out):
+    out = pd.DataFrame(out)
+    if 'irr_trig' in out and 'irr_targ' in out:
+        out['irr_targ'] = np.maximum(out['irr_targ'], out['irr_trig'])  # irrigate to at least the trigger
+    return out
+
+
+def sample_strategies(space, n, seed=None):
+    """
+    sample candidate strategies from a strategy space, the ranges are sampled with a latin hypercube (one sample in
+    each of n equal strata of each range) and the choices evenly
+    :param space: dictionary of the strategy space, keys in strategy_weather_keys, strategy_param_keys and 'doy_irr'
+                  with values of:
+                  * a (low, high) tuple: a range of values (not for doy_irr)
+                  * a list: the values to choose from
+                  * a number: a fixed value
+                  doy_irr is a (start, stop) irrigation window (see window_doys) or a list of windows to choose from.
+                  irr_targ is raised to irr_trig where it is lower
+    :param n: number of candidates
+    :param seed: seed of the random sampling
+    :return: pd.DataFrame of the candidates (columns are the keys of space, doy_irr is split into irr_start and
+             irr_stop)
+    """
+    _check_space(space)
+    rng = np.random.default_rng(seed)
+    out = {}
+    for key, value in space.items():
+        if key == 'doy_irr':
+            windows = np.array(_get_windows(value))
+            idx = rng.permutation(np.resize(np.arange(len(windows)), n))
+            out['irr_start'], out['irr_stop'] = windows[idx, 0], windows[idx, 1]
+        elif isinstance(value, tuple):
+            low, high = value
+            out[key] = low + (rng.permutation(n) + rng.random(n)) / n * (high - low)
+        elif isinstance(value, list):
+            out[key] = rng.permutation(np.resize(np.array(value, dtype=float), n))
+        else:
+            out[key] = np.full(n, value, dtype=float)
+    return _finish_strategies(out)
+
+
+def grid_strategies(space, n_levels=3):
+    """
+    all combinations of a strategy space, e.g. to replace hand written grid loops
+    :param space: see sample_strategies
+    :param n_levels: number of evenly spaced values of each range
+    :return: pd.DataFrame of the candidates, see sample_strategies
+    """
+    _check_space(space)
+    keys, levels = [], []
+    for key, value in space.items():
+        if key == 'doy_irr':
+            keys.append(('irr_start', 'irr_stop'))
+            levels.append(_get_windows(value))
+        elif isinstance(value, tuple):
+            keys.append((key,))
+            levels.append([(e,) for e in np.linspace(value[0], value[1], n_levels)])
+        elif isinstance(value, list):
+            keys.append((key,))
+            levels.append([(e,) for e in value])
+        else:
+            keys.append((key,))
+            levels.append([(value,)])
+    columns = [k for e in keys for k in e]
+    rows = [[v for e in combo for v in e] for combo in itertools.product(*levels)]
+    return _finish_strategies(pd.DataFrame(rows, columns=columns, dtype=float))
+
+
+def total_yield(yield_out, doy):
+    """
+    the total harvested yield of runs.  the YIELD output is the cumulative yield since the last 1 June (doy 152), so
+    the total is the sum of its daily increases with the value on 1 June as the increase of that day
+    :param yield_out: (n_runs, ndays) YIELD output (tDM/ha)
+    :param doy: (ndays,) day of year of each day
+    :return: (n_runs,) total yield (tDM/ha)
+    """
+    yield_out = np.atleast_2d(yield_out)
+    increase = np.diff(yield_out, axis=1, prepend=0.)
+    reset = np.asarray(doy) == 152
+    increase[:, reset] = yield_out[:, reset]
+    return increase.sum(axis=1)
+
+
+def pareto_rank(cost, benefit):
+    """
+    the non-dominated sorting rank of candidates that minimise cost and maximise benefit, 0 is the pareto front, 1
+    the front of the others and so on.  nan values are dominated by any other value
+    :param cost: 1d array, e.g. total IRRIG
+    :param benefit: 1d array, e.g. total YIELD
+    :return: 1d int array
+    """
+    cost = np.where(np.isnan(cost), np.inf, np.asarray(cost, dtype=float))
+    benefit = np.where(np.isnan(benefit), -np.inf, np.asarray(benefit, dtype=float))
+    rank = np.zeros(len(cost), int)
+    remaining = np.arange(len(cost))
+    r = 0
+    while len(remaining) > 0:
+        c, b = cost[remaining], benefit[remaining]
+        # dominates[i, j]: candidate i is at least as good as j in both and better in one
+        dominates = (c[:, np.newaxis] <= c) & (b[:, np.newaxis] >= b) & ((c[:, np.newaxis] < c) |
+                                                                         (b[:, np.newaxis] > b))
+        dominated = dominates.any(axis=0)
+        rank[remaining[~dominated]] = r
+        remaining = remaining[dominated]
+        r += 1
+    return rank
+
+
+class IrrigationOptimiser(object):
+    def __init__(self, params, matrix_weather, days_harvest, doy_irr=None, supply_pet=True, auto_harvest=True,
+                 dll_path='default', nprocesses=1, batch_size=256, verbose=False):
+        """
+        :param params: dictionary of the parameters shared by all candidates (see run_basgra_nz), the IRRIGF and
+                       irr_frm_paw of a strategy replace the values in params
+        :param matrix_weather: weather dataframe (see run_basgra_nz), the irr_trig and irr_targ of a strategy replace
+                               the values in matrix_weather. max_irr sets the irrigation available each day
+        :param days_harvest: days harvest dataframe, see run_basgra_nz
+        :param doy_irr: the days of year to irrigate for strategies without an irrigation window
+        :param supply_pet: see run_basgra_nz
+        :param auto_harvest: see run_basgra_nz
+        :param dll_path: see run_basgra_nz
+        :param nprocesses: number of processes to run each batch in, see run_basgra_multisite
+        :param batch_size: number of candidates per call of run_basgra_multisite (limits the memory used)
+        :param verbose: see run_basgra_nz
+        """
+        keys = matrix_weather_keys_pet if supply_pet else matrix_weather_keys_penman
+        self.params = params
+        self.weather = np.ascontiguousarray(matrix_weather.loc[:, keys].values, dtype=float)
+        self._weather_idx = {k: keys.index(k) for k in strategy_weather_keys}
+        self.dates = pd.to_datetime(['{}-{:03d}'.format(int(e), int(f)) for e, f in self.weather[:, :2]],
+                                    format='%Y-%j')
+        self.days_harvest = days_harvest
+        self._harvest_dates = pd.to_datetime(['{}-{:03d}'.format(int(e), int(f)) for e, f in
+                                              days_harvest[['year', 'doy']].itertuples(False, None)], format='%Y-%j')
+        self.doy_irr = doy_irr
+        self.supply_pet = supply_pet
+        self.auto_harvest = auto_harvest
+        self.dll_path = dll_path
+        self.nprocesses = nprocesses
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self.history = None
+
+    @property
+    def ndays(self):
+        return len(self.weather)
+
+    def evaluate(self, strategies, ndays=None):
+        """
+        run the candidates and total their irrigation and yield
+        :param strategies: pd.DataFrame of the candidates, see sample_strategies
+        :param ndays: None (the whole period) or the number of days from the start of the period to run
+        :return: a copy of strategies with the columns 'IRRIG' (total, mm) and 'YIELD' (total, tDM/ha)
+        """
+        ndays = self.ndays if ndays is None else int(ndays)
+        assert 1 <= ndays <= self.ndays, 'ndays must be between 1 and {}'.format(self.ndays)
+        bad_keys = set(strategies.columns) - set(strategy_weather_keys + strategy_param_keys +
+                                                 ('irr_start', 'irr_stop'))
+        assert len(bad_keys) == 0, 'unexpected strategy columns: {}'.format(bad_keys)
+        has_window = 'irr_start' in strategies.columns
+        assert has_window == ('irr_stop' in strategies.columns), 'irr_start and irr_stop must be passed together'
+        assert has_window or self.doy_irr is not None, 'doy_irr must be set when the strategies have no window'
+
+        days_harvest = self.days_harvest.loc[self._harvest_dates <= self.dates[ndays - 1]]
+        param_keys = [e for e in strategy_param_keys if e in strategies.columns]
+        weather_keys = [e for e in strategy_weather_keys if e in strategies.columns]
+        totals = np.zeros((len(strategies), 2))
+        for start in range(0, len(strategies), self.batch_size):
+            batch = strategies.iloc[start:start + self.batch_size]
+            weather = np.repeat(self.weather[np.newaxis, :ndays], len(batch), axis=0)
+            for k in weather_keys:
+                weather[:, :, self._weather_idx[k]] = batch[k].values[:, np.newaxis]
+            if has_window:
+                doy_irr = [window_doys(e, f) for e, f in batch[['irr_start', 'irr_stop']].itertuples(False, None)]
+            else:
+                doy_irr = self.doy_irr
+            site_params = batch[param_keys].reset_index(drop=True) if len(param_keys) > 0 else None
+            out = run_basgra_multisite(self.params, weather, days_harvest, doy_irr, site_params=site_params,
+                                       verbose=self.verbose, dll_path=self.dll_path, supply_pet=self.supply_pet,
+                                       auto_harvest=self.auto_harvest, out_vars=['IRRIG', 'YIELD'],
+                                       nprocesses=self.nprocesses)
+            totals[start:start + len(batch), 0] = out[:, :, 0].sum(axis=1)
+            totals[start:start + len(batch), 1] = total_yield(out[:, :, 1], self.weather[:ndays, 1])
+        out = strategies.copy()
+        out['IRRIG'] = totals[:, 0]
+        out['YIELD'] = totals[:, 1]
+        return out
+
+    def optimise(self, strategies, max_irrig=None, yield_target=None, eta=3, horizons=None, min_keep=10):
+        """
+        successive halving search for the pareto front of total IRRIG vs total YIELD over the whole period
+        :param strategies: pd.DataFrame of the candidates, see sample_strategies and grid_strategies
+        :param max_irrig: None or the water cap, the maximum total irrigation (mm) over the whole period
+        :param yield_target: None or the minimum total yield (tDM/ha) over the whole period
+        :param eta: the fraction (1/eta) of the candidates kept at each horizon
+        :param horizons: None or increasing numbers of days to run the candidates for, the last must be the whole
+                         period. default is the whole period / eta ** 2, / eta and the whole period
+        :param min_keep: the minimum number of candidates kept at each horizon
+        :return: pd.DataFrame of the candidates run over the whole period sorted by IRRIG, with the columns of
+                 evaluate and 'pareto' (on the pareto front of these candidates) and 'feasible' (meets max_irrig and
+                 yield_target), so the cheapest strategy that meets the target is the first feasible row.
+                 every evaluation is kept in self.history (with the columns 'horizon' and 'ndays')
+        """
+        assert eta > 1, 'eta must be greater than 1'
+        if horizons is None:
+            horizons = [int(np.ceil(self.ndays / eta ** k)) for k in (2, 1, 0)]
+        horizons = list(horizons)
+        assert np.all(np.diff(horizons) > 0), 'horizons must be increasing'
+        assert horizons[-1] == self.ndays, 'the last horizon must be the whole period ({} days)'.format(self.ndays)
+
+        candidates = strategies.reset_index(drop=True)
+        history = []
+        for i, ndays in enumerate(horizons):
+            results = self.evaluate(candidates, ndays)
+            results.index = candidates.index
+            history.append(results.assign(horizon=i, ndays=ndays))
+            if max_irrig is not None:
+                results = results.loc[results['IRRIG'] <= max_irrig]
+            if i == len(horizons) - 1:
+                break
+            keep = max(int(np.ceil(len(candidates) / eta)), min_keep)
+            rank = pareto_rank(results['IRRIG'].values, results['YIELD'].values)
+            order = np.lexsort((results['IRRIG'].values, rank))[:keep]
+            candidates = candidates.loc[results.index[np.sort(order)]]
+        self.history = pd.concat(history)
+        self.history.index.name = 'candidate'
+
+        results = results.sort_values('IRRIG', kind='stable')
+        results['pareto'] = pareto_rank(results['IRRIG'].values, results['YIELD'].values) == 0
+        feasible = np.ones(len(results), bool)
+        if yield_target is not None:
+            feasible &= (results['YIELD'] >= yield_target).values
+        results['feasible'] = feasible
+        results.index.name = 'candidate'
+        return results
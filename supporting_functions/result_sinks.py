@@ -0,0 +1,249 @@
+"""
+streaming sinks for ensemble results.  run_to_sinks runs an ensemble (see basgra_python.iter_basgra_multisite) and
+passes the output of each chunk of runs to one or more sinks as soon as it is finished.  the sinks are written on a
+background thread, which overlaps with the fortran runs (ctypes releases the GIL), through a bounded queue: when the
+sinks fall behind the runs wait, so memory use stays flat however many runs there are.
+
+a sink is any object with the methods:
+    open(out_vars, dates): called once before any results
+    write(start, y): y is the (n_runs, ndays, len(out_vars)) output of runs start to start + n_runs
+    close(): called once after all results
+built in sinks keep a reduction in memory (ReducerSink), write to a partitioned parquet store (ParquetSink), to a .npy
+memmap (MemmapSink) or one csv per run (CsvSink).
+
+ Created: 19/10/2026
+ """
+import os
+import queue
+import threading
+import numpy as np
+import pandas as pd
+from basgra_python import iter_basgra_multisite
+from input_output_keys import out_cols
+
+
+class ResultSink(object):
+    """
+    base class of the sinks
+    """
+
+    def open(self, out_vars, dates):
+        self.out_vars = list(out_vars)
+        self.dates = pd.DatetimeIndex(dates)
+
+    def write(self, start, y):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ReducerSink(ResultSink):
+    def __init__(self, reducer=None):
+        """
+        keep the (reduced) output of each run in memory
+        :param reducer: None (keep the whole output) or a function f(y, out_vars, dates) which reduces the
+                        (n_runs, ndays, n_vars) output of a chunk of runs to an array with one entry per run on the
+                        first axis, e.g. annual_total('YIELD')
+        """
+        self.reducer = reducer
+        self._blocks = {}
+
+    def write(self, start, y):
+        if self.reducer is not None:
+            y = np.asarray(self.reducer(y, self.out_vars, self.dates))
+        self._blocks[start] = y
+
+    @property
+    def result(self):
+        """
+        the (reduced) output of all of the runs, in run order
+        """
+        return np.concatenate([self._blocks[k] for k in sorted(self._blocks)])
+
+    def to_dataframes(self):
+        """
+        the output of each run as a dataframe (as returned by run_basgra_nz), e.g. for plotting.plot_multiple_results
+        :return: dictionary {run: pd.DataFrame}
+        """
+        assert self.reducer is None, 'to_dataframes is only available when the whole output is kept (reducer=None)'
+        out = {}
+        for i, y in enumerate(self.result):
+            out[i] = pd.DataFrame(y, index=self.dates, columns=self.out_vars)
+            out[i].index.name = 'date'
+        return out
+
+
+def annual_total(var):
+    """
+    a reducer for ReducerSink which sums one variable in each calendar year (e.g. 'YIELD' or 'IRRIG')
+    :param var: output variable
+    :return: function which returns a (n_runs, n_years) array
+    """
+
+    def reducer(y, out_vars, dates):
+        years = dates.year.values
+        _, inverse = np.unique(years, return_inverse=True)
+        out = np.zeros((len(y), inverse.max() + 1))
+        np.add.at(out.T, inverse, y[:, :, out_vars.index(var)].T)
+        return out
+
+    return reducer
+
+
+class ParquetSink(ResultSink):
+    def __init__(self, path, site, scenario='base', **store_kwargs):
+        """
+        write the runs as realisations of one partition of a supporting_functions.result_store.ResultStore
+        :param path: directory of the store
+        :param site: site name
+        :param scenario: scenario name
+        :param store_kwargs: passed to ResultStore (e.g. dtypes, compression), backend defaults to parquet
+        """
+        self.path = path
+        self.site = site
+        self.scenario = scenario
+        self.store_kwargs = store_kwargs
+        self.store = None
+
+    def open(self, out_vars, dates):
+        from supporting_functions.result_store import ResultStore
+        super(ParquetSink, self).open(out_vars, dates)
+        self.store = ResultStore(self.path, **self.store_kwargs)
+
+    def write(self, start, y):
+        self.store.write(y, self.site, self.scenario, realisations=np.arange(start, start + len(y)),
+                         out_vars=self.out_vars, dates=self.dates)
+
+
+class MemmapSink(ResultSink):
+    def __init__(self, path, nruns, dtype=np.float64):
+        """
+        write the output into a (nruns, ndays, n_vars) .npy file (np.lib.format.open_memmap), which can be read with
+        np.load(path, mmap_mode='r')
+        :param path: path of the .npy file
+        :param nruns: total number of runs
+        :param dtype: dtype of the file
+        """
+        self.path = path
+        self.nruns = nruns
+        self.dtype = dtype
+        self.array = None
+
+    def open(self, out_vars, dates):
+        super(MemmapSink, self).open(out_vars, dates)
+        self.array = np.lib.format.open_memmap(self.path, mode='w+', dtype=self.dtype,
+                                               shape=(self.nruns, len(self.dates), len(self.out_vars)))
+
+    def write(self, start, y):
+        self.array[start:start + len(y)] = y
+
+    def close(self):
+        self.array.flush()
+
+
+class CsvSink(ResultSink):
+    def __init__(self, outdir, name='run_{:06d}.csv'):
+        """
+        write each run to a csv in the format of the run_basgra_nz output (index: date, columns: out_vars)
+        :param outdir: output directory
+        :param name: file name, formatted with the run number
+        """
+        self.outdir = outdir
+        self.name = name
+
+    def open(self, out_vars, dates):
+        super(CsvSink, self).open(out_vars, dates)
+        if not os.path.exists(self.outdir):
+            os.makedirs(self.outdir)
+
+    def write(self, start, y):
+        for i, run in enumerate(y):
+            data = pd.DataFrame(run, index=self.dates, columns=self.out_vars)
+            data.index.name = 'date'
+            data.to_csv(os.path.join(self.outdir, self.name.format(start + i)))
+
+
+class SinkWriter(object):
+    def __init__(self, sinks, maxsize=2):
+        """
+        write results to the (opened) sinks on a background thread
+        :param sinks: list of sinks
+        :param maxsize: maximum number of chunks waiting to be written, put blocks while the queue is full
+        """
+        self.sinks = sinks
+        self._queue = queue.Queue(maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue  # keep draining so that put never blocks forever
+            try:
+                for sink in self.sinks:
+                    sink.write(*item)
+            except BaseException as e:
+                self._error = e
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError('writing to a sink failed') from self._error
+
+    def put(self, start, y):
+        """
+        queue the output of runs start to start + len(y) for writing, blocks while the queue is full
+        """
+        self._check()
+        self._queue.put((start, y))
+
+    def close(self):
+        """
+        wait for the queued results to be written
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self._check()
+
+
+def run_to_sinks(sinks, params, matrix_weather, days_harvest, doy_irr, out_vars=None, queue_size=2, **kwargs):
+    """
+    run an ensemble and stream the output to sinks as each chunk of runs finishes, the output of all of the runs is
+    never held in memory at once
+    :param sinks: a sink or a list of sinks
+    :param params: see basgra_python.run_basgra_multisite
+    :param matrix_weather: see basgra_python.run_basgra_multisite
+    :param days_harvest: see basgra_python.run_basgra_multisite
+    :param doy_irr: see basgra_python.run_basgra_multisite
+    :param out_vars: None (all of out_cols) or a list of the output variables to pass to the sinks
+    :param queue_size: maximum number of chunks waiting to be written
+    :param kwargs: passed to basgra_python.iter_basgra_multisite (e.g. site_params, chunk_size, nprocesses,
+                   supply_pet)
+    :return: the list of sinks
+    """
+    if not isinstance(sinks, (list, tuple)):
+        sinks = [sinks]  # a single sink, which need not be a ResultSink
+    if out_vars is None:
+        out_vars = list(out_cols)
+    weather = np.asarray(matrix_weather)
+    first = weather if weather.ndim == 2 else weather[0]
+    dates = pd.to_datetime(['{}-{:03d}'.format(int(e), int(f)) for e, f in first[:, :2]], format='%Y-%j')
+
+    for sink in sinks:
+        sink.open(out_vars, dates)
+    writer = SinkWriter(sinks, queue_size)
+    try:
+        for start, y in iter_basgra_multisite(params, matrix_weather, days_harvest, doy_irr, out_vars=out_vars,
+                                              **kwargs):
+            writer.put(start, y)
+    finally:
+        try:
+            writer.close()  # raises any error from writing to the sinks
+        finally:
+            for sink in sinks:
+                sink.close()
+    return sinks
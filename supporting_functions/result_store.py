@@ -0,0 +1,238 @@
+"""
+a compressed, columnar store for ensemble results, partitioned by site and scenario with one row per
+(realisation, day).  Each variable is stored as its own column (parquet) or dataset (hdf5) so reading one
+variable for all of the realisations only reads that variable.  Variables are down-cast to float32 unless set
+otherwise.  The metadata (metadata.json) records the output variables, dtypes, dates, parameters and hashes of the
+inputs of each partition.
+
+the parquet backend requires pyarrow and the hdf5 backend requires h5py, neither are requirements of basgra_nz_py.
+
+ Created: 19/10/2026
+ """
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from input_output_keys import out_cols
+
+
+class ResultStore(object):
+    metadata_name = 'metadata.json'
+    hdf_name = 'results.h5'
+    realisations_per_chunk = 64  # realisations per parquet row group / hdf5 chunk
+
+    def __init__(self, path, backend='parquet', default_dtype='float32', dtypes=None, compression=None):
+        """
+        open (or create) a result store
+        :param path: directory of the store
+        :param backend: 'parquet' or 'hdf5', an existing store keeps its backend
+        :param default_dtype: the dtype to store variables as
+        :param dtypes: None or dictionary of {variable: dtype} to override default_dtype (e.g. {'Time': 'float64'})
+        :param compression: None (zstd for parquet, gzip for hdf5) or a compression supported by the backend
+        """
+        assert backend in ('parquet', 'hdf5'), 'backend must be "parquet" or "hdf5"'
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        meta_path = os.path.join(path, self.metadata_name)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.metadata = json.load(f)
+        else:
+            self.metadata = {'backend': backend, 'partitions': {}}
+        self.backend = self.metadata['backend']
+        self.default_dtype = np.dtype(default_dtype)
+        self.dtypes = {} if dtypes is None else {k: np.dtype(v) for k, v in dtypes.items()}
+        if compression is None:
+            compression = 'zstd' if self.backend == 'parquet' else 'gzip'
+        self.compression = compression
+
+    def _dtype(self, var):
+        return self.dtypes.get(var, self.default_dtype)
+
+    @staticmethod
+    def _key(site, scenario):
+        site, scenario = str(site), str(scenario)
+        for e in (site, scenario):
+            assert not any(c in e for c in '/\\='), 'site and scenario names cannot contain "/", "\\" or "="'
+        return site, scenario, '{}/{}'.format(site, scenario)
+
+    def sites(self):
+        return sorted({k.split('/')[0] for k in self.metadata['partitions']})
+
+    def scenarios(self, site):
+        return sorted(k.split('/')[1] for k in self.metadata['partitions'] if k.split('/')[0] == str(site))
+
+    def write(self, data, site, scenario, realisations=None, out_vars=None, dates=None, params=None, inputs=None):
+        """
+        add realisations to a partition
+        :param data: the output of run_basgra_nz (one realisation) or a (n_realisations, ndays, nvars) array
+                     (e.g. from run_basgra_multisite)
+        :param site: site name
+        :param scenario: scenario name
+        :param realisations: None (numbered on from the realisations already stored) or the realisation numbers
+        :param out_vars: the variables in the array (default out_cols), ignored for dataframes
+        :param dates: the dates of the days, required for arrays unless 'year' and 'doy' are in out_vars
+        :param params: None or the parameter dictionary, stored in the metadata
+        :param inputs: None or a dictionary of {name: input} (e.g. matrix_weather, days_harvest, doy_irr), the
+                       hash of each input is stored in the metadata
+        :return:
+        """
+        site, scenario, key = self._key(site, scenario)
+        if isinstance(data, pd.DataFrame):
+            out_vars = list(data.columns)
+            dates = pd.DatetimeIndex(data.index)
+            data = data.values[np.newaxis]
+        data = np.asarray(data)
+        assert data.ndim == 3, 'data must be a dataframe or a (n_realisations, ndays, nvars) array'
+        if out_vars is None:
+            out_vars = list(out_cols)
+        out_vars = list(out_vars)
+        assert data.shape[2] == len(out_vars), 'data has {} variables, but {} out_vars'.format(data.shape[2],
+                                                                                             len(out_vars))
+        nreal, ndays = data.shape[:2]
+        if dates is None:
+            assert 'year' in out_vars and 'doy' in out_vars, 'dates must be passed unless year and doy are in data'
+            year, doy = data[0, :, out_vars.index('year')], data[0, :, out_vars.index('doy')]
+            dates = pd.to_datetime(['{}-{:03d}'.format(int(e), int(f)) for e, f in zip(year, doy)], format='%Y-%j')
+        dates = pd.DatetimeIndex(dates)
+        assert len(dates) == ndays, 'dates must have one entry per day'
+
+        part = self.metadata['partitions'].get(key)
+        if part is None:
+            part = {
+                'out_vars': out_vars,
+                'dtypes': {v: self._dtype(v).name for v in out_vars},
+                'start_date': str(dates[0].date()),
+                'ndays': ndays,
+                'realisations': [],
+                'files': 0,
+                'params': None,
+                'input_hashes': {},
+            }
+        else:
+            assert part['out_vars'] == out_vars, 'out_vars must match the variables already stored for {}'.format(key)
+            assert part['ndays'] == ndays and part['start_date'] == str(dates[0].date()), (
+                'dates must match the dates already stored for {}'.format(key))
+
+        if realisations is None:
+            start = max(part['realisations']) + 1 if len(part['realisations']) > 0 else 0
+            realisations = np.arange(start, start + nreal)
+        realisations = np.atleast_1d(realisations).astype(int)
+        assert len(realisations) == nreal, 'realisations must have one entry per realisation'
+        assert not set(realisations) & set(part['realisations']), 'realisations are already stored for {}'.format(key)
+
+        if self.backend == 'parquet':
+            self._write_parquet(data, site, scenario, part, realisations, out_vars, dates)
+        else:
+            self._write_hdf5(data, key, part, realisations, out_vars, dates)
+
+        part['realisations'] = part['realisations'] + realisations.tolist()
+        if params is not None:
+            part['params'] = {k: float(v) for k, v in params.items()}
+        if inputs is not None:
+            part['input_hashes'].update({k: hash_input(v) for k, v in inputs.items()})
+        self.metadata['partitions'][key] = part
+        self._write_metadata()
+
+    def _write_parquet(self, data, site, scenario, part, realisations, out_vars, dates):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        nreal, ndays = data.shape[:2]
+        columns = {
+            'realisation': np.repeat(realisations, ndays).astype(np.int32),
+            'date': np.tile(dates.values, nreal),
+        }
+        for i, v in enumerate(out_vars):
+            columns[v] = data[:, :, i].ravel().astype(part['dtypes'][v])
+        part_dir = os.path.join(self.path, 'site={}'.format(site), 'scenario={}'.format(scenario))
+        if not os.path.exists(part_dir):
+            os.makedirs(part_dir)
+        path = os.path.join(part_dir, 'part-{:06d}.parquet'.format(part['files']))
+        pq.write_table(pa.table(columns), path + '.tmp', compression=self.compression,
+                       row_group_size=ndays * self.realisations_per_chunk)
+        os.replace(path + '.tmp', path)
+        part['files'] += 1
+
+    def _write_hdf5(self, data, key, part, realisations, out_vars, dates):
+        import h5py
+        nreal, ndays = data.shape[:2]
+        with h5py.File(os.path.join(self.path, self.hdf_name), 'a') as f:
+            if key not in f:
+                group = f.create_group(key)
+                group.create_dataset('date', data=dates.values.astype(np.int64))
+                group.create_dataset('realisation', shape=(0,), maxshape=(None,), dtype=np.int64, chunks=(1024,))
+                chunks = (min(self.realisations_per_chunk, 8), min(ndays, 4096))
+                for v in out_vars:
+                    group.create_dataset(v, shape=(0, ndays), maxshape=(None, ndays), dtype=part['dtypes'][v],
+                                         chunks=chunks, compression=self.compression, shuffle=True)
+            group = f[key]
+            n0 = group['realisation'].shape[0]
+            group['realisation'].resize((n0 + nreal,))
+            group['realisation'][n0:] = realisations
+            for i, v in enumerate(out_vars):
+                group[v].resize((n0 + nreal, ndays))
+                group[v][n0:] = data[:, :, i].astype(part['dtypes'][v])
+
+    def read(self, var, site, scenario, realisations=None):
+        """
+        read one variable for the realisations of a partition, only that variable is read from disk
+        :param var: output variable
+        :param site: site name
+        :param scenario: scenario name
+        :param realisations: None (all) or a list of realisation numbers
+        :return: pd.DataFrame index: date, columns: realisation
+        """
+        site, scenario, key = self._key(site, scenario)
+        assert key in self.metadata['partitions'], 'no results for site: {}, scenario: {}'.format(site, scenario)
+        assert var in self.metadata['partitions'][key]['out_vars'], '{} not stored for {}'.format(var, key)
+
+        if self.backend == 'parquet':
+            import pyarrow.parquet as pq
+            part_dir = os.path.join(self.path, 'site={}'.format(site), 'scenario={}'.format(scenario))
+            filters = None if realisations is None else [('realisation', 'in', [int(e) for e in realisations])]
+            table = pq.read_table(part_dir, columns=['realisation', 'date', var], filters=filters)
+            out = table.to_pandas().pivot(index='date', columns='realisation', values=var)
+        else:
+            import h5py
+            with h5py.File(os.path.join(self.path, self.hdf_name), 'r') as f:
+                group = f[key]
+                stored = group['realisation'][:]
+                if realisations is None:
+                    idx = np.arange(len(stored))
+                else:
+                    idx = np.array([np.where(stored == e)[0][0] for e in realisations])
+                    idx.sort()
+                values = group[var][idx] if len(idx) < len(stored) else group[var][:]
+                dates = pd.to_datetime(group['date'][:])
+            out = pd.DataFrame(values.T, index=dates, columns=stored[idx])
+            out = out.sort_index(axis=1)
+        out.index.name = 'date'
+        out.columns.name = 'realisation'
+        return out
+
+    def _write_metadata(self):
+        path = os.path.join(self.path, self.metadata_name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.metadata, f, indent=1)
+        os.replace(path + '.tmp', path)
+
+
+def hash_input(data):
+    """
+    sha1 hash of an input (dataframe, array, list or dictionary) to record which inputs made a set of results
+    :param data: input data
+    :return: hex digest
+    """
+    h = hashlib.sha1()
+    if isinstance(data, pd.DataFrame):
+        h.update(str(list(data.columns)).encode())
+        h.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+    elif isinstance(data, dict):
+        h.update(json.dumps({k: float(v) for k, v in data.items()}, sort_keys=True).encode())
+    else:
+        data = np.ascontiguousarray(data)
+        h.update(str((data.shape, data.dtype.str)).encode())
+        h.update(data.tobytes())
+    return h.hexdigest()
@@ -0,0 +1,237 @@
+"""
+chunked, resumable execution of BASGRA over the cells of a grid.  the masked cells are split into chunks, each chunk
+is run with run_basgra_multisite in a worker process and its output is written atomically to the output directory.
+a manifest records the finished chunks so a job that is killed can be restarted and will only run the missing chunks.
+
+ Created: 19/10/2026
+ """
+import os
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from basgra_python import run_basgra_multisite
+from input_output_keys import out_cols
+from supporting_functions.result_store import hash_input
+
+
+class GridRunManager(object):
+    manifest_name = 'manifest.json'
+    chunk_name = 'chunk_{:06d}.npz'
+
+    def __init__(self, outdir, weather_source, mask, params, days_harvest, doy_irr, site_params=None,
+                 chunk_size=1000, out_vars=None, supply_pet=True, auto_harvest=True, dll_path='default'):
+        """
+        set up (or re-open) a gridded run
+        :param outdir: directory for the chunk outputs and the manifest
+        :param weather_source: the weather of every cell, one of:
+                               * a (ny, nx, ndays, nweather) array, only the chunk's cells are sent to the workers
+                               * the path to a .npy file of a (ny, nx, ndays, nweather) array, which is memory mapped
+                                 by each worker
+                               * a picklable function f(cells) -> (n_cells, ndays, nweather) array, where cells is a
+                                 (n_cells, 2) array of (row, col) indices
+                               weather columns as described in run_basgra_multisite
+        :param mask: (ny, nx) boolean array, True for the cells to run. cells are run in the order of np.argwhere(mask)
+        :param params: dictionary of the parameters shared by all cells, see run_basgra_nz
+        :param days_harvest: see run_basgra_multisite (a per cell array is not supported, use a shared dataframe)
+        :param doy_irr: list of the days of year to irrigate on shared by all cells
+        :param site_params: None or pd.DataFrame with one row per masked cell (in the order of np.argwhere(mask)),
+                            see run_basgra_multisite
+        :param chunk_size: number of cells per chunk
+        :param out_vars: None (all of out_cols) or a list of the output variables to keep
+        :param supply_pet: see run_basgra_nz
+        :param auto_harvest: see run_basgra_nz
+        :param dll_path: see run_basgra_nz
+        """
+        mask = np.asarray(mask, dtype=bool)
+        assert mask.ndim == 2, 'mask must be (ny, nx)'
+        if isinstance(weather_source, np.ndarray):
+            assert weather_source.shape[:2] == mask.shape, 'weather_source and mask must have the same (ny, nx)'
+        elif isinstance(weather_source, str):
+            assert os.path.exists(weather_source), 'weather_source path does not exist: {}'.format(weather_source)
+        else:
+            assert callable(weather_source), 'weather_source must be an array, a .npy path or a function'
+        self.cells = np.argwhere(mask)
+        if site_params is not None:
+            assert len(site_params) == len(self.cells), 'site_params must have one row per masked cell'
+        if out_vars is None:
+            out_vars = list(out_cols)
+        bad_vars = set(out_vars) - set(out_cols)
+        assert len(bad_vars) == 0, 'unexpected out_vars: {}'.format(bad_vars)
+
+        self.outdir = outdir
+        self.weather_source = weather_source
+        self.mask = mask
+        self.chunk_size = int(chunk_size)
+        self.out_vars = list(out_vars)
+        self.run_kwargs = dict(params=params, days_harvest=days_harvest, doy_irr=doy_irr, supply_pet=supply_pet,
+                               auto_harvest=auto_harvest, dll_path=dll_path)
+        self.site_params = site_params
+        self.nchunks = int(np.ceil(len(self.cells) / self.chunk_size))
+
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+        self.manifest = self._read_manifest()
+
+    def _config(self):
+        config = {
+            'n_cells': int(len(self.cells)),
+            'mask_shape': list(self.mask.shape),
+            'chunk_size': self.chunk_size,
+            'n_chunks': self.nchunks,
+            'out_vars': self.out_vars,
+            'supply_pet': bool(self.run_kwargs['supply_pet']),
+            'auto_harvest': bool(self.run_kwargs['auto_harvest']),
+        }
+        config.update(self._input_hashes())
+        return config
+
+    def _input_hashes(self):
+        """
+        hashes of the mask and the run inputs, so that chunks run with other inputs are never reused.  a weather
+        function is identified by its name only, so a changed function needs a new outdir
+        """
+        weather = self.weather_source
+        if isinstance(weather, str):
+            weather = np.load(weather, mmap_mode='r')
+        elif not isinstance(weather, np.ndarray):
+            weather = np.array('{}.{}'.format(getattr(weather, '__module__', ''),
+                                              getattr(weather, '__qualname__', repr(weather))))
+        return {
+            'mask_hash': hash_input(self.mask),
+            'weather_hash': hash_input(weather),
+            'params_hash': hash_input(self.run_kwargs['params']),
+            'days_harvest_hash': hash_input(self.run_kwargs['days_harvest']),
+            'doy_irr_hash': hash_input(np.asarray(self.run_kwargs['doy_irr'])),
+            'site_params_hash': None if self.site_params is None else hash_input(self.site_params),
+        }
+
+    def _read_manifest(self):
+        path = os.path.join(self.outdir, self.manifest_name)
+        config = self._config()
+        if not os.path.exists(path):
+            manifest = dict(config, finished=[])
+            _atomic_write_json(path, manifest)
+            return manifest
+
+        with open(path) as f:
+            manifest = json.load(f)
+        for k, v in config.items():
+            if manifest.get(k) != v:
+                raise ValueError('the run in {} was set up with a different {}: {} != {}, use a new outdir'.format(
+                    self.outdir, k, manifest.get(k), v))
+        # chunks written after the last manifest update (e.g. job killed in between) are also finished
+        finished = set(manifest['finished'])
+        finished.update(i for i in range(self.nchunks)
+                        if os.path.exists(os.path.join(self.outdir, self.chunk_name.format(i))))
+        manifest['finished'] = sorted(finished)
+        return manifest
+
+    @property
+    def remaining_chunks(self):
+        finished = set(self.manifest['finished'])
+        return [i for i in range(self.nchunks) if i not in finished]
+
+    def chunk_cells(self, chunk):
+        return self.cells[chunk * self.chunk_size: (chunk + 1) * self.chunk_size]
+
+    def _job(self, chunk):
+        cells = self.chunk_cells(chunk)
+        weather = self.weather_source
+        if isinstance(weather, np.ndarray):
+            weather = np.ascontiguousarray(weather[cells[:, 0], cells[:, 1]])
+        site_params = None
+        if self.site_params is not None:
+            site_params = self.site_params.iloc[chunk * self.chunk_size: (chunk + 1) * self.chunk_size]
+        path = os.path.join(self.outdir, self.chunk_name.format(chunk))
+        return path, cells, weather, site_params, self.out_vars, self.run_kwargs
+
+    def run(self, nprocesses=1, verbose=True):
+        """
+        run all of the chunks which are not yet finished
+        :param nprocesses: number of worker processes (on windows this must be called from within an
+                           if __name__ == '__main__' block), at most 2 * nprocesses chunks are queued at a time
+        :param verbose: boolean, if True print progress
+        :return:
+        """
+        remaining = self.remaining_chunks
+        if verbose:
+            print('{} of {} chunks to run'.format(len(remaining), self.nchunks))
+        if nprocesses == 1:
+            for chunk in remaining:
+                _run_chunk(self._job(chunk))
+                self._finish(chunk, verbose)
+            return
+
+        # the jobs (and their weather copies) are only built when there is room in the queue
+        jobs = ((chunk, self._job(chunk)) for chunk in remaining)
+        with ProcessPoolExecutor(nprocesses) as pool:
+            futures = {}
+            for chunk, job in jobs:
+                futures[pool.submit(_run_chunk, job)] = chunk
+                if len(futures) >= 2 * nprocesses:
+                    self._finish_done(futures, verbose)
+            while len(futures) > 0:
+                self._finish_done(futures, verbose)
+
+    def _finish_done(self, futures, verbose):
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            future.result()  # raise any errors from the worker
+            self._finish(futures.pop(future), verbose)
+
+    def _finish(self, chunk, verbose):
+        self.manifest['finished'] = sorted(set(self.manifest['finished']) | {chunk})
+        _atomic_write_json(os.path.join(self.outdir, self.manifest_name), self.manifest)
+        if verbose:
+            print('finished chunk {} ({} of {})'.format(chunk, len(self.manifest['finished']), self.nchunks))
+
+    def iter_results(self):
+        """
+        iterate over the finished chunks
+        :return: generator of (cells (n, 2), output (n, ndays, len(out_vars)))
+        """
+        for chunk in self.manifest['finished']:
+            with np.load(os.path.join(self.outdir, self.chunk_name.format(chunk))) as data:
+                yield data['cells'], data['y']
+
+    def to_grid(self, var):
+        """
+        gather one output variable into a (ny, nx, ndays) array, cells which are masked out or not yet run are nan
+        :param var: output variable (in out_vars)
+        :return: np.ndarray
+        """
+        idx = self.out_vars.index(var)
+        out = np.full(self.mask.shape + (self._ndays(),), np.nan)
+        for cells, y in self.iter_results():
+            out[cells[:, 0], cells[:, 1]] = y[:, :, idx]
+        return out
+
+    def _ndays(self):
+        weather = self.weather_source
+        if isinstance(weather, str):
+            return np.load(weather, mmap_mode='r').shape[2]
+        elif isinstance(weather, np.ndarray):
+            return weather.shape[2]
+        return weather(self.cells[:1]).shape[1]
+
+
+def _run_chunk(job):
+    """
+    run one chunk and write it atomically (to a temporary file which is then renamed)
+    """
+    path, cells, weather, site_params, out_vars, run_kwargs = job
+    if isinstance(weather, str):
+        weather = np.load(weather, mmap_mode='r')[cells[:, 0], cells[:, 1]]
+    elif not isinstance(weather, np.ndarray):
+        weather = weather(cells)
+    y = run_basgra_multisite(matrix_weather=weather, site_params=site_params, out_vars=out_vars, **run_kwargs)
+    tmp_path = path.replace('.npz', '.tmp.npz')
+    np.savez(tmp_path, cells=cells, y=y)
+    os.replace(tmp_path, path)
+
+
+def _atomic_write_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp_path, path)
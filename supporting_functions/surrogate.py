@@ -0,0 +1,293 @@
+"""
+fast surrogate (emulator) models of summaries of BASGRA runs, e.g. for interactive tools where a kernel call per
+query is too slow.  the input space (ranges of management parameters and/or constant weather columns such as max_irr
+and irr_trig) is sampled with a latin hypercube, the samples are run with basgra_python.run_basgra_multisite and a
+polynomial chaos expansion (legendre polynomials of the inputs scaled to -1 to 1, fitted by least squares) is fitted
+to each summary.  the degree of each summary is chosen by its leave one out error on the training runs and the
+error is then reported on separate validation runs.  a query is a few small numpy operations (micro seconds), and
+queries outside of the training ranges are run with the kernel instead.
+
+ Created: 19/10/2026
+ """
+import json
+import itertools
+import numpy as np
+import pandas as pd
+from basgra_python import run_basgra_multisite
+from input_output_keys import param_keys, matrix_weather_keys_pet, matrix_weather_keys_penman
+from supporting_functions.irrigation_optimiser import total_yield
+
+
+def _annual_yield(values, doy):
+    return total_yield(values, doy) / (values.shape[1] / 365.25)
+
+
+# summaries of a run: {name: (output variable, function(values (n_runs, ndays), doy (ndays,)) -> (n_runs,))}
+default_summaries = {
+    'YIELD': ('YIELD', _annual_yield),  # mean annual yield (tDM/ha/year)
+    'IRRIG': ('IRRIG', lambda values, doy: values.sum(axis=1)),  # total irrigation (mm)
+    'PAW': ('PAW', lambda values, doy: values.mean(axis=1)),  # mean profile available water (mm)
+}
+
+
+def latin_hypercube(bounds, n, seed=None):
+    """
+    a latin hypercube sample, one sample in each of n equal strata of each range
+    :param bounds: (ndim, 2) array of the (low, high) of each input
+    :param n: number of samples
+    :param seed: seed of the random sampling
+    :return: (n, ndim) array
+    """
+    bounds = np.asarray(bounds, dtype=float)
+    rng = np.random.default_rng(seed)
+    u = (np.argsort(rng.random((len(bounds), n)), axis=1).T + rng.random((n, len(bounds)))) / n
+    return bounds[:, 0] + u * (bounds[:, 1] - bounds[:, 0])
+
+
+def _legendre(z, degree):
+    """
+    legendre polynomials 0 to degree of z (-1 to 1), (..., degree + 1) array
+    """
+    out = np.empty(np.shape(z) + (degree + 1,))
+    out[..., 0] = 1
+    if degree > 0:
+        out[..., 1] = z
+    for d in range(2, degree + 1):
+        out[..., d] = ((2 * d - 1) * z * out[..., d - 1] - (d - 1) * out[..., d - 2]) / d
+    return out
+
+
+def _total_degree_terms(ndim, degree):
+    """
+    the multi indices (nterms, ndim) of the polynomials of at most degree in total, ordered by total degree
+    """
+    terms = [e for e in itertools.product(range(degree + 1), repeat=ndim) if sum(e) <= degree]
+    return np.array(sorted(terms, key=sum), int).reshape(-1, ndim)
+
+
+class Surrogate(object):
+    def __init__(self, space, summaries=None, max_degree=3):
+        """
+        :param space: dictionary of {key: (low, high)} of the inputs, keys are param_keys and/or weather keys (a
+                      weather column is set to one value for the whole run, e.g. max_irr, irr_trig, irr_targ)
+        :param summaries: None (default_summaries) or a list of the names in default_summaries or a dictionary as
+                          per default_summaries
+        :param max_degree: the largest total degree of the polynomials
+        """
+        self.keys = list(space.keys())
+        self.bounds = np.array([space[k] for k in self.keys], dtype=float).reshape(len(self.keys), 2)
+        assert (self.bounds[:, 1] > self.bounds[:, 0]).all(), 'the high of each range must be above the low'
+        if summaries is None:
+            summaries = default_summaries
+        elif not isinstance(summaries, dict):
+            summaries = {k: default_summaries[k] for k in summaries}
+        self.summaries = dict(summaries)
+        self.max_degree = int(max_degree)
+        self._terms = _total_degree_terms(len(self.keys), self.max_degree)
+        self._dim_idx = np.arange(len(self.keys))
+        self._low, self._high = self.bounds[:, 0].copy(), self.bounds[:, 1].copy()
+        self._scale = 2 / (self._high - self._low)
+        self._offset = self._low * self._scale + 1  # z = x * scale - offset is -1 to 1 over the range
+        # for single queries: the legendre polynomials as polynomials of z and the flat index of each term in the
+        # (ndim, degree + 1) array of the polynomials of each input
+        self._powers = np.arange(self.max_degree + 1)
+        self._leg_poly = np.zeros((self.max_degree + 1, self.max_degree + 1))
+        for d in range(self.max_degree + 1):
+            self._leg_poly[:d + 1, d] = np.polynomial.legendre.leg2poly(np.eye(d + 1)[d])
+        self._flat_terms = self._terms + self._dim_idx * (self.max_degree + 1)
+        self.coef = None  # (nterms, nsummaries), the terms above the degree of a summary are zero
+        self.degree = None
+        self.validation = None
+        self._inputs = None
+        self.n_kernel_queries = 0
+
+    @property
+    def names(self):
+        return list(self.summaries.keys())
+
+    def set_inputs(self, params, matrix_weather, days_harvest, doy_irr, supply_pet=True, auto_harvest=True,
+                   dll_path='default', nprocesses=1, batch_size=256, verbose=False):
+        """
+        set the kernel inputs that the sampled inputs are applied to, these are needed to fit the surrogate and for
+        queries outside of the training ranges (e.g. after load)
+        :param params: dictionary of the parameters, see run_basgra_nz
+        :param matrix_weather: weather dataframe, see run_basgra_nz
+        :param days_harvest: see run_basgra_nz
+        :param doy_irr: see run_basgra_nz
+        :param supply_pet: see run_basgra_nz
+        :param auto_harvest: see run_basgra_nz
+        :param dll_path: see run_basgra_nz
+        :param nprocesses: number of processes to run the batches in, see run_basgra_multisite
+        :param batch_size: number of runs per call of run_basgra_multisite (limits the memory used)
+        :param verbose: see run_basgra_nz
+        """
+        weather_keys = matrix_weather_keys_pet if supply_pet else matrix_weather_keys_penman
+        bad_keys = set(self.keys) - set(param_keys) - (set(weather_keys) - {'year', 'doy'})
+        assert len(bad_keys) == 0, 'unexpected keys in the space: {}'.format(bad_keys)
+        weather = np.ascontiguousarray(matrix_weather.loc[:, weather_keys].values, dtype=float)
+        self._inputs = dict(params=params, weather=weather, days_harvest=days_harvest, doy_irr=doy_irr,
+                            supply_pet=supply_pet, auto_harvest=auto_harvest, dll_path=dll_path,
+                            nprocesses=nprocesses, batch_size=batch_size, verbose=verbose,
+                            weather_idx={k: weather_keys.index(k) for k in self.keys if k in weather_keys})
+
+    def run_kernel(self, x):
+        """
+        run BASGRA for inputs and calculate the summaries
+        :param x: (n, len(self.keys)) array of the inputs
+        :return: (n, len(self.names)) array
+        """
+        assert self._inputs is not None, 'the kernel inputs have not been set, see set_inputs'
+        inp = self._inputs
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        out_vars = list(dict.fromkeys(v for v, f in self.summaries.values()))
+        site_keys = [k for k in self.keys if k not in inp['weather_idx']]
+        out = np.empty((len(x), len(self.names)))
+        for start in range(0, len(x), inp['batch_size']):
+            batch = x[start:start + inp['batch_size']]
+            if len(inp['weather_idx']) > 0:
+                weather = np.repeat(inp['weather'][np.newaxis], len(batch), axis=0)
+                for k, i in inp['weather_idx'].items():
+                    weather[:, :, i] = batch[:, self.keys.index(k), np.newaxis]
+            else:
+                weather = inp['weather']
+            site_params = None
+            if len(site_keys) > 0:
+                site_params = pd.DataFrame(batch[:, [self.keys.index(k) for k in site_keys]], columns=site_keys)
+            y = run_basgra_multisite(inp['params'], weather, inp['days_harvest'], inp['doy_irr'],
+                                     site_params=site_params,
+                                     verbose=inp['verbose'], dll_path=inp['dll_path'], supply_pet=inp['supply_pet'],
+                                     auto_harvest=inp['auto_harvest'], out_vars=out_vars,
+                                     nprocesses=inp['nprocesses'])
+            for j, (var, func) in enumerate(self.summaries.values()):
+                out[start:start + len(batch), j] = func(y[:, :, out_vars.index(var)], inp['weather'][:, 1])
+        return out
+
+    def _basis(self, x):
+        z = x * self._scale - self._offset
+        phi = _legendre(z, self.max_degree)  # (n, ndim, degree + 1)
+        return phi[:, self._dim_idx, self._terms].prod(axis=-1)  # (n, nterms)
+
+    def fit(self, n_train=500, n_validate=100, seed=None):
+        """
+        run the training and validation samples and fit the surrogate, set_inputs must be called first
+        :param n_train: number of training runs, the number of terms of a degree must be less than this for the
+                        degree to be used
+        :param n_validate: number of validation runs (a separate latin hypercube)
+        :param seed: seed of the sampling
+        :return: self.validation, pd.DataFrame (index: summaries) of the degree, the leave one out rmse of the
+                 training runs and the rmse, max absolute error and r2 of the validation runs
+        """
+        rng = np.random.default_rng(seed)
+        x_train = latin_hypercube(self.bounds, n_train, rng)
+        x_val = latin_hypercube(self.bounds, n_validate, rng)
+        y = self.run_kernel(np.concatenate((x_train, x_val)))
+        y_train, y_val = y[:n_train], y[n_train:]
+        assert np.isfinite(y).all(), 'some runs have non finite summaries'
+
+        basis = self._basis(x_train)
+        term_degree = self._terms.sum(axis=1)
+        self.coef = np.zeros((len(self._terms), len(self.names)))
+        self.degree = np.zeros(len(self.names), int)
+        loo = np.full(len(self.names), np.inf)
+        for degree in range(self.max_degree + 1):
+            nterms = (term_degree <= degree).sum()
+            if nterms >= n_train:
+                break
+            q, r = np.linalg.qr(basis[:, :nterms])
+            coef = np.linalg.solve(r, q.T @ y_train)
+            leverage = np.minimum((q ** 2).sum(axis=1), 1 - 1e-12)
+            residual = (y_train - basis[:, :nterms] @ coef) / (1 - leverage)[:, np.newaxis]
+            rmse = np.sqrt((residual ** 2).mean(axis=0))
+            better = rmse < loo
+            loo[better] = rmse[better]
+            self.degree[better] = degree
+            self.coef[:, better] = 0
+            self.coef[:nterms, better] = coef[:, better]
+
+        error = self.predict(x_val) - y_val
+        variance = ((y_val - y_val.mean(axis=0)) ** 2).sum(axis=0)
+        self.validation = pd.DataFrame({
+            'degree': self.degree,
+            'loo_rmse': loo,
+            'rmse': np.sqrt((error ** 2).mean(axis=0)),
+            'max_abs_error': np.abs(error).max(axis=0),
+            'r2': 1 - (error ** 2).sum(axis=0) / np.where(variance > 0, variance, np.nan),
+        }, index=pd.Index(self.names, name='summary'))
+        return self.validation
+
+    def in_domain(self, x):
+        """
+        :param x: (n, len(self.keys)) array of the inputs
+        :return: (n,) boolean, True where all of the inputs are within the training ranges
+        """
+        x = np.atleast_2d(x)
+        return ((x >= self.bounds[:, 0]) & (x <= self.bounds[:, 1])).all(axis=1)
+
+    def predict(self, x):
+        """
+        the surrogate prediction (no domain check)
+        :param x: (n, len(self.keys)) array of the inputs
+        :return: (n, len(self.names)) array
+        """
+        assert self.coef is not None, 'the surrogate has not been fitted'
+        return self._basis(np.atleast_2d(np.asarray(x, dtype=float))) @ self.coef
+
+    def _predict_one(self, x):
+        # the prediction of one point with as few numpy calls as possible, for interactive queries
+        z = x * self._scale - self._offset
+        phi = np.power(z[:, np.newaxis], self._powers) @ self._leg_poly
+        return np.prod(np.take(phi, self._flat_terms), axis=1) @ self.coef
+
+    def query(self, x):
+        """
+        the summaries of inputs, from the surrogate within the training ranges and from the kernel outside them
+        :param x: dictionary of {key: value} (all keys) or (n, len(self.keys)) array of the inputs
+        :return: dictionary of {summary: value} if x is a dictionary, otherwise (n, len(self.names)) array
+        """
+        if isinstance(x, dict):
+            x = np.array([x[k] for k in self.keys], dtype=float)
+            if (x >= self._low).all() and (x <= self._high).all():
+                out = self._predict_one(x)
+            else:
+                out = self.run_kernel(x[np.newaxis])[0]
+                self.n_kernel_queries += 1
+            return dict(zip(self.names, out))
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        out = self.predict(x)
+        outside = ~self.in_domain(x)
+        if outside.any():
+            out[outside] = self.run_kernel(x[outside])
+            self.n_kernel_queries += outside.sum()
+        return out
+
+    def save(self, path):
+        """
+        save the fitted surrogate to a .npz file, the summary functions and kernel inputs are not saved
+        :param path: path to the .npz file
+        """
+        assert self.coef is not None, 'the surrogate has not been fitted'
+        meta = {'keys': self.keys, 'names': self.names, 'max_degree': self.max_degree,
+                'summary_vars': [v for v, f in self.summaries.values()]}
+        np.savez(path, meta=json.dumps(meta), bounds=self.bounds, coef=self.coef, degree=self.degree,
+                 validation=self.validation.values, validation_columns=list(self.validation.columns))
+
+    @classmethod
+    def load(cls, path, summaries=None):
+        """
+        load a surrogate saved with save, call set_inputs for queries outside of the training ranges
+        :param path: path to the .npz file
+        :param summaries: None (default_summaries of the saved names) or the dictionary of summaries used to fit it
+        :return: Surrogate
+        """
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            if summaries is None:
+                summaries = meta['names']
+            out = cls(dict(zip(meta['keys'], data['bounds'])), summaries, meta['max_degree'])
+            assert out.names == meta['names'], 'summaries do not match the saved surrogate'
+            out.coef = data['coef']
+            out.degree = data['degree']
+            out.validation = pd.DataFrame(data['validation'], columns=list(data['validation_columns']),
+                                          index=pd.Index(out.names, name='summary'))
+            out.validation['degree'] = out.validation['degree'].astype(int)
+        return out
@@ -0,0 +1,223 @@
+"""
+a Richardson (WGEN) type stochastic weather generator fitted to a site's matrix_weather.  rain occurrence is a first
+order two state markov chain, wet day rain amounts follow a gamma distribution and the remaining variables
+(tmin, tmax, radn and pet or vpa/wind) are standardised (by month and wet/dry state) and generated with a
+multivariate lag-1 autoregressive model, which preserves the persistence and the cross correlation of the
+original series.
+
+realisations are written in chunks straight into packed (realisation, day, n_weather) float arrays, the same layout
+as supporting_functions.weather_preprocessing.prepare_weather.  each realisation draws from its own random stream
+(spawned from a single numpy SeedSequence), so realisation i is identical regardless of the chunk size or of which
+process generates it.
+
+ Created: 19/10/2026
+ """
+import numpy as np
+import pandas as pd
+from input_output_keys import matrix_weather_keys_pet, matrix_weather_keys_penman
+
+
+class WeatherGenerator(object):
+    rain_key = 'rain'
+    irr_keys = ('max_irr', 'irr_trig', 'irr_targ')
+    min_samples = 10  # minimum number of days in a month/state to use state specific statistics
+
+    def __init__(self, matrix_weather, wet_threshold=0.1, seed=None):
+        """
+        fit the generator to a site's weather
+        :param matrix_weather: pandas dataframe of weather data (keys matrix_weather_keys_pet or
+                               matrix_weather_keys_penman), must be a continuous daily series
+        :param wet_threshold: rain (mm) above which a day is considered wet
+        :param seed: None, int or np.random.SeedSequence, the base of all realisation streams
+        """
+        if set(matrix_weather.keys()) == set(matrix_weather_keys_pet):
+            self.supply_pet = True
+            self.keys = matrix_weather_keys_pet
+        elif set(matrix_weather.keys()) == set(matrix_weather_keys_penman):
+            self.supply_pet = False
+            self.keys = matrix_weather_keys_penman
+        else:
+            raise ValueError('matrix_weather must have the keys of matrix_weather_keys_pet or '
+                             'matrix_weather_keys_penman')
+        if matrix_weather.isna().any().any():
+            raise ValueError('matrix_weather cannot have na values')
+
+        self.wet_threshold = wet_threshold
+        self.seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.variables = tuple(k for k in self.keys if k not in ('year', 'doy', self.rain_key) + self.irr_keys)
+
+        month = _get_month(matrix_weather['year'].values, matrix_weather['doy'].values)
+        rain = matrix_weather[self.rain_key].values.astype(float)
+        data = matrix_weather.loc[:, self.variables].values.astype(float)
+        self._fit_rain(rain, month)
+        self._fit_variables(data, rain > self.wet_threshold, month)
+
+    def _fit_rain(self, rain, month):
+        wet = rain > self.wet_threshold
+        self.p_wet_dry = np.zeros(12)  # p(wet | previous day dry)
+        self.p_wet_wet = np.zeros(12)  # p(wet | previous day wet)
+        self.gamma_shape = np.ones(12)
+        self.gamma_scale = np.zeros(12)
+        prev, cur, m = wet[:-1], wet[1:], month[1:]
+        for i in range(12):
+            idx = m == i
+            n_dry, n_wet = (~prev[idx]).sum(), prev[idx].sum()
+            self.p_wet_dry[i] = (cur[idx] & ~prev[idx]).sum() / n_dry if n_dry > 0 else 0
+            self.p_wet_wet[i] = (cur[idx] & prev[idx]).sum() / n_wet if n_wet > 0 else 0
+
+            # method of moments gamma fit to the wet day amounts above the threshold
+            amounts = rain[(month == i) & wet] - self.wet_threshold
+            if len(amounts) > 1 and amounts.var() > 0:
+                self.gamma_shape[i] = amounts.mean() ** 2 / amounts.var()
+                self.gamma_scale[i] = amounts.var() / amounts.mean()
+            elif len(amounts) > 0:
+                self.gamma_scale[i] = amounts.mean()  # exponential distribution
+
+    def _fit_variables(self, data, wet, month):
+        nvar = len(self.variables)
+        self.mean = np.zeros((12, 2, nvar))  # month, dry/wet, variable
+        self.std = np.ones((12, 2, nvar))
+        for i in range(12):
+            idx_month = month == i
+            for state in (0, 1):
+                idx = idx_month & (wet == state)
+                if idx.sum() < self.min_samples:
+                    idx = idx_month
+                self.mean[i, state] = data[idx].mean(axis=0)
+                std = data[idx].std(axis=0)
+                self.std[i, state] = np.where(std > 0, std, 1)
+
+        # lag 0 and lag 1 correlation of the standardised residuals
+        state = wet.astype(int)
+        z = (data - self.mean[month, state]) / self.std[month, state]
+        m0 = np.corrcoef(z, rowvar=False).reshape(nvar, nvar)
+        m1 = np.array([[np.corrcoef(z[1:, i], z[:-1, j])[0, 1] for j in range(nvar)] for i in range(nvar)])
+        self.ar_a = m1.dot(np.linalg.pinv(m0))
+        bbt = m0 - self.ar_a.dot(m1.T)
+        # symmetric positive semi-definite square root, robust where bbt is not quite positive definite
+        w, v = np.linalg.eigh((bbt + bbt.T) / 2)
+        self.ar_b = v.dot(np.diag(np.sqrt(np.clip(w, 0, None)))).dot(v.T)
+
+    def realisation_streams(self, start, stop):
+        """
+        the random generators for realisations start to stop-1, independent of how the realisations are chunked
+        """
+        # equivalent to self.seed_sequence.spawn(stop)[start:] without advancing the sequence's spawn counter
+        return [np.random.default_rng(np.random.SeedSequence(self.seed_sequence.entropy,
+                                                             spawn_key=self.seed_sequence.spawn_key + (i,)))
+                for i in range(start, stop)]
+
+    def generate(self, start_date, ndays, realisations, max_irr=10., irr_trig=0., irr_targ=1., out=None):
+        """
+        generate a set of realisations into a packed array
+        :param start_date: first day of the series (anything pd.to_datetime understands)
+        :param ndays: number of days in each realisation
+        :param realisations: int (number of realisations, numbered from 0) or (start, stop) realisation numbers
+        :param max_irr: maximum irrigation (mm/d), scalar or (day,)
+        :param irr_trig: irrigation trigger (fraction), scalar or (day,)
+        :param irr_targ: irrigation target (fraction), scalar or (day,)
+        :param out: None or a float array (n, ndays, n_weather) to write into
+        :return: packed float array (realisation, day, n_weather) in the order of self.keys
+        """
+        if np.isscalar(realisations):
+            start, stop = 0, int(realisations)
+        else:
+            start, stop = realisations
+        nreal = stop - start
+        dates = pd.date_range(pd.to_datetime(start_date), periods=ndays)
+        month = dates.month.values - 1
+        if out is None:
+            out = np.empty((nreal, ndays, len(self.keys)), dtype=float)
+        elif out.shape != (nreal, ndays, len(self.keys)):
+            raise ValueError('out must have shape {}'.format((nreal, ndays, len(self.keys))))
+        col = {k: out[:, :, i] for i, k in enumerate(self.keys)}
+        col['year'][:] = dates.year.values
+        col['doy'][:] = dates.dayofyear.values
+        col['max_irr'][:] = max_irr
+        col['irr_trig'][:] = irr_trig
+        col['irr_targ'][:] = irr_targ
+
+        # draw all random numbers per realisation so the streams do not depend on the chunking
+        nvar = len(self.variables)
+        u_occ = np.empty((nreal, ndays))
+        amount = np.empty((nreal, ndays))
+        eps = np.empty((nreal, ndays, nvar))
+        for i, rng in enumerate(self.realisation_streams(start, stop)):
+            u_occ[i] = rng.random(ndays)
+            amount[i] = rng.gamma(self.gamma_shape[month], 1., ndays) * self.gamma_scale[month]
+            eps[i] = rng.standard_normal((ndays, nvar))
+
+        # rain occurrence markov chain (vectorised across realisations)
+        wet = np.empty((nreal, ndays), dtype=bool)
+        pwd, pww = self.p_wet_dry[month[0]], self.p_wet_wet[month[0]]
+        wet[:, 0] = u_occ[:, 0] < (pwd / (1 - pww + pwd) if pwd > 0 else 0.)  # stationary wet probability
+        for d in range(1, ndays):
+            m = month[d]
+            wet[:, d] = u_occ[:, d] < np.where(wet[:, d - 1], self.p_wet_wet[m], self.p_wet_dry[m])
+        col[self.rain_key][:] = np.where(wet, amount + self.wet_threshold, 0.)
+
+        # standardised residuals, multivariate ar(1)
+        z = _matvec(self.ar_b, eps)  # z[:, d] = A z[:, d-1] + B eps[:, d]
+        for d in range(1, ndays):
+            z[:, d] += _matvec(self.ar_a, z[:, d - 1])
+
+        state = wet.astype(int)
+        values = self.mean[month, state] + self.std[month, state] * z
+        for i, k in enumerate(self.variables):
+            col[k][:] = values[:, :, i]
+
+        # physical limits
+        np.maximum(col['tmax'], col['tmin'] + 0.1, out=col['tmax'])
+        for k in set(self.variables) - {'tmin', 'tmax'}:
+            np.maximum(col[k], 0, out=col[k])
+        return out
+
+    def iter_chunks(self, start_date, ndays, nrealisations, chunk_size=100, reuse_buffer=True, **kwargs):
+        """
+        lazily generate nrealisations in chunks
+        :param start_date: see generate
+        :param ndays: see generate
+        :param nrealisations: total number of realisations
+        :param chunk_size: number of realisations per chunk
+        :param reuse_buffer: if True a single buffer is reused for every full chunk, so the yielded array is
+                             overwritten by the next chunk (copy it if it needs to be kept)
+        :param kwargs: passed to generate (max_irr, irr_trig, irr_targ)
+        :return: generator of (start, stop, packed array (stop-start, ndays, n_weather))
+        """
+        buffer = None
+        for start in range(0, nrealisations, chunk_size):
+            stop = min(start + chunk_size, nrealisations)
+            out = None
+            if reuse_buffer:
+                if buffer is None:
+                    buffer = np.empty((stop - start, ndays, len(self.keys)), dtype=float)
+                out = buffer[:stop - start]
+            yield start, stop, self.generate(start_date, ndays, (start, stop), out=out, **kwargs)
+
+    def to_matrix_weather(self, packed):
+        """
+        convert one realisation (day, n_weather) of a packed array to a matrix_weather dataframe for run_basgra_nz
+        """
+        out = pd.DataFrame(packed, columns=self.keys)
+        out.loc[:, 'year'] = out.loc[:, 'year'].astype(int)
+        out.loc[:, 'doy'] = out.loc[:, 'doy'].astype(int)
+        return out
+
+
+def _matvec(matrix, x):
+    """
+    matrix.dot(v) for every vector v along the last axis of x.  the products are summed element wise (rather than
+    with np.dot) so that the result for one realisation does not depend on how many realisations are in the array
+    """
+    out = x[..., 0:1] * matrix[:, 0]
+    for j in range(1, matrix.shape[1]):
+        out += x[..., j:j + 1] * matrix[:, j]
+    return out
+
+
+def _get_month(year, doy):
+    """
+    zero based month of each year/doy
+    """
+    strs = ['{}-{:03d}'.format(int(e), int(f)) for e, f in zip(year, doy)]
+    return pd.to_datetime(strs, format='%Y-%j').month.values - 1
@@ -0,0 +1,177 @@
+"""
+vectorised preparation of raw station weather for many sites at once.  raw data are (site, day) arrays and the
+output is a single packed float array of shape (n_site, n_day, n_weather) with the columns in the order of
+matrix_weather_keys_penman (or matrix_weather_keys_pet), which is the layout the batch kernel expects.
+
+ Created: 19/10/2026
+ """
+import numpy as np
+from input_output_keys import matrix_weather_keys_pet, matrix_weather_keys_penman
+
+
+def ffill_days(data):
+    """
+    forward fill missing (nan) values along the last (day) axis, equivalent to pd.DataFrame.fillna(method='ffill')
+    for each site.  leading nan values (before the first valid value) are left as nan.
+    :param data: array of (site, day) or (day,) data
+    :return: filled copy of data (float)
+    """
+    data = np.asarray(data, dtype=float)
+    idx = np.where(np.isnan(data), 0, np.arange(data.shape[-1]))
+    np.maximum.accumulate(idx, axis=-1, out=idx)
+    return np.take_along_axis(data, idx, axis=-1)
+
+
+def calc_vpa(rh, tmin, tmax, out=None):
+    """
+    vectorised version of supporting_functions.conversions.convert_RH_vpa
+    :param rh: relative humidity (%, 0-100)
+    :param tmin: min temperature (degrees c)
+    :param tmax: max temperature (degrees c)
+    :param out: None or array to write the vapour pressure into (e.g. a column of the packed weather)
+    :return: vapour pressure (kpa)
+    """
+    out = np.add(tmin, tmax, out=out)
+    out *= 0.5  # mean temperature
+    np.divide(7.5 * out, 237.3 + out, out=out)
+    np.power(10., out, out=out)
+    out *= 6.11 / 10 / 100  # saturated vapour pressure hPa -> kpa, rh % -> fraction
+    out *= rh
+    return out
+
+
+def calc_wind_2m(wind, z, out=None):
+    """
+    vectorised version of supporting_functions.conversions.convert_wind_to_2m (FAO equation 47 in Allen et al (1998))
+    :param wind: measured wind speed [m s-1]
+    :param z: height of wind measurement above ground surface [m], scalar or one value per site
+    :param out: None or array to write the wind speed into (e.g. a column of the packed weather)
+    :return: wind speed at 2 m above the surface [m s-1]
+    """
+    z = np.asarray(z, dtype=float)
+    if z.ndim == 1:
+        z = z[:, np.newaxis]  # one height per site
+    return np.multiply(wind, 4.87 / np.log(67.8 * z - 5.42), out=out)
+
+
+def calc_reference_pet(tmin, tmax, radn, vpa, wind_2m, doy, lat, elevation=0., out=None):
+    """
+    FAO-56 Penman-Monteith daily grass reference evapotranspiration (Allen et al 1998, equation 6), soil heat flux
+    is assumed to be zero.
+    :param tmin: min temperature (degrees c) (site, day)
+    :param tmax: max temperature (degrees c) (site, day)
+    :param radn: daily solar radiation (MJ/m2) (site, day)
+    :param vpa: vapour pressure (kpa) (site, day)
+    :param wind_2m: wind speed at 2m (m s-1) (site, day)
+    :param doy: day of year (day,) or (site, day)
+    :param lat: latitude (degrees north), scalar or one value per site
+    :param elevation: site elevation (m), scalar or one value per site
+    :param out: None or array to write the pet into (e.g. a column of the packed weather)
+    :return: reference evapotranspiration (mm d-1)
+    """
+    lat = np.atleast_1d(np.asarray(lat, dtype=float))[:, np.newaxis]
+    elevation = np.atleast_1d(np.asarray(elevation, dtype=float))[:, np.newaxis]
+    doy = np.asarray(doy, dtype=float)
+
+    tmean = (tmin + tmax) / 2
+    gamma = 0.000665 * 101.3 * ((293. - 0.0065 * elevation) / 293.) ** 5.26  # psychrometric constant (kpa C-1)
+    es = (0.6108 * np.exp(17.27 * tmax / (tmax + 237.3)) + 0.6108 * np.exp(17.27 * tmin / (tmin + 237.3))) / 2
+    delta = 4098 * 0.6108 * np.exp(17.27 * tmean / (tmean + 237.3)) / (tmean + 237.3) ** 2
+
+    # extraterrestrial and clear sky radiation (MJ m-2 d-1)
+    phi = np.deg2rad(lat)
+    dr = 1 + 0.033 * np.cos(2 * np.pi * doy / 365)
+    sol_dec = 0.409 * np.sin(2 * np.pi * doy / 365 - 1.39)
+    ws = np.arccos(np.clip(-np.tan(phi) * np.tan(sol_dec), -1, 1))
+    ra = 24 * 60 / np.pi * 0.0820 * dr * (ws * np.sin(phi) * np.sin(sol_dec) + np.cos(phi) * np.cos(sol_dec) * np.sin(ws))
+    rso = (0.75 + 2e-5 * elevation) * ra
+
+    # net radiation
+    rs_rso = np.divide(radn, rso, out=np.ones(np.broadcast(radn, rso).shape), where=rso > 0)
+    rnl = (4.903e-9 * ((tmax + 273.16) ** 4 + (tmin + 273.16) ** 4) / 2 * (0.34 - 0.14 * np.sqrt(vpa))
+           * (1.35 * np.minimum(rs_rso, 1.) - 0.35))
+    rn = (1 - 0.23) * radn - rnl
+
+    out = np.divide(0.408 * delta * rn + gamma * 900 / (tmean + 273) * wind_2m * (es - vpa),
+                    delta + gamma * (1 + 0.34 * wind_2m), out=out)
+    return out
+
+
+def prepare_weather(year, doy, tmin, tmax, rain, radn, rh=None, wind=None, wind_height=2., max_irr=10., irr_trig=0.,
+                    irr_targ=1., supply_pet=False, pet=None, lat=None, elevation=0., fill_missing=True):
+    """
+    build the packed weather for many sites in one pass.  vpa and 2 m wind (penman mode) or pet (pet mode) are
+    calculated in place in the packed array, missing values are forward filled per site (after the derived
+    variables are calculated, as in check_basgra_python.support_for_tests.establish_peyman_input)
+
+    :param year: (day,) year of each day, shared by all sites
+    :param doy: (day,) day of year of each day, shared by all sites
+    :param tmin: (site, day) min temperature (degrees c)
+    :param tmax: (site, day) max temperature (degrees c)
+    :param rain: (site, day) rainfall (mm)
+    :param radn: (site, day) daily solar radiation (MJ/m2)
+    :param rh: (site, day) relative humidity (%, 0-100), needed for the vapour pressure
+    :param wind: (site, day) wind speed (m s-1) measured at wind_height
+    :param wind_height: height of the wind measurement (m), scalar or one value per site
+    :param max_irr: maximum irrigation (mm/d), scalar, (day,) or (site, day)
+    :param irr_trig: irrigation trigger (fraction), scalar, (day,) or (site, day)
+    :param irr_targ: irrigation target (fraction), scalar, (day,) or (site, day)
+    :param supply_pet: boolean, if True pack for the pet version of BASGRA (matrix_weather_keys_pet) otherwise
+                       pack for the penman version (matrix_weather_keys_penman)
+    :param pet: None or (site, day) pet (mm), only used if supply_pet, if None the FAO-56 reference pet is
+                calculated from the weather (requires rh, wind and lat)
+    :param lat: latitude (degrees north), scalar or one value per site, only needed to calculate pet
+    :param elevation: elevation (m), scalar or one value per site, only used to calculate pet
+    :param fill_missing: boolean, if True forward fill missing values along the day axis
+    :return: packed float array (site, day, n_weather)
+    """
+    tmin = np.atleast_2d(np.asarray(tmin, dtype=float))
+    nsites, ndays = tmin.shape
+    year = np.asarray(year)
+    doy = np.asarray(doy)
+    if year.shape != (ndays,) or doy.shape != (ndays,):
+        raise ValueError('year and doy must be 1d arrays with one value per day ({})'.format(ndays))
+
+    keys = matrix_weather_keys_pet if supply_pet else matrix_weather_keys_penman
+    out = np.empty((nsites, ndays, len(keys)), dtype=float)
+    col = {k: out[:, :, i] for i, k in enumerate(keys)}
+
+    col['year'][:] = year
+    col['doy'][:] = doy
+    col['tmin'][:] = tmin
+    col['tmax'][:] = tmax
+    col['rain'][:] = rain
+    col['radn'][:] = radn
+    col['max_irr'][:] = max_irr
+    col['irr_trig'][:] = irr_trig
+    col['irr_targ'][:] = irr_targ
+
+    need_humidity = not supply_pet or pet is None
+    if need_humidity and (rh is None or wind is None):
+        raise ValueError('rh and wind must be passed to calculate vpa/wind or pet')
+
+    if need_humidity:
+        vpa = col['vpa'] if 'vpa' in col else np.empty((nsites, ndays))
+        wind_2m = col['wind'] if 'wind' in col else np.empty((nsites, ndays))
+        calc_vpa(rh, col['tmin'], col['tmax'], out=vpa)
+        calc_wind_2m(wind, wind_height, out=wind_2m)
+
+    if supply_pet:
+        if pet is not None:
+            col['pet'][:] = pet
+        else:
+            if lat is None:
+                raise ValueError('lat must be passed to calculate pet')
+            calc_reference_pet(col['tmin'], col['tmax'], col['radn'], vpa, wind_2m, doy, lat, elevation,
+                               out=col['pet'])
+
+    if fill_missing:
+        for k in keys:
+            col[k][:] = ffill_days(col[k])
+
+    if np.isnan(out).any():
+        bad = [k for k in keys if np.isnan(col[k]).any()]
+        raise ValueError('missing values remain in {} (missing values at the start of a series cannot be forward '
+                         'filled)'.format(bad))
+
+    return out
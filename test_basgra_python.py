@@ -5,10 +5,11 @@
 import os
 import numpy as np
 import pandas as pd
-from basgra_python import run_basgra_nz, _trans_manual_harv
+from basgra_python import run_basgra_nz
 from input_output_keys import matrix_weather_keys_pet
 from check_basgra_python.support_for_tests import establish_org_input, get_org_correct_values, get_lincoln_broadfield, \
-    test_dir, establish_peyman_input, _clean_harvest, base_auto_harvest_data, base_manual_harvest_data
+    test_dir, establish_peyman_input, _clean_harvest, base_auto_harvest_data, base_manual_harvest_data, \
+    _trans_manual_harv
 
 from supporting_functions.plotting import plot_multiple_results  # used in test development and debugging
 